@@ -0,0 +1,165 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+# Latency and payload knobs (milliseconds, words, bytes)
+DEFAULT_LATENCY = {
+    "chat_first_token_ms": 350,   # OpenAI chat: time to the first streamed token
+    "chat_token_ms": 25,          # ... then per token
+    "reply_words": 30,            # words in every reply
+    "stt_ms": 450,                # OpenAI transcription round-trip
+    "tts_first_byte_ms": 250,     # Deepgram speak: time to the first audio byte
+    "tts_bytes_per_char": 400,    # MP3 bytes per character of text (~48 kbps speech)
+    "tts_bytes_per_sec": 96000,   # how fast Deepgram sends audio once started
+}
+
+REPLY = ("That is a great answer! Can you tell me more about it? What is your favourite colour, "
+         "and what do you like to do after school with your friends? Let's practice some new words today.")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Local imitation of the OpenAI and Deepgram endpoints TalkyBuddy uses:
+
+    POST /v1/chat/completions     streamed (SSE) or plain replies
+    POST /v1/audio/transcriptions a fixed transcript
+    POST /v1/speak                chunked MP3-sized bytes (Deepgram)
+    HEAD any path                 for connection pre-warming
+    """
+
+    protocol_version = "HTTP/1.1"
+    latency = DEFAULT_LATENCY  # replaced per server by start_standins()
+    transcript = "Hello Buddy, I like to play football."
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlparse(self.path).path
+        try:
+            if path.endswith("/chat/completions"):
+                self._chat(json.loads(body))
+            elif path.endswith("/audio/transcriptions"):
+                self._transcription()
+            elif path.endswith("/speak"):
+                self._speak(json.loads(body))
+            else:
+                self._json(404, {"error": "not found"})
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # the client stopped reading (e.g. playback was interrupted)
+
+    def _chat(self, request):
+        words = (REPLY.split() * 4)[:self.latency["reply_words"]]
+        model = request.get("model", "gpt-4o-mini")
+        time.sleep(self.latency["chat_first_token_ms"] / 1000)
+        if not request.get("stream"):
+            time.sleep(self.latency["chat_token_ms"] * len(words) / 1000)
+            self._json(200, {
+                "id": "chatcmpl-standin", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            })
+            return
+
+        self._start_chunked(200, "text/event-stream")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.latency["chat_token_ms"] / 1000)
+            chunk = {"id": "chatcmpl-standin", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word},
+                                                  "finish_reason": None}]}
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _transcription(self):
+        time.sleep(self.latency["stt_ms"] / 1000)
+        self._json(200, {"text": self.transcript, "language": "english", "duration": 1.0, "segments": [
+            {"id": 0, "seek": 0, "start": 0.0, "end": 1.0, "text": self.transcript, "tokens": [],
+             "temperature": 0.0, "avg_logprob": -0.2, "compression_ratio": 1.0, "no_speech_prob": 0.01}]})
+
+    def _speak(self, request):
+        size = max(1, len(request.get("text", ""))) * self.latency["tts_bytes_per_char"]
+        time.sleep(self.latency["tts_first_byte_ms"] / 1000)
+        self._start_chunked(200, "audio/mpeg")
+        chunk = 4096
+        for sent in range(0, size, chunk):
+            n = min(chunk, size - sent)
+            self._chunk(b"\xff" * n)
+            time.sleep(n / self.latency["tts_bytes_per_sec"])
+        self._chunk(b"")
+
+    def _start_chunked(self, status, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standins(latency=None, host="127.0.0.1", port=0):
+    """
+    Starts the stand-in server on a background thread.
+
+    Args:
+        latency: Overrides for DEFAULT_LATENCY
+        port: 0 picks a free port
+
+    Returns:
+        (server, base URL); point OpenAI at f"{url}/v1" and Deepgram at f"{url}/v1/speak".
+        Call server.shutdown() when done.
+    """
+    settings = dict(DEFAULT_LATENCY, **(latency or {}))
+    handler = type("Handler", (StandInHandler,), {"latency": settings})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def parse_overrides(pairs):
+    """Turns ["chat_first_token_ms=500", ...] into latency overrides."""
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        if key not in DEFAULT_LATENCY:
+            raise ValueError(f"Unknown setting '{key}' (choose from {', '.join(DEFAULT_LATENCY)})")
+        overrides[key] = float(value) if "." in value else int(value)
+    return overrides
+
+
+if __name__ == "__main__":
+    # python api_standins.py --port 8800 --set chat_first_token_ms=600 --set stt_ms=300
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stand-ins for the OpenAI and Deepgram APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="latency/payload setting")
+    args = parser.parse_args()
+
+    server, url = start_standins(parse_overrides(args.set), args.host, args.port)
+    print(f"🧪 Stand-in APIs on {url} (OpenAI base_url {url}/v1, Deepgram {url}/v1/speak)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
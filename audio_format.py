@@ -0,0 +1,131 @@
+import io
+import wave
+import struct
+import numpy as np
+
+WHISPER_RATE = 16000
+
+
+def as_mono_float32(audio):
+    """
+    Returns audio as a 1-D contiguous float32 array for Whisper.
+
+    Arrays that already are float32 and contiguous (including the (N, 1)
+    arrays sounddevice records) come back as a view, without copying.
+    """
+    audio = np.asarray(audio)
+    if audio.ndim == 2:
+        audio = audio[:, 0] if audio.shape[1] >= 1 else audio.reshape(-1)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+def wav_file(audio, rate=WHISPER_RATE, name="speech.wav"):
+    """
+    Encodes audio as an in-memory 16-bit WAV for APIs that need a file upload.
+
+    Returns a (filename, bytes) tuple accepted by the OpenAI client.
+    """
+    pcm = (np.clip(as_mono_float32(audio), -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return name, buf.getvalue()
+
+
+# WAV format tags
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def decode_wav(buffer):
+    """
+    Decodes a RIFF/WAVE payload (e.g. from st.audio_input) into mono float32.
+
+    The header chunks are parsed so they are never mistaken for samples, and
+    the PCM data is viewed in place with np.frombuffer; float32 mono payloads
+    are returned without any copy.
+
+    Args:
+        buffer: bytes, bytearray or memoryview holding the whole WAV file
+
+    Returns:
+        (audio, sample_rate) where audio is a 1-D float32 array
+    """
+    view = memoryview(buffer).cast("B")
+    if len(view) < 12 or bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE payload")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        size = struct.unpack_from("<I", view, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            if size < 16 or body + 16 > len(view):
+                raise ValueError("Truncated WAV fmt chunk")
+            tag, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", view, body)
+            if not channels or not rate or bits % 8:
+                raise ValueError(f"Invalid WAV format ({channels} channels, {rate} Hz, {bits} bits)")
+            if tag == _WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                # Real format tag is the first two bytes of the sub-format GUID
+                tag = struct.unpack_from("<H", view, body + 24)[0]
+            fmt = (tag, channels, rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            # Streaming recorders may leave the size as 0 or 0xFFFFFFFF
+            end = len(view) if size in (0, 0xFFFFFFFF) else min(body + size, len(view))
+            return _pcm_to_float32(view, body, end, *fmt)
+        offset = body + size + (size & 1)  # chunks are word-aligned
+
+    raise ValueError("WAV payload has no data chunk")
+
+
+def _pcm_to_float32(view, start, end, tag, channels, rate, bits):
+    if tag == _WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        dtype, scale, bias = "<f4", 1.0, 0.0
+    elif tag == _WAVE_FORMAT_PCM and bits == 16:
+        dtype, scale, bias = "<i2", 1.0 / 32768, 0.0
+    elif tag == _WAVE_FORMAT_PCM and bits == 32:
+        dtype, scale, bias = "<i4", 1.0 / 2147483648, 0.0
+    elif tag == _WAVE_FORMAT_PCM and bits == 8:
+        dtype, scale, bias = "u1", 1.0 / 128, -1.0
+    else:
+        raise ValueError(f"Unsupported WAV encoding (format {tag}, {bits} bits)")
+
+    frame_size = bits // 8 * channels
+    count = (end - start) // frame_size * channels
+    samples = np.frombuffer(view, dtype=dtype, count=count, offset=start)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+    if samples.dtype == np.float32 and scale == 1.0:
+        return samples, rate
+    audio = samples.astype(np.float32)
+    audio *= scale
+    if bias:
+        audio += bias
+    return audio, rate
+
+
+def resample(audio, orig_rate, target_rate=WHISPER_RATE):
+    """
+    Resamples mono float32 audio with a vectorized windowed-sinc low-pass
+    and linear interpolation. Returns the input untouched when the rates match.
+    """
+    if orig_rate == target_rate or len(audio) == 0:
+        return audio
+    audio = np.asarray(audio, dtype=np.float32)
+    if target_rate < orig_rate:
+        # Anti-aliasing filter at the new Nyquist frequency
+        cutoff = target_rate / orig_rate / 2
+        taps = np.arange(-32, 33)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+        audio = np.convolve(audio, (kernel / kernel.sum()).astype(np.float32), mode="same")
+    length = int(round(len(audio) * target_rate / orig_rate))
+    positions = np.arange(length, dtype=np.float64) * (orig_rate / target_rate)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
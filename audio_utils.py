@@ -0,0 +1,336 @@
+import queue
+import threading
+import collections
+import numpy as np
+
+try:
+    import sounddevice as sd
+except (ImportError, OSError):  # no PortAudio: VAD helpers still work on recorded audio
+    sd = None
+
+# Input device found by get_input_device(), looked up once per session
+_input_device = None
+
+
+def get_input_device(refresh=False):
+    """
+    Returns (index, name) of the first device with input channels, or None.
+    The device list is only queried once per session unless refresh is set.
+    """
+    global _input_device
+    if _input_device is None or refresh:
+        _input_device = None
+        for i, device in enumerate(sd.query_devices()):
+            if device['max_input_channels'] > 0:
+                _input_device = (i, device['name'])
+                break
+    return _input_device
+
+
+def frame_energy(frame):
+    """Returns the RMS energy of a mono float32 frame."""
+    if frame.size == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(np.square(frame, dtype=np.float32))))
+
+
+class Endpointer:
+    """
+    Energy-based voice activity detector working on fixed-size frames.
+
+    A frame counts as speech when its RMS energy is above the threshold
+    (fixed, or estimated from the background noise in the first frames).
+    push() returns "onset" once `min_speech` seconds of speech are seen and
+    "end" once `hangover` seconds of silence follow speech.
+    """
+
+    def __init__(self, frame_ms=30, hangover=0.8, threshold=None, min_speech=0.15, calibrate=0.2):
+        self.threshold = threshold
+        self.hangover_frames = max(1, int(hangover * 1000 / frame_ms))
+        self.onset_frames = max(1, int(min_speech * 1000 / frame_ms))
+        self.calib_frames = 0 if threshold is not None else max(1, int(calibrate * 1000 / frame_ms))
+        self.reset()
+
+    def reset(self):
+        """Starts listening for a new utterance (keeps the calibrated threshold)."""
+        self.speaking = False
+        self._noise = []
+        self._run = 0
+        self._silence = 0
+
+    def push(self, frame):
+        energy = frame_energy(frame)
+
+        if self.threshold is None:
+            self._noise.append(energy)
+            if len(self._noise) < self.calib_frames:
+                return None
+            # Speech has to stand clearly above the background noise
+            self.threshold = max(0.01, 3.0 * float(np.median(self._noise)))
+            return None
+
+        if not self.speaking:
+            self._run = self._run + 1 if energy > self.threshold else 0
+            if self._run >= self.onset_frames:
+                self.speaking = True
+                self._silence = 0
+                return "onset"
+            return None
+
+        self._silence = self._silence + 1 if energy <= self.threshold else 0
+        if self._silence >= self.hangover_frames:
+            self.speaking = False
+            self._run = 0
+            return "end"
+        return None
+
+
+def record_until_silence(rate=16000, max_duration=10, hangover=0.8, frame_ms=30,
+                         start_timeout=5, threshold=None, pre_roll=0.3,
+                         min_speech=0.15, device=None, input_stream=None):
+    """
+    Records from the microphone until the speaker stops talking.
+
+    Audio is read in small frames from a streaming input and passed through
+    an Endpointer. Recording ends once `hangover` seconds of silence follow
+    speech, or after `max_duration`.
+
+    Args:
+        rate: Sample rate in Hz
+        max_duration: Hard limit on the recording length in seconds
+        hangover: Seconds of trailing silence that end the utterance
+        frame_ms: VAD frame size in milliseconds
+        start_timeout: Give up if no speech starts within this many seconds
+        threshold: Fixed RMS threshold, or None to calibrate from noise
+        pre_roll: Seconds of audio kept from before speech onset
+        min_speech: Seconds of consecutive speech needed to trigger onset
+        device: sounddevice input device (None means system default)
+        input_stream: Replacement for sd.InputStream with the same arguments
+            (e.g. a recording replayed by benchmark.py)
+
+    Returns:
+        1-D float32 array (empty if no speech was detected)
+    """
+    frame_len = int(rate * frame_ms / 1000)
+    max_frames = int(max_duration * 1000 / frame_ms)
+    start_frames = int(start_timeout * 1000 / frame_ms)
+    vad = Endpointer(frame_ms=frame_ms, hangover=hangover, threshold=threshold, min_speech=min_speech)
+
+    frames = queue.Queue()
+
+    def callback(indata, frame_count, time_info, status):
+        frames.put(indata[:, 0].copy())
+
+    pre = collections.deque(maxlen=max(1, int(pre_roll * 1000 / frame_ms)) + vad.onset_frames)
+    voiced = []
+
+    with (input_stream or sd.InputStream)(samplerate=rate, channels=1, dtype='float32',
+                                          blocksize=frame_len, device=device, callback=callback):
+        for n in range(max_frames):
+            frame = frames.get()
+            event = vad.push(frame)
+
+            if not voiced:
+                pre.append(frame)
+                if event == "onset":
+                    voiced.extend(pre)
+                elif n >= start_frames:
+                    break
+                continue
+
+            voiced.append(frame)
+            if event == "end":
+                break
+
+    if not voiced:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(voiced)
+
+
+def record_utterance(mic, vad, since=None, max_duration=8, start_timeout=5, pre_roll=0.3):
+    """
+    Reads one utterance from a running MicStream, endpointed by `vad`.
+
+    Like record_until_silence, but on the persistent stream: no second input
+    stream is opened, and the utterance can start at an earlier position.
+
+    Args:
+        mic: Started MicStream
+        vad: Endpointer for the mic's frame size (reset here, keeps its threshold)
+        since: MicStream position to start from instead of now, e.g. where
+            the child started talking over Buddy
+        max_duration: Hard limit on the utterance length in seconds
+        start_timeout: Give up if no speech starts within this many seconds
+        pre_roll: Seconds of audio kept from before speech onset
+
+    Returns:
+        1-D float32 array (empty if no speech was detected)
+    """
+    vad.reset()
+    listen_from = mic.position if since is None else since
+    start = end = None
+    for pos, frame in mic.frames(listen_from):
+        event = vad.push(frame)
+        end = pos + len(frame)
+
+        if start is None:
+            if event == "onset":
+                start = max(listen_from, end - int(pre_roll * mic.rate) - vad.onset_frames * len(frame))
+            elif end - listen_from >= start_timeout * mic.rate:
+                break
+            continue
+
+        if event == "end" or end - start >= max_duration * mic.rate:
+            break
+
+    if start is None:
+        return np.zeros(0, dtype=np.float32)
+    return mic.read(start, end)
+
+
+class MicStream:
+    """
+    Persistent microphone input feeding a ring buffer.
+
+    The stream is opened once and kept running, so each turn only reads the
+    samples it needs instead of re-opening the device. Positions are absolute
+    sample counts since start(); only the last `seconds` are kept.
+    """
+
+    def __init__(self, rate=16000, seconds=30, frame_ms=30, device=None):
+        self.rate = rate
+        self.frame_len = int(rate * frame_ms / 1000)
+        self.device = device
+        self._ring = np.zeros(int(rate * seconds), dtype=np.float32)
+        self._total = 0
+        self._cond = threading.Condition()
+        self._stream = None
+
+    def _callback(self, indata, frame_count, time_info, status):
+        data = indata[:, 0]
+        size = len(self._ring)
+        with self._cond:
+            start = self._total % size
+            first = min(len(data), size - start)
+            self._ring[start:start + first] = data[:first]
+            self._ring[:len(data) - first] = data[first:]
+            self._total += len(data)
+            self._cond.notify_all()
+
+    def start(self):
+        if self._stream is None:
+            self._stream = sd.InputStream(samplerate=self.rate, channels=1, dtype='float32',
+                                          blocksize=self.frame_len, device=self.device,
+                                          callback=self._callback)
+            self._stream.start()
+        return self
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def position(self):
+        """Number of samples captured so far."""
+        with self._cond:
+            return self._total
+
+    def read(self, start, end):
+        """Returns a copy of samples [start, end), clipped to what the ring still holds."""
+        size = len(self._ring)
+        with self._cond:
+            start = max(start, self._total - size, 0)
+            end = min(end, self._total)
+            if end <= start:
+                return np.zeros(0, dtype=np.float32)
+            idx = np.arange(start, end) % size
+            return self._ring[idx]
+
+    def frames(self, start=None, timeout=2.0):
+        """Yields (position, frame) for consecutive frames from `start` onwards, as they arrive."""
+        pos = self.position if start is None else start
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._total >= pos + self.frame_len, timeout):
+                    return
+            yield pos, self.read(pos, pos + self.frame_len)
+            pos += self.frame_len
+
+
+class BargeInDetector:
+    """
+    Watches a MicStream while Buddy is talking and fires when the child starts speaking.
+
+    The microphone also hears Buddy through the speakers, so the threshold
+    is `margin` times the usual speech threshold and speech has to last
+    `min_speech` seconds (headphones make this much more reliable). After
+    firing, `position` is where the child's speech started (minus pre-roll),
+    so the utterance can be transcribed from the ring buffer without losing
+    its first words.
+
+    Args:
+        mic: Started MicStream
+        threshold: Fixed RMS threshold, or None to calibrate from the first frames
+        margin: Multiplier on the calibrated threshold to reject speaker echo
+        min_speech: Seconds of consecutive speech needed to interrupt
+        pre_roll: Seconds of audio kept from before speech onset
+    """
+
+    def __init__(self, mic, threshold=None, margin=2.0, min_speech=0.3, pre_roll=0.3):
+        self.mic = mic
+        self.threshold = threshold
+        self.margin = margin
+        self.min_speech = min_speech
+        self.pre_roll = int(pre_roll * mic.rate)
+        self.position = None
+        self._lock = threading.Lock()
+        self._active = False
+
+    @property
+    def triggered(self):
+        return self.position is not None
+
+    def start(self, on_speech):
+        """Starts watching from the current position; on_speech() is called (once) on speech onset."""
+        with self._lock:
+            self.position = None
+            self._active = True
+        threading.Thread(target=self._watch, args=(on_speech,), daemon=True).start()
+
+    def stop(self):
+        """Stops watching; triggered and position keep their values."""
+        with self._lock:
+            self._active = False
+
+    def _watch(self, on_speech):
+        frame_ms = self.mic.frame_len * 1000 / self.mic.rate
+        vad = Endpointer(frame_ms=frame_ms, threshold=self.threshold, min_speech=self.min_speech)
+        scaled = self.threshold is not None
+        pos = self.mic.position
+        while self._active:
+            for pos, frame in self.mic.frames(pos, timeout=0.5):
+                if not self._active:
+                    return
+                event = vad.push(frame)
+                if not scaled and vad.threshold is not None:
+                    vad.threshold *= self.margin
+                    scaled = True
+                if event == "onset":
+                    start = pos + len(frame) - vad.onset_frames * len(frame) - self.pre_roll
+                    with self._lock:
+                        if not self._active:
+                            return
+                        self._active = False
+                        self.position = max(0, start)
+                    on_speech()
+                    return
+            else:
+                pos = self.mic.position  # stream stalled; resume at the live edge
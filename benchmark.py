@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from functools import partial
+from collections import defaultdict
+import numpy as np
+from api_standins import DEFAULT_LATENCY, start_standins, parse_overrides
+from audio_format import WHISPER_RATE
+from audio_utils import record_until_silence
+from bulk_transcribe import load_audio
+from conversation_memory import ConversationMemory
+from http_clients import get_openai_client
+from pipeline import Pipeline, Stage, run_turns
+from reply_stream import reply_sentences
+from stt_backends import APIBackend, load_backend, warm_up
+from tts import open_deepgram_stream, play_stream
+
+# Per-turn stages first, then the per-sentence ones, then the end-to-end numbers
+STAGES = ["capture", "stt", "llm_first_token", "llm_total", "tts_first_byte", "playback", "ttfa", "turn_total"]
+
+SYSTEM_PROMPT = "You are a patient, friendly English teacher for kids. Keep responses short and simple."
+MP3_BYTES_PER_SECOND = 6000  # Deepgram's default 48 kbps MP3
+
+
+class ReplayStream:
+    """
+    Stands in for sd.InputStream, feeding a recording to the callback frame
+    by frame (in real time unless `realtime` is False) and silence after it.
+    """
+
+    def __init__(self, audio, realtime=True, samplerate=WHISPER_RATE, blocksize=480, callback=None, **kwargs):
+        self.audio = audio
+        self.realtime = realtime
+        self.rate = samplerate
+        self.blocksize = blocksize
+        self.callback = callback
+        self._stop = threading.Event()
+
+    def _feed(self):
+        pos = 0
+        next_frame = time.perf_counter()
+        while not self._stop.is_set():
+            frame = self.audio[pos:pos + self.blocksize]
+            if len(frame) < self.blocksize:
+                frame = np.pad(frame, (0, self.blocksize - len(frame)))
+            pos += self.blocksize
+            self.callback(frame.reshape(-1, 1), self.blocksize, None, None)
+            if self.realtime:
+                next_frame += self.blocksize / self.rate
+                self._stop.wait(max(0.0, next_frame - time.perf_counter()))
+
+    def __enter__(self):
+        threading.Thread(target=self._feed, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+
+
+class TimingSink:
+    """Playback sink that notes when audio first reaches it and drains at the MP3 byte rate."""
+
+    def __init__(self, turn, realtime=True):
+        self.turn = turn
+        self.realtime = realtime
+
+    def write(self, chunk):
+        self.turn.setdefault("first_audio", time.perf_counter())
+        if self.realtime:
+            time.sleep(len(chunk) / MP3_BYTES_PER_SECOND)
+
+    def close(self):
+        pass
+
+
+def load_fixture(path, lead=0.5, tail=1.5):
+    """
+    Loads a recording padded with room noise before (for VAD calibration) and
+    after (to end the utterance), as loud as the quietest part of the recording.
+    """
+    audio = load_audio(path)
+    frames = audio[:len(audio) // 480 * 480].reshape(-1, 480)
+    noise = max(1e-4, float(np.percentile(np.sqrt(np.mean(np.square(frames), axis=1)), 10)))
+    rng = np.random.default_rng(0)
+    before = (rng.standard_normal(int(lead * WHISPER_RATE)) * noise).astype(np.float32)
+    after = (rng.standard_normal(int(tail * WHISPER_RATE)) * noise).astype(np.float32)
+    return np.concatenate([before, audio, after])
+
+
+def run_turn(audio, stt, client, deepgram_url, samples, realtime=True):
+    """Replays one recording through capture → STT → chat → TTS → playback and records stage timings."""
+    turn = {}
+    memory = ConversationMemory(SYSTEM_PROMPT)
+
+    def listen(fixture):
+        started = time.perf_counter()
+        recorded = record_until_silence(input_stream=partial(ReplayStream, fixture, realtime))
+        turn["capture_end"] = time.perf_counter()
+        samples["capture"].append(turn["capture_end"] - started)
+        return recorded if len(recorded) else None
+
+    def transcribe(recorded):
+        started = time.perf_counter()
+        text = stt.transcribe(recorded)["text"]
+        samples["stt"].append(time.perf_counter() - started)
+        return text or None
+
+    def think(text):
+        started = time.perf_counter()
+
+        def first_token(piece):
+            if "llm_first_token" not in turn:
+                turn["llm_first_token"] = time.perf_counter()
+                samples["llm_first_token"].append(turn["llm_first_token"] - started)
+
+        yield from reply_sentences(client, memory, text, on_text=first_token)
+        samples["llm_total"].append(time.perf_counter() - started)
+
+    def synthesize(sentence):
+        started = time.perf_counter()
+        response = open_deepgram_stream(sentence, "standin", url=deepgram_url)
+        # Deepgram sends its headers with the first audio bytes
+        samples["tts_first_byte"].append(time.perf_counter() - started)
+        return response
+
+    def play(response):
+        started = time.perf_counter()
+        play_stream(response, sink=TimingSink(turn, realtime))
+        samples["playback"].append(time.perf_counter() - started)
+
+    pipeline = Pipeline(
+        Stage("listen", listen),
+        Stage("transcribe", transcribe),
+        Stage("think", think),
+        Stage("synthesize", synthesize, workers=2),
+        Stage("play", play),
+    )
+    run_turns(pipeline, [audio])
+    if "first_audio" in turn:
+        samples["ttfa"].append(turn["first_audio"] - turn["capture_end"])
+        samples["turn_total"].append(time.perf_counter() - turn["capture_end"])
+
+
+def summarize(samples):
+    """p50/p95/p99/mean per stage, in milliseconds."""
+    stages = {}
+    for stage in STAGES:
+        values = np.array(samples.get(stage, [])) * 1000
+        if not len(values):
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        stages[stage] = {"n": len(values), "p50": round(float(p50), 1), "p95": round(float(p95), 1),
+                         "p99": round(float(p99), 1), "mean": round(float(values.mean()), 1)}
+    return stages
+
+
+def compare(stages, baseline, tolerance=0.2, floor_ms=5.0):
+    """Lists stages whose p50 or p95 got slower than the baseline by more than `tolerance` (and `floor_ms`)."""
+    regressions = []
+    for stage, old in baseline.get("stages", {}).items():
+        new = stages.get(stage)
+        if new is None:
+            continue
+        for key in ("p50", "p95"):
+            if new[key] > old[key] * (1 + tolerance) and new[key] - old[key] > floor_ms:
+                regressions.append(f"{stage} {key}: {old[key]:.1f} → {new[key]:.1f} ms")
+    return regressions
+
+
+def print_report(stages):
+    print(f"\n{'stage':<16}{'n':>5}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}   (ms)")
+    for stage, s in stages.items():
+        print(f"{stage:<16}{s['n']:>5}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}{s['mean']:>10.1f}")
+
+
+if __name__ == "__main__":
+    # python benchmark.py input.wav --runs 10 --output bench.json [--compare baseline.json]
+    parser = argparse.ArgumentParser(description="Per-stage latency of a full TalkyBuddy turn against local API stand-ins")
+    parser.add_argument("fixtures", nargs="*", help="recordings to replay (default: input.wav)")
+    parser.add_argument("--runs", type=int, default=5, help="turns per fixture")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed turns first (connections, caches)")
+    parser.add_argument("--engine", default="api", help="api (stand-in) or a local engine: whisper, faster-whisper")
+    parser.add_argument("--model", default="base", help="local Whisper model")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help=f"stand-in latency/payload setting ({', '.join(DEFAULT_LATENCY)})")
+    parser.add_argument("--fast", action="store_true", help="replay and play back as fast as possible")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="fail if slower than an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown for --compare (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    fixtures = args.fixtures or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "input.wav")]
+    latency = dict(DEFAULT_LATENCY, **parse_overrides(args.set))
+    server, url = start_standins(latency)
+    client = get_openai_client("standin", base_url=f"{url}/v1")
+    if args.engine == "api":
+        stt = APIBackend(client)
+    else:
+        print(f"📦 Loading {args.engine} model '{args.model}'...")
+        stt = load_backend(args.engine, args.model)
+        warm_up(stt)
+
+    samples = defaultdict(list)
+    audios = [load_fixture(path) for path in fixtures]
+    for _ in range(args.warmup):
+        run_turn(audios[0], stt, client, f"{url}/v1/speak", defaultdict(list), realtime=not args.fast)
+    total = args.runs * len(audios)
+    for n in range(args.runs):
+        for i, audio in enumerate(audios):
+            print(f"⏱️  Turn {n * len(audios) + i + 1}/{total}", end="\r", flush=True)
+            run_turn(audio, stt, client, f"{url}/v1/speak", samples, realtime=not args.fast)
+    server.shutdown()
+
+    stages = summarize(samples)
+    print_report(stages)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"fixtures": fixtures, "runs": args.runs, "engine": args.engine, "realtime": not args.fast,
+                       "latency": latency, "stages": stages}, f, indent=2)
+        print(f"💾 Results saved to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(stages, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Slower than the baseline:\n   " + "\n   ".join(regressions))
+            sys.exit(1)
+        print("✅ No regressions against the baseline")
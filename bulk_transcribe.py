@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from audio_format import WHISPER_RATE, as_mono_float32, decode_wav, resample
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3")
+
+# Loaded once per worker process by _init_worker()
+_backend = None
+_load_error = None
+
+
+def find_audio(directory, extensions=AUDIO_EXTENSIONS):
+    """Returns the audio files under `directory` (recursively), as sorted relative paths."""
+    found = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(extensions):
+                found.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(found)
+
+
+def load_audio(path):
+    """Reads an audio file as 16 kHz mono float32 (WAV is parsed directly, other formats via soundfile)."""
+    if path.lower().endswith(".wav"):
+        with open(path, "rb") as f:
+            audio, rate = decode_wav(f.read())
+    else:
+        import soundfile as sf
+        audio, rate = sf.read(path, dtype="float32")
+    return resample(as_mono_float32(audio), rate, WHISPER_RATE)
+
+
+def completed(output):
+    """Paths already transcribed in an existing output file (the JSONL doubles as the checkpoint)."""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # last line cut short by an interrupted run
+            if "error" not in record:
+                done.add(record["path"])
+    return done
+
+
+def drop_partial_line(path):
+    """Truncates a file after its last newline, removing a record an interrupted run left half-written."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            step = min(4096, end)
+            f.seek(end - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                end -= step - newline - 1
+                break
+            end -= step
+        if end < size:
+            f.truncate(end)
+
+
+def _init_worker(engine, model_name, threads):
+    """Loads one model per process, limited to `threads` CPU threads so workers don't oversubscribe."""
+    global _backend, _load_error
+    try:
+        options = {}
+        if engine == "faster-whisper":
+            options["cpu_threads"] = threads
+        else:
+            import torch
+            torch.set_num_threads(threads)
+        from stt_backends import load_backend
+        _backend = load_backend(engine, model_name, **options)
+    except Exception as e:
+        # Raising here would make the pool restart the worker forever
+        _load_error = f"{type(e).__name__}: {e}"
+
+
+def _transcribe_file(job):
+    directory, path, language = job
+    if _load_error:
+        return {"path": path, "error": _load_error, "fatal": True}
+    started = time.perf_counter()
+    try:
+        audio = load_audio(os.path.join(directory, path))
+        result = _backend.transcribe(audio, language=language)
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+    return {
+        "path": path,
+        "text": result["text"],
+        "segments": result["segments"],
+        "language": result["language"],
+        "duration": round(len(audio) / WHISPER_RATE, 2),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def transcribe_directory(directory, output, workers=2, threads=1, engine="faster-whisper",
+                         model_name="base", language="en", offline=True):
+    """
+    Transcribes every audio file under `directory` into `output` (JSONL, one record per file).
+
+    Files are spread over `workers` processes, each with its own model and
+    `threads` CPU threads. Records are appended and flushed as they finish,
+    so an interrupted run resumes where it stopped; files that failed are
+    retried on the next run. With `offline`, models must already be cached
+    (or `model_name` must be a local model directory).
+
+    Returns:
+        (files transcribed, files failed, elapsed seconds)
+    """
+    files = find_audio(directory)
+    # New records are appended: they must not be glued onto a line cut short by a crash
+    drop_partial_line(output)
+    done = completed(output)
+    todo = [path for path in files if path not in done]
+    print(f"📂 {len(files)} files, {len(done)} already done, {len(todo)} to transcribe")
+    if not todo:
+        return 0, 0, 0.0
+
+    ok = failed = 0
+    audio_seconds = 0.0
+    started = time.perf_counter()
+    # Workers inherit the environment at spawn. Thread pools (OpenMP, BLAS) read it when numpy and
+    # torch are imported, which happens before _init_worker runs, so it is set here in the parent
+    for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(threads)
+    if offline:
+        os.environ["HF_HUB_OFFLINE"] = "1"  # faster-whisper: use cached models, never the network
+    # spawn: torch and CTranslate2 don't survive fork() with their thread pools running
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(engine, model_name, threads)) as pool, \
+            open(output, "a", encoding="utf-8") as out:
+        jobs = [(directory, path, language) for path in todo]
+        for record in pool.imap_unordered(_transcribe_file, jobs):
+            if record.get("fatal"):
+                print(f"❌ Could not load the {engine} model: {record['error']}")
+                pool.terminate()
+                return ok, failed, time.perf_counter() - started
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            elapsed = time.perf_counter() - started
+            if "error" in record:
+                failed += 1
+                print(f"❌ {record['path']}: {record['error']}")
+            else:
+                ok += 1
+                audio_seconds += record["duration"]
+            count = ok + failed
+            print(f"   {count}/{len(todo)}  {count / elapsed:.2f} files/sec  "
+                  f"{audio_seconds / elapsed:.1f}x real time", end="\r", flush=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ {ok} transcribed, {failed} failed in {elapsed:.1f}s "
+          f"({(ok + failed) / elapsed:.2f} files/sec)")
+    return ok, failed, elapsed
+
+
+if __name__ == "__main__":
+    # python bulk_transcribe.py recordings/ -o transcripts.jsonl --workers 4 --threads 2
+    parser = argparse.ArgumentParser(description="Transcribe a directory of recordings offline on CPU")
+    parser.add_argument("directory")
+    parser.add_argument("-o", "--output", default="transcripts.jsonl")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="processes, each with its own model")
+    parser.add_argument("--threads", type=int, default=2, help="CPU threads per process")
+    parser.add_argument("--engine", choices=["whisper", "faster-whisper"], default="faster-whisper")
+    parser.add_argument("--model", default="base", help="model size or local model directory")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--download", action="store_true", help="allow downloading a missing model")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        sys.exit(f"❌ Not a directory: {args.directory}")
+    transcribe_directory(args.directory, args.output, args.workers, args.threads,
+                         args.engine, args.model, args.language, offline=not args.download)
@@ -0,0 +1,195 @@
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character-based estimate
+    tiktoken = None
+
+# Per-message framing tokens in the chat format, plus reply priming
+_MESSAGE_OVERHEAD = 4
+_PRIMING = 3
+
+SUMMARY_PREFIX = "\n\nSummary of the conversation so far: "
+SUMMARY_PROMPT = ("Summarize this conversation between an English teacher and a child in a few short sentences. "
+                  "Keep the child's name, interests, mistakes to practice and what was last being discussed.")
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Counts tokens with tiktoken when installed, otherwise estimates ~4 characters per token."""
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def openai_summarizer(client, model="gpt-4o-mini", max_tokens=150):
+    """Returns a summarize(previous_summary, messages) function that uses the chat API."""
+    def summarize(previous, messages):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        if previous:
+            transcript = f"Earlier summary: {previous}\n\n{transcript}"
+        res = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT},
+                      {"role": "user", "content": transcript}],
+            max_tokens=max_tokens,
+        )
+        return res.choices[0].message.content.strip()
+    return summarize
+
+
+class ConversationMemory:
+    """
+    Conversation history with a hard prompt-size ceiling.
+
+    The prompt is the system prompt, a rolling summary of older turns, and
+    as many recent messages as fit in `max_prompt_tokens`. Messages that fall
+    out of the recent window are summarized on a background thread, off the
+    turn's critical path, once `summarize_batch` of them have piled up (one
+    summary call per batch, not per message); until then they are simply
+    left out, so the ceiling holds even while a summary is pending.
+
+    Args:
+        system_prompt: The teacher persona prompt
+        max_prompt_tokens: Ceiling for every prompt built by prompt()
+        recent_messages: Messages kept verbatim before older ones are summarized
+        summarize_batch: Messages to collect beyond the recent window per summary call
+                         (default: half the window)
+        summarize: Function (previous_summary, messages) -> summary, or None to just drop old turns
+        max_summary_tokens: Longest summary allowed into the prompt
+        model: Model name used for token counting
+    """
+
+    def __init__(self, system_prompt, max_prompt_tokens=1500, recent_messages=8,
+                 summarize=None, max_summary_tokens=200, model="gpt-4o-mini", summarize_batch=None):
+        self.system_prompt = system_prompt
+        self.max_prompt_tokens = max_prompt_tokens
+        self.recent_messages = recent_messages
+        self.summarize_batch = summarize_batch or max(1, recent_messages // 2)
+        self.summarize = summarize
+        self.max_summary_tokens = max_summary_tokens
+        self.model = model
+        self.prompt_tokens = []  # prompt size of every turn, for checking the ceiling
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.messages = []
+            self._summarizing = False
+            self._generation = getattr(self, "_generation", 0) + 1
+
+    @property
+    def generation(self):
+        """Changes on every clear(); pass it to add_user()/add_assistant() to drop messages of a cleared conversation."""
+        return self._generation
+
+    def add_user(self, text, generation=None):
+        """Adds what the child said; returns the message (None if dropped), for remove()."""
+        return self._add("user", text, generation)
+
+    def add_assistant(self, text, generation=None):
+        return self._add("assistant", text, generation)
+
+    def remove(self, message):
+        """Takes back a message returned by add_user()/add_assistant(), e.g. a question whose reply failed."""
+        with self._lock:
+            for i, m in enumerate(self.messages):
+                if m is message:
+                    del self.messages[i]
+                    return
+
+    def _add(self, role, text, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return None  # from a turn that started before clear()
+            message = {"role": role, "content": text}
+            self.messages.append(message)
+            overflow = len(self.messages) - self.recent_messages
+            start = self.summarize is not None and overflow >= self.summarize_batch and not self._summarizing
+            if start:
+                self._summarizing = True
+                old = self.messages[:overflow]
+                previous = self.summary
+                generation = self._generation
+        if start:
+            threading.Thread(target=self._summarize, args=(previous, old, generation), daemon=True).start()
+        elif self.summarize is None:
+            with self._lock:
+                del self.messages[:max(0, len(self.messages) - self.recent_messages)]
+        return message
+
+    def _summarize(self, previous, old, generation):
+        try:
+            summary = self.summarize(previous, old)
+        except Exception as e:
+            print(f"⚠️  Summary failed: {e}")
+            summary = None
+        with self._lock:
+            self._summarizing = False
+            if generation != self._generation:
+                return  # conversation was cleared meanwhile
+            if summary:
+                self.summary = self._truncate(summary, self.max_summary_tokens)
+                del self.messages[:len(old)]
+
+    def _truncate(self, text, limit):
+        if count_tokens(text, self.model) <= limit:
+            return text
+        words = text.split()
+        while words and count_tokens(" ".join(words), self.model) > limit:
+            words = words[:max(1, len(words) * 3 // 4)] if len(words) > 1 else []
+        return " ".join(words)
+
+    def _message_tokens(self, message):
+        return count_tokens(message["content"], self.model) + _MESSAGE_OVERHEAD
+
+    def prompt(self):
+        """
+        Builds the messages to send this turn, within the ceiling as long as the
+        system prompt alone fits in it. The newest message is always included
+        (shortened if it alone is too long); the summary gets what's left after
+        the system prompt and the newest message, and is shortened or dropped
+        to fit.
+        """
+        with self._lock:
+            summary = self.summary
+            messages = list(self.messages[-self.recent_messages:])
+
+        system = self.system_prompt
+        if summary:
+            room = (self.max_prompt_tokens - _PRIMING - self._message_tokens({"content": system})
+                    - count_tokens(SUMMARY_PREFIX, self.model)
+                    - (self._message_tokens(messages[-1]) if messages else 0))
+            summary = self._truncate(summary, room) if room > 0 else ""
+            if summary:
+                system = f"{system}{SUMMARY_PREFIX}{summary}"
+
+        head = {"role": "system", "content": system}
+        budget = self.max_prompt_tokens - _PRIMING - self._message_tokens(head)
+        chosen = []
+        for message in reversed(messages):
+            cost = self._message_tokens(message)
+            if cost > budget:
+                if not chosen:
+                    text = self._truncate(message["content"], max(1, budget - _MESSAGE_OVERHEAD))
+                    chosen.append({"role": message["role"], "content": text})
+                break
+            chosen.append(message)
+            budget -= cost
+
+        prompt = [head] + chosen[::-1]
+        self.prompt_tokens.append(self.count(prompt))
+        return prompt
+
+    def count(self, messages):
+        """Token count of a list of chat messages."""
+        return _PRIMING + sum(self._message_tokens(m) for m in messages)
+
+    @property
+    def last_prompt_tokens(self):
+        return self.prompt_tokens[-1] if self.prompt_tokens else 0
@@ -0,0 +1,90 @@
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI
+
+DEEPGRAM_HOST = "https://api.deepgram.com"
+OPENAI_HOST = "https://api.openai.com"
+
+# Connections kept alive per host; override with configure_pools() before first use
+POOL_SIZES = {DEEPGRAM_HOST: 8, OPENAI_HOST: 8}
+
+_lock = threading.Lock()
+_session = None
+_openai_clients = {}
+_httpx_client = None
+
+
+def configure_pools(sizes):
+    """
+    Sets keep-alive pool sizes per host, e.g. {"https://api.deepgram.com": 16}.
+    Only affects clients created after the call.
+    """
+    POOL_SIZES.update(sizes)
+
+
+def get_session():
+    """
+    Returns the process-wide requests.Session used for Deepgram.
+    Connections are kept alive and reused, so only the first request to a
+    host pays for DNS, TCP and TLS setup.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            for host, size in POOL_SIZES.items():
+                session.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=size))
+            _session = session
+        return _session
+
+
+def _get_httpx_client():
+    global _httpx_client
+    if _httpx_client is None:
+        size = POOL_SIZES.get(OPENAI_HOST, 8)
+        _httpx_client = httpx.Client(
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=120),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+    return _httpx_client
+
+
+def get_openai_client(api_key, base_url=None):
+    """
+    Returns one shared OpenAI client per API key, backed by a pooled keep-alive connection pool.
+    base_url points the client at another server (e.g. the local stand-ins in api_standins.py).
+    """
+    with _lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=_get_httpx_client())
+            _openai_clients[(api_key, base_url)] = client
+        return client
+
+
+def prewarm(deepgram=True, openai=True):
+    """
+    Opens connections to Deepgram and OpenAI in the background so the next
+    real request skips the handshake. Call it while the child is still
+    speaking. Returns the started thread.
+    """
+    def warm():
+        # Any response (even 401/404) leaves a live connection in the pool
+        try:
+            if deepgram:
+                get_session().head(DEEPGRAM_HOST, timeout=5).close()
+        except requests.RequestException:
+            pass
+        try:
+            if openai:
+                with _lock:
+                    client = _get_httpx_client()
+                client.head(OPENAI_HOST + "/v1/models", timeout=5)
+        except httpx.HTTPError:
+            pass
+
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
@@ -13,10 +13,18 @@ import json
 import os
 import numpy as np
 import threading
+import tempfile
 import soundfile as sf
-import sounddevice as sd
-from openai import OpenAI
-import requests
+from http_clients import get_openai_client, prewarm, configure_pools
+from conversation_memory import ConversationMemory, openai_summarizer
+from reply_cache import get_reply_cache
+from reply_stream import reply_sentences
+from pipeline import Pipeline, Stage, run_turns
+from audio_utils import record_until_silence
+from stt_backends import APIBackend, ServerBackend
+from tracing import tracer_from_config, NULL_TRACE
+from tts_cache import get_tts_cache, DEFAULT_CACHE_DIR
+from tts_formats import FORMATS, negotiate, get_speech, join_clips
 
 # Set window size for testing
 Window.size = (400, 800)
@@ -28,6 +36,7 @@ class TalkyBuddyApp(App):
         self.init_clients()
         self.recording = False
         self.audio_data = None
+        self.reply_file = None  # latest reply's audio; earlier ones are deleted
         
     def load_config(self):
         """Load API keys from config.json"""
@@ -37,16 +46,33 @@ class TalkyBuddyApp(App):
                 config = json.load(f)
             self.openai_key = config["openai_api_key"]
             self.deepgram_key = config["deepgram_api_key"]
+            self.max_prompt_tokens = config.get("max_prompt_tokens", 1500)
+            # No local model on mobile: use the classroom speech server if one is configured
+            self.stt_engine = config.get("stt_engine")
+            self.stt_options = config.get("stt_options", {})
+            configure_pools(config.get("http_pool_sizes", {}))
+            # Per-turn stage timings ("trace_file" and/or "metrics_port")
+            self.tracer = tracer_from_config(config)
+            # Small speech payloads for tablets on shared Wi-Fi (low-bitrate Opus by default)
+            self.tts_format = negotiate(config.get("tts_mobile_formats", ["opus-12", "mp3-32"]),
+                                        bandwidth_kbps=config.get("client_bandwidth_kbps"))
+            self.tts_cache = get_tts_cache(config.get("tts_cache_dir", DEFAULT_CACHE_DIR),
+                                           config.get("tts_cache_mb", 50))
         except Exception as e:
             self.show_error(f"Config error: {e}")
     
     def init_clients(self):
         """Initialize OpenAI client and load Whisper model"""
         try:
-            self.openai_client = OpenAI(api_key=self.openai_key)
-            self.messages = [
-                {"role": "system", "content": "You are a patient, friendly English teacher for kids. Keep responses short and simple. Ask one question at a time."}
-            ]
+            self.openai_client = get_openai_client(self.openai_key)
+            # Bounded history: recent turns plus a rolling summary
+            self.memory = ConversationMemory(
+                "You are a patient, friendly English teacher for kids. Keep responses short and simple. Ask one question at a time.",
+                max_prompt_tokens=self.max_prompt_tokens, summarize=openai_summarizer(self.openai_client))
+            if self.stt_engine == "server":
+                self.stt = ServerBackend(**self.stt_options)
+            else:
+                self.stt = APIBackend(self.openai_client)
         except Exception as e:
             self.show_error(f"Client init error: {e}")
     
@@ -144,25 +170,28 @@ class TalkyBuddyApp(App):
         thread.daemon = True
         thread.start()
     
-    def process_text(self, text):
-        """Process text through chat and TTS"""
-        try:
-            # Get chat response
-            self.messages.append({"role": "user", "content": text})
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=self.messages
-            )
-            ai_text = response.choices[0].message.content
-            self.messages.append({"role": "assistant", "content": ai_text})
-            
+    def process_text(self, text, trace=None):
+        """Process text through chat and TTS (trace: the turn's trace when it started with a recording)"""
+        trace = trace or self.tracer.turn("kivy")
+
+        def think(text):
+            # Streamed sentence by sentence; frequent utterances reuse a cached reply instead of calling the LLM
+            parts = []
+            yield from reply_sentences(self.openai_client, self.memory, text, reply_cache=get_reply_cache(),
+                                       on_text=parts.append, trace=trace)
             # Display response
-            self.add_message("assistant", ai_text)
-            
-            # Generate speech
-            self.generate_and_play_speech(ai_text)
+            self.add_message("assistant", "".join(parts))
+
+        try:
+            # Each sentence is synthesized while the rest of the reply is still streaming in
+            clips = run_turns(Pipeline(Stage("think", think),
+                                       Stage("speak", lambda sentence: self.synthesize(sentence, trace), workers=2)),
+                              [text])
+            self.save_reply(clips, trace)
         except Exception as e:
             self.show_error(str(e))
+        finally:
+            trace.end()
     
     def on_record_toggle(self, instance):
         """Toggle recording on/off"""
@@ -171,6 +200,9 @@ class TalkyBuddyApp(App):
             self.record_btn.text = "⏹️ Stop"
             self.record_btn.background_color = (0.8, 0.2, 0.2, 1)
             
+            # Open API connections while the child is talking
+            prewarm()
+            
             # Record in background
             thread = threading.Thread(target=self.record_audio)
             thread.daemon = True
@@ -182,61 +214,87 @@ class TalkyBuddyApp(App):
     
     def record_audio(self):
         """Record audio from microphone"""
+        trace = self.tracer.turn("kivy")
         try:
             duration = 8
             rate = 16000
             
             self.add_message("user", "🎤 Recording...")
             
-            audio = sd.rec(int(duration * rate), samplerate=rate, channels=1, dtype='float32')
-            sd.wait()
+            # Stop as soon as the child finishes talking
+            with trace.span("capture"):
+                audio = record_until_silence(rate=rate, max_duration=duration)
             
             # Check audio level
-            max_amplitude = np.max(np.abs(audio))
+            max_amplitude = np.max(np.abs(audio)) if audio.size else 0.0
             if max_amplitude < 0.001:
                 self.show_error("Very quiet - speak louder!")
                 return
             
-            # Transcribe
+            # Transcribe on the shared speech server (or the OpenAI API)
             self.add_message("user", "⏳ Transcribing...")
+            with trace.span("stt"):
+                text = self.stt.transcribe(audio)["text"]
+            if not text:
+                self.show_error("Couldn't understand. Try again!")
+                return
             
-            # For now, use text input as fallback (Whisper requires ffmpeg on mobile)
-            self.add_message("user", "📝 (Using text input - Whisper not available on mobile yet)")
+            self.add_message("user", text)
+            self.process_text(text, trace)
             
         except Exception as e:
             self.show_error(str(e))
+        finally:
+            trace.end()  # no-op if process_text already ended it
     
-    def generate_and_play_speech(self, text):
-        """Generate speech from Deepgram and play it"""
+    def synthesize(self, text, trace=NULL_TRACE):
+        """Speech for one sentence: cached, transcoded from another cached format, or synthesized
+        in the negotiated format. None on error."""
+        trace.count("tts_chars", len(text))
         try:
-            url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
-            headers = {
-                "Authorization": f"Token {self.deepgram_key.strip()}",
-                "Content-Type": "application/json"
-            }
-            payload = {"text": text}
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            
-            if response.status_code == 200:
-                # Save and play audio
-                audio_file = "response_mobile.mp3"
-                with open(audio_file, "wb") as f:
-                    f.write(response.content)
+            with trace.span("tts") as span:
+                audio = get_speech(text, self.deepgram_key, self.tts_format, cache=self.tts_cache)
+                span.first("tts_first_byte")
+            return audio
+        except Exception as e:
+            self.show_error(f"Speech error: {str(e)}")
+            return None
+    
+    def save_reply(self, clips, trace=NULL_TRACE):
+        """Joins the reply's sentence clips into one audio file and plays it"""
+        try:
+            audio = join_clips(clips, self.tts_format)
+            if audio:
+                # Save and play audio (unique file so replies don't overwrite each other)
+                fd, audio_file = tempfile.mkstemp(prefix="talkybuddy_", suffix="." + FORMATS[self.tts_format]["ext"])
+                with os.fdopen(fd, "wb") as f:
+                    f.write(audio)
+                self.replace_reply_file(audio_file)
                 
                 # Note: Playing audio on Android requires additional setup
+                trace.mark("playback_start")
                 self.add_message("assistant", "🔊 [Audio response generated]")
             else:
-                self.show_error(f"TTS error: {response.status_code}")
+                self.show_error("TTS error (see console)")
         except Exception as e:
             self.show_error(f"Speech error: {str(e)}")
     
+    def replace_reply_file(self, path):
+        """Keeps only the newest reply's audio file on the device (None removes the last one)."""
+        previous, self.reply_file = self.reply_file, path
+        if previous:
+            try:
+                os.remove(previous)
+            except OSError:
+                pass
+    
+    def on_stop(self):
+        self.replace_reply_file(None)
+    
     def on_clear(self, instance):
         """Clear chat history"""
         self.chat_box.clear_widgets()
-        self.messages = [
-            {"role": "system", "content": "You are a patient, friendly English teacher for kids. Keep responses short and simple. Ask one question at a time."}
-        ]
+        self.memory.clear()
         self.add_message("assistant", "👋 Conversation cleared!")
 
 if __name__ == '__main__':
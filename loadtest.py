@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from collections import defaultdict
+import numpy as np
+import requests
+from audio_format import WHISPER_RATE, decode_wav, resample
+from conversation_memory import ConversationMemory
+from http_clients import get_openai_client, get_session, POOL_SIZES, OPENAI_HOST, DEEPGRAM_HOST
+from stt_backends import APIBackend, ServerBackend, load_backend, warm_up
+from stt_batching import BatchingBackend
+from tracing import BUCKETS
+
+SYSTEM_PROMPT = ("You are a patient, friendly English teacher for kids. Keep responses short and simple. "
+                 "Ask one question at a time.")
+STAGES = ["decode", "stt", "chat", "tts"]
+
+
+class Slots:
+    """
+    A stage's share of the host: at most `size` calls at once (0 = unlimited),
+    like the model lock or the keep-alive connection pools. Waiting for a slot
+    is the stage's queueing delay.
+    """
+
+    def __init__(self, size):
+        self.semaphore = threading.Semaphore(size) if size else None
+
+    def run(self, func, *args):
+        """Returns (result, seconds queued, seconds running)."""
+        queued = time.perf_counter()
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        started = time.perf_counter()
+        try:
+            return func(*args), started - queued, time.perf_counter() - started
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+
+class Classroom:
+    """
+    The handlers of streamlit_app.py, as every session on one host runs them:
+    decode the browser's WAV, transcribe_audio, get_chat_response and
+    get_deepgram_tts, with the shared STT model and connection pools.
+    Replies and speech are not cached, so every turn reaches the (stand-in) APIs.
+    """
+
+    def __init__(self, stt, client, speak_url, slots):
+        self.stt = stt
+        self.client = client
+        self.speak_url = speak_url
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.turns = []
+        self.errors = 0
+
+    def decode(self, wav):
+        audio, rate = decode_wav(wav)
+        return resample(audio, rate, WHISPER_RATE)
+
+    def transcribe_audio(self, audio):
+        return self.stt.transcribe(audio, language="en")["text"].strip()
+
+    def get_chat_response(self, user_text, memory):
+        question = memory.add_user(user_text)
+        try:
+            response = self.client.chat.completions.create(model="gpt-4o-mini", messages=memory.prompt())
+        except Exception:
+            memory.remove(question)  # no reply: don't leave the question in the conversation
+            raise
+        ai_text = response.choices[0].message.content
+        memory.add_assistant(ai_text)
+        return ai_text
+
+    def get_deepgram_tts(self, text):
+        response = get_session().post(self.speak_url, params={"model": "aura-asteria-en"}, json={"text": text},
+                                      headers={"Authorization": "Token standin"}, timeout=30)
+        response.raise_for_status()
+        return response.content
+
+    def turn(self, wav, memory):
+        """One child's turn; returns its latency in seconds."""
+        started = time.perf_counter()
+        timings = {}
+        value = wav
+        for stage, func in (("decode", self.decode), ("stt", self.transcribe_audio),
+                            ("chat", lambda text: self.get_chat_response(text, memory)),
+                            ("tts", self.get_deepgram_tts)):
+            value, queued, ran = self.slots[stage].run(func, value)
+            timings[stage] = (queued, ran)
+        latency = time.perf_counter() - started
+        with self.lock:
+            for stage, (queued, ran) in timings.items():
+                self.samples[f"{stage}_queue"].append(queued)
+                self.samples[stage].append(ran)
+            self.turns.append((time.perf_counter(), latency))
+        return latency
+
+
+def think_time(spec):
+    """
+    Returns a function drawing think times (seconds between a child's turns) from `spec`:
+    "fixed:3", "uniform:2:6" or "exp:4" (exponential with mean 4).
+    """
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / params[0]) if params[0] > 0 else 0.0
+    raise ValueError(f"Unknown think time '{spec}' (use fixed:S, uniform:A:B or exp:MEAN)")
+
+
+def rss_mb():
+    """Current resident memory of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource  # peak instead of current where /proc is missing
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def sample_usage(stop, usage, interval=0.5):
+    """Records CPU (% of one core) and RSS every `interval` seconds until `stop` is set."""
+    last_cpu, last_wall = time.process_time(), time.perf_counter()
+    while not stop.wait(interval):
+        cpu, wall = time.process_time(), time.perf_counter()
+        usage.append({"cpu": (cpu - last_cpu) / (wall - last_wall) * 100, "rss_mb": rss_mb()})
+        last_cpu, last_wall = cpu, wall
+
+
+def run_level(children, classroom_factory, wavs, turns, ramp, think, seed=0):
+    """Runs `children` virtual children for `turns` turns each and returns the level's report."""
+    classroom = classroom_factory()
+    stop = threading.Event()
+    usage = []
+    threading.Thread(target=sample_usage, args=(stop, usage), daemon=True).start()
+
+    def child(n):
+        rng = random.Random(seed * 100003 + n)
+        time.sleep(ramp * n / children)
+        memory = ConversationMemory(SYSTEM_PROMPT)
+        for t in range(turns):
+            try:
+                classroom.turn(wavs[(n + t) % len(wavs)], memory)
+            except Exception as e:
+                with classroom.lock:
+                    classroom.errors += 1
+                print(f"\n❌ Child {n}: {e}")
+            if t < turns - 1:
+                time.sleep(think(rng))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=child, args=(n,), daemon=True) for n in range(children)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return report(children, classroom, usage, elapsed, started + ramp)
+
+
+def percentiles(values):
+    values = np.array(values) * 1000
+    if not len(values):
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"n": len(values), "p50": round(float(p50), 1), "p95": round(float(p95), 1),
+            "p99": round(float(p99), 1), "max": round(float(values.max()), 1)}
+
+
+def report(children, classroom, usage, elapsed, ramped):
+    latencies = [latency for _, latency in classroom.turns]
+    # Throughput once every child has joined (the ramp would understate it)
+    steady = [end for end, _ in classroom.turns if end >= ramped]
+    window = max(1e-9, (max(steady) - ramped) if steady else elapsed)
+    histogram = [int(np.sum(np.array(latencies) <= bound)) for bound in BUCKETS]
+    return {
+        "children": children,
+        "turns": len(latencies),
+        "errors": classroom.errors,
+        "seconds": round(elapsed, 2),
+        "turns_per_sec": round(len(steady) / window if steady else len(latencies) / elapsed, 2),
+        "turn_ms": percentiles(latencies),
+        "stages": {stage: {"queue_ms": percentiles(classroom.samples[f"{stage}_queue"]),
+                           "service_ms": percentiles(classroom.samples[stage])} for stage in STAGES},
+        "cpu_percent": {"mean": round(float(np.mean([u["cpu"] for u in usage])), 1) if usage else 0.0,
+                        "max": round(float(np.max([u["cpu"] for u in usage])), 1) if usage else 0.0},
+        "rss_mb": {"max": round(max([u["rss_mb"] for u in usage] + [rss_mb()]), 1)},
+        # Cumulative counts of turns at or under each bucket (seconds), as in Prometheus
+        "turn_histogram": dict(zip([str(b) for b in BUCKETS], histogram)),
+    }
+
+
+def print_level(level):
+    t = level["turn_ms"] or {"p50": 0, "p95": 0, "p99": 0}
+    print(f"\n👥 {level['children']} children: {level['turns']} turns ({level['errors']} errors) in {level['seconds']}s, "
+          f"{level['turns_per_sec']} turns/sec, CPU {level['cpu_percent']['mean']}% "
+          f"(max {level['cpu_percent']['max']}%), RSS {level['rss_mb']['max']} MB")
+    print(f"   turn latency p50 {t['p50']:.0f} ms, p95 {t['p95']:.0f} ms, p99 {t['p99']:.0f} ms")
+    print(f"   {'stage':<8}{'queue p50':>11}{'queue p99':>11}{'run p50':>10}{'run p99':>10}   (ms)")
+    for stage, s in level["stages"].items():
+        if s["queue_ms"] is None:
+            continue
+        q, r = s["queue_ms"], s["service_ms"]
+        print(f"   {stage:<8}{q['p50']:>11.1f}{q['p99']:>11.1f}{r['p50']:>10.1f}{r['p99']:>10.1f}")
+    previous = 0
+    total = max(1, level["turns"])
+    for bound, count in level["turn_histogram"].items():
+        n = count - previous
+        previous = count
+        if n:
+            print(f"   ≤{float(bound):>5.2f}s {'█' * max(1, round(40 * n / total))} {n}")
+    if level["turns"] > previous:
+        print(f"   >{BUCKETS[-1]:>5.2f}s {'█' * max(1, round(40 * (level['turns'] - previous) / total))} "
+              f"{level['turns'] - previous}")
+
+
+def start_standin_process(settings, port):
+    """Runs api_standins.py in its own process, so its CPU doesn't count as the host's."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api_standins.py")
+    command = [sys.executable, script, "--port", str(port)]
+    for setting in settings:
+        command += ["--set", setting]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.head(url, timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    sys.exit("❌ The API stand-ins did not start")
+
+
+if __name__ == "__main__":
+    # python loadtest.py --children 5,10,20,40 --turns 5 --ramp 10 --think exp:4
+    parser = argparse.ArgumentParser(description="Simulate a classroom of children talking to one TalkyBuddy host")
+    parser.add_argument("fixtures", nargs="*", help="WAV recordings to replay (default: input.wav)")
+    parser.add_argument("--children", default="10", help="virtual children, or a list of levels: 5,10,20")
+    parser.add_argument("--turns", type=int, default=5, help="turns per child")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds until every child has started")
+    parser.add_argument("--think", default="exp:3", help="think time between turns: fixed:S, uniform:A:B, exp:MEAN")
+    parser.add_argument("--stt", default="api", help="api (stand-in), server, whisper or faster-whisper")
+    parser.add_argument("--stt-url", default=None, help="speech server URL for --stt server")
+    parser.add_argument("--model", default="base", help="local Whisper model")
+    parser.add_argument("--batch-size", type=int, default=1, help="micro-batch local transcriptions")
+    parser.add_argument("--stt-slots", type=int, default=None,
+                        help="transcriptions at once (default: 1 for a local model, else the OpenAI pool size)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="stand-in latency setting")
+    parser.add_argument("--standin-url", help="use stand-ins that are already running")
+    parser.add_argument("--standin-port", type=int, default=8801)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    wavs = []
+    for path in args.fixtures or [os.path.join(here, "input.wav")]:
+        with open(path, "rb") as f:
+            wavs.append(f.read())
+    think = think_time(args.think)
+
+    process = None
+    if args.standin_url:
+        url = args.standin_url.rstrip("/")
+    else:
+        process, url = start_standin_process(args.set, args.standin_port)
+    client = get_openai_client("standin", base_url=f"{url}/v1")
+
+    if args.stt == "api":
+        stt = APIBackend(client)
+    elif args.stt == "server":
+        stt = ServerBackend(**({"url": args.stt_url} if args.stt_url else {}))
+    else:
+        print(f"📦 Loading {args.stt} model '{args.model}'...")
+        stt = load_backend(args.stt, args.model)
+        warm_up(stt)
+        if args.batch_size > 1 and hasattr(stt, "transcribe_batch"):
+            stt = BatchingBackend(stt, max_batch=args.batch_size)
+        elif args.batch_size > 1:
+            print(f"⚠️  {args.stt} can't batch; ignoring --batch-size")
+    if args.stt_slots is not None:
+        stt_slots = args.stt_slots
+    elif stt.local:
+        stt_slots = args.batch_size if isinstance(stt, BatchingBackend) else 1
+    else:
+        stt_slots = POOL_SIZES[OPENAI_HOST]
+
+    def classroom():
+        return Classroom(stt, client, f"{url}/v1/speak", {
+            "decode": Slots(0),
+            "stt": Slots(stt_slots),
+            "chat": Slots(POOL_SIZES[OPENAI_HOST]),
+            "tts": Slots(POOL_SIZES[DEEPGRAM_HOST]),
+        })
+
+    levels = []
+    try:
+        for children in [int(n) for n in args.children.split(",")]:
+            print(f"🏫 {children} children, {args.turns} turns each...")
+            level = run_level(children, classroom, wavs, args.turns, args.ramp, think, args.seed)
+            print_level(level)
+            levels.append(level)
+    finally:
+        if process is not None:
+            process.terminate()
+
+    if len(levels) > 1:
+        print(f"\n{'children':>9}{'turns/sec':>11}{'p50 ms':>9}{'p99 ms':>9}{'CPU %':>8}")
+        for level in levels:
+            t = level["turn_ms"] or {"p50": 0, "p99": 0}
+            print(f"{level['children']:>9}{level['turns_per_sec']:>11}{t['p50']:>9.0f}{t['p99']:>9.0f}"
+                  f"{level['cpu_percent']['mean']:>8}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"stt": args.stt, "think": args.think, "turns": args.turns, "ramp": args.ramp,
+                       "latency": args.set, "levels": levels}, f, indent=2)
+        print(f"💾 Report saved to {args.output}")
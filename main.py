@@ -1,7 +1,15 @@
 import os
-import requests
 import json
-from openai import OpenAI
+import asyncio
+import tempfile
+from http_clients import get_openai_client, get_session, prewarm, configure_pools
+from reply_stream import reply_sentences
+from pipeline import Pipeline, Stage
+from conversation_memory import ConversationMemory, openai_summarizer
+from tts import (open_deepgram_stream, TurnPlayer, stream_player_command,
+                 pcm_output_rate, pcm_params)
+from tts_cache import get_tts_cache, DEFAULT_CACHE_DIR
+from tracing import tracer_from_config
 
 # Load credentials from config.json
 def load_config():
@@ -15,41 +23,123 @@ def load_config():
 config = load_config()
 OPENAI_KEY = config["openai_api_key"]
 DEEPGRAM_KEY = config["deepgram_api_key"]
+# Speak each sentence as soon as it is generated instead of waiting for the whole reply
+STREAM_REPLIES = config.get("stream_replies", True)
+# Prompt-size ceiling per turn; older turns are folded into a rolling summary
+MAX_PROMPT_TOKENS = config.get("max_prompt_tokens", 1500)
+# Play speech in-process as raw PCM at the output device's rate: no player process, no MP3 decoding
+PCM_RATE = pcm_output_rate() if config.get("stream_tts", True) and config.get("pcm_playback", True) else None
+TTS_FORMAT = pcm_params(PCM_RATE) if PCM_RATE else {}
+# Start playback on the first TTS bytes (in-process, or ffplay/mpg123 reading MP3 from a pipe)
+STREAM_TTS = config.get("stream_tts", True) and (PCM_RATE is not None or stream_player_command() is not None)
+# One output stream per turn: the sentences of a reply play back to back
+player = TurnPlayer(PCM_RATE)
+# Milliseconds of speech buffered before playback starts: more rides out network jitter, less starts sooner
+TTS_JITTER_MS = config.get("tts_jitter_ms", 150)
+# Repeated phrases ("Great job!") are served from disk instead of Deepgram
+tts_cache = get_tts_cache(config.get("tts_cache_dir", DEFAULT_CACHE_DIR), config.get("tts_cache_mb", 200))
+# Per-turn stage timings: "trace_file" (JSONL) and/or "metrics_port" (Prometheus) turn it on
+tracer = tracer_from_config(config)
 
-client = OpenAI(api_key=OPENAI_KEY)
+# Shared keep-alive clients: TLS handshakes are paid once, not every turn
+configure_pools(config.get("http_pool_sizes", {}))
+client = get_openai_client(OPENAI_KEY)
 
-def get_deepgram_tts(text, filename="output.mp3"):
-    """Uses Deepgram's Aura-2 for 5x cheaper speech than OpenAI"""
-    url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
-    headers = {
-        "Authorization": f"Token {DEEPGRAM_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {"text": text}
+def get_deepgram_tts(text, filename=None):
+    """Uses Deepgram's Aura-2 for 5x cheaper speech than OpenAI. Returns the MP3 path or None."""
+    audio = tts_cache.get(text, "aura-asteria-en")
+    if audio is None:
+        url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
+        headers = {
+            "Authorization": f"Token {DEEPGRAM_KEY}",
+            "Content-Type": "application/json"
+        }
+        payload = {"text": text}
+        
+        response = get_session().post(url, headers=headers, json=payload, timeout=30)
+        if response.status_code != 200:
+            return None
+        audio = response.content
+        tts_cache.put(text, "aura-asteria-en", audio)
     
-    response = requests.post(url, headers=headers, json=payload)
-    if response.status_code == 200:
-        with open(filename, "wb") as f:
-            f.write(response.content)
-        return True
-    return False
+    if filename is None:
+        # Unique file per reply so concurrent sessions don't collide
+        fd, filename = tempfile.mkstemp(prefix="talkybuddy_", suffix=".mp3")
+        os.close(fd)
+    with open(filename, "wb") as f:
+        f.write(audio)
+    return filename
+
+def play_speech(speech_file):
+    """Plays a synthesized reply and deletes the temp file."""
+    # Mac. Use 'start' for Windows.
+    os.system(f'afplay "{speech_file}"')
+    os.remove(speech_file)
+
+def synthesize(text):
+    """Starts speech for a reply or sentence: a streaming response, or a saved MP3 path."""
+    trace = tracer.current
+    trace.count("tts_chars", len(text))
+    with trace.span("tts") as span:
+        if not STREAM_TTS:
+            return get_deepgram_tts(text)
+        response = open_deepgram_stream(text, DEEPGRAM_KEY, cache=tts_cache, **TTS_FORMAT)
+        span.first("tts_first_byte")
+        return response
+
+def play(speech):
+    """Plays whatever synthesize() returned."""
+    trace = tracer.current
+    if STREAM_TTS:
+        player.play(speech, jitter_ms=TTS_JITTER_MS, on_start=lambda: trace.mark("playback_start"))
+    else:
+        trace.mark("playback_start")
+        play_speech(speech)
 
 def chat_loop():
-    messages = [{"role": "system", "content": "You are a friendly teacher. Speak simply."}]
+    memory = ConversationMemory("You are a friendly teacher. Speak simply.",
+                                max_prompt_tokens=MAX_PROMPT_TOKENS, summarize=openai_summarizer(client))
     
-    while True:
-        user_input = input("👦 You (Type or speak): ")
-        if user_input.lower() in ["exit", "bye"]: break
-        
-        # 1. Brain (GPT-4o-mini is ultra-cheap)
-        messages.append({"role": "user", "content": user_input})
-        res = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
-        ai_text = res.choices[0].message.content
-        print(f"🤖 AI: {ai_text}")
-        
-        # 2. Voice (Deepgram is ultra-cheap)
-        if get_deepgram_tts(ai_text):
-            os.system("afplay output.mp3") # Mac. Use 'start' for Windows.
+    def listen(_):
+        prewarm()  # open API connections while the child types
+        with tracer.current.span("capture"):
+            try:
+                return input("👦 You (Type or speak): ")
+            except EOFError:  # stdin closed (Ctrl+D or end of piped input)
+                return "exit"
+
+    def think(user_input):
+        if user_input.lower() in ["exit", "bye"]:
+            pipeline.stop()
+            return
+        # 1. Brain (GPT-4o-mini is ultra-cheap), streamed sentence by sentence
+        print("🤖 AI: ", end="", flush=True)
+        yield from reply_sentences(client, memory, user_input, stream=STREAM_REPLIES,
+                                   on_text=lambda text: print(text, end="", flush=True), trace=tracer.current)
+        print()
+
+    async def turns():
+        while not pipeline.stopping:
+            trace = tracer.turn("main")
+            yield None
+            await pipeline.idle()
+            await asyncio.to_thread(player.close)
+            trace.end()
+
+    # 2. Voice (Deepgram is ultra-cheap): the next sentence is synthesized while one plays
+    pipeline = Pipeline(
+        Stage("listen", listen, thread="daemon"),  # Ctrl+C mustn't wait for a pending input()
+        Stage("think", think),
+        Stage("synthesize", synthesize, workers=2),
+        Stage("play", play),
+    )
+    try:
+        asyncio.run(pipeline.run(turns()))
+    except KeyboardInterrupt:
+        # input() may still be waiting on its daemon thread and holding stdin,
+        # which would abort the interpreter's normal shutdown: leave right away
+        print("\n👋 Bye!", flush=True)
+        os._exit(130)
 
 if __name__ == "__main__":
     chat_loop()
\ No newline at end of file
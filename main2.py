@@ -1,10 +1,20 @@
 import os
-import requests
 import wave
 import sys
 import json
-from openai import OpenAI
+import asyncio
+import tempfile
+from http_clients import get_openai_client, get_session, prewarm, configure_pools
 from deepgram import DeepgramClient
+from reply_stream import reply_sentences
+from pipeline import Pipeline, Stage
+from conversation_memory import ConversationMemory, openai_summarizer
+from reply_cache import get_reply_cache, openai_embedder
+from tts import (open_deepgram_stream, play_stream, TurnPlayer, stream_player_command, CachedAudio,
+                 pcm_output_rate, pcm_params, player_options)
+from phrase_bank import load_phrase_bank
+from tts_cache import get_tts_cache, DEFAULT_CACHE_DIR
+from tracing import tracer_from_config
 
 # Load credentials from config.json
 def load_config():
@@ -18,36 +28,108 @@ def load_config():
 config = load_config()
 OPENAI_KEY = config["openai_api_key"]
 DEEPGRAM_KEY = config["deepgram_api_key"]
+# Speak each sentence as soon as it is generated instead of waiting for the whole reply
+STREAM_REPLIES = config.get("stream_replies", True)
+# Play speech in-process as raw PCM at the output device's rate: no player process, no MP3 decoding
+PCM_RATE = pcm_output_rate() if config.get("stream_tts", True) and config.get("pcm_playback", True) else None
+TTS_FORMAT = pcm_params(PCM_RATE) if PCM_RATE else {}
+# Start playback on the first TTS bytes (in-process, or ffplay/mpg123 reading MP3 from a pipe)
+STREAM_TTS = config.get("stream_tts", True) and (PCM_RATE is not None or stream_player_command() is not None)
+# One output stream per turn: the sentences of a reply play back to back
+player = TurnPlayer(PCM_RATE)
+# Milliseconds of speech buffered before playback starts: more rides out network jitter, less starts sooner
+TTS_JITTER_MS = config.get("tts_jitter_ms", 150)
+# Repeated phrases ("Great job!") are served from disk instead of Deepgram
+tts_cache = get_tts_cache(config.get("tts_cache_dir", DEFAULT_CACHE_DIR), config.get("tts_cache_mb", 200))
+# Fixed phrases and lesson openers, rendered once and played from a local pack
+phrases = load_phrase_bank(DEEPGRAM_KEY, config.get("lesson_openers", []), **TTS_FORMAT)
+# Per-turn stage timings: "trace_file" (JSONL) and/or "metrics_port" (Prometheus) turn it on
+tracer = tracer_from_config(config)
 
-client = OpenAI(api_key=OPENAI_KEY)
+# Shared keep-alive clients: TLS handshakes are paid once, not every turn
+configure_pools(config.get("http_pool_sizes", {}))
+client = get_openai_client(OPENAI_KEY)
+# Prompt-size ceiling per turn; older turns are folded into a rolling summary
+MAX_PROMPT_TOKENS = config.get("max_prompt_tokens", 1500)
+# Replies to frequent utterances ("hello", "I don't know") are reused without calling the LLM
+REPLY_CONTEXT_MESSAGES = 2
+reply_cache = get_reply_cache(ttl=config.get("reply_cache_ttl", 6 * 3600),
+                              embed=openai_embedder(client) if config.get("reply_cache_semantic", False) else None)
 
 def play_audio(filename):
     """Plays audio based on your Operating System."""
     if sys.platform == "darwin":      # Mac
-        os.system(f"afplay {filename}")
+        os.system(f'afplay "{filename}"')
     elif sys.platform == "win32":     # Windows
-        os.system(f"start {filename}")
+        os.system(f'start "" "{filename}"')
     else:                             # Linux
-        os.system(f"mpg123 {filename}")
-
-def get_deepgram_tts(text, filename="response.mp3"):
-    url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
-    headers = {
-        "Authorization": f"Token {DEEPGRAM_KEY.strip()}", # .strip() removes accidental spaces
-        "Content-Type": "application/json"
-    }
-    payload = {"text": text}
-    
-    response = requests.post(url, headers=headers, json=payload)
+        os.system(f'mpg123 -q "{filename}"')
+
+def play_and_remove(filename):
+    """Plays a synthesized reply, then deletes the temp file."""
+    play_audio(filename)
+    if sys.platform != "win32":  # 'start' returns before playback ends
+        os.remove(filename)
+
+def get_deepgram_tts(text, filename=None):
+    """Returns the path of the saved MP3 (unique temp file by default), or None on failure."""
+    audio = tts_cache.get(text, "aura-asteria-en")
+    if audio is None:
+        url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
+        headers = {
+            "Authorization": f"Token {DEEPGRAM_KEY.strip()}", # .strip() removes accidental spaces
+            "Content-Type": "application/json"
+        }
+        payload = {"text": text}
+        
+        response = get_session().post(url, headers=headers, json=payload, timeout=30)
+        if response.status_code != 200:
+            # This will tell us EXACTLY why it failed (401, 403, etc.)
+            print(f"❌ Deepgram Error: {response.status_code} - {response.text}")
+            return None
+        audio = response.content
+        tts_cache.put(text, "aura-asteria-en", audio)
     
-    if response.status_code == 200:
-        with open(filename, "wb") as f:
-            f.write(response.content)
-        return True
+    if filename is None:
+        # Unique file per reply so concurrent sessions don't collide
+        fd, filename = tempfile.mkstemp(prefix="talkybuddy_", suffix=".mp3")
+        os.close(fd)
+    with open(filename, "wb") as f:
+        f.write(audio)
+    return filename
+
+def synthesize(text):
+    """Starts speech for a reply or sentence: a streaming response, or a saved MP3 path."""
+    trace = tracer.current
+    trace.count("tts_chars", len(text))
+    with trace.span("tts") as span:
+        if not STREAM_TTS:
+            return get_deepgram_tts(text)
+        response = open_deepgram_stream(text, DEEPGRAM_KEY, cache=tts_cache, **TTS_FORMAT)
+        span.first("tts_first_byte")
+        return response
+
+def play(speech):
+    """Plays whatever synthesize() returned."""
+    trace = tracer.current
+    if STREAM_TTS:
+        player.play(speech, jitter_ms=TTS_JITTER_MS, on_start=lambda: trace.mark("playback_start"))
+    else:
+        trace.mark("playback_start")
+        play_and_remove(speech)
+
+def say(name):
+    """Plays a pre-rendered phrase from the phrase bank (no network round-trip)."""
+    audio = phrases.get(name)
+    if not audio:
+        return
+    if STREAM_TTS:
+        play_stream(CachedAudio(audio), **player_options(PCM_RATE))
     else:
-        # This will tell us EXACTLY why it failed (401, 403, etc.)
-        print(f"❌ Deepgram Error: {response.status_code} - {response.text}")
-        return False
+        fd, speech_file = tempfile.mkstemp(prefix="talkybuddy_", suffix=".mp3")
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        play_and_remove(speech_file)
 
 # def get_deepgram_tts(text, filename="response.mp3"):
     
@@ -71,35 +153,58 @@ def get_deepgram_tts(text, filename="response.mp3"):
 
 def chat_loop():
     # System prompt tailored for children
-    messages = [{
-        "role": "system", 
-        "content": "You are a patient, fun English teacher for kids. Keep sentences short. Ask one simple question at a time to keep the conversation going."
-    }]
+    memory = ConversationMemory(
+        "You are a patient, fun English teacher for kids. Keep sentences short. Ask one simple question at a time to keep the conversation going.",
+        max_prompt_tokens=MAX_PROMPT_TOKENS, summarize=openai_summarizer(client))
     
     print("🎨 Buddy is ready! (Type 'exit' to stop)")
     
-    while True:
+    def listen(_):
         # Use input for now, or integrate a recording library like 'sounddevice'
-        user_input = input("\n👦 You: ")
-        
+        prewarm()  # open API connections while the child types
+        with tracer.current.span("capture"):
+            try:
+                return input("\n👦 You: ")
+            except EOFError:  # stdin closed (Ctrl+D or end of piped input)
+                return "exit"
+
+    def think(user_input):
         if user_input.lower() in ["exit", "quit", "bye"]:
             print("🤖 Goodbye! See you next time!")
-            break
-        
-        # 1. Think (Brain)
-        messages.append({"role": "user", "content": user_input})
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
-        ai_text = completion.choices[0].message.content
-        messages.append({"role": "assistant", "content": ai_text})
-        
-        print(f"🤖 Buddy: {ai_text}")
-        
-        # 2. Speak (Voice)
-        if get_deepgram_tts(ai_text):
-            play_audio("response.mp3")
+            say("goodbye")
+            pipeline.stop()
+            return
+
+        # Think and speak together: each sentence is voiced as soon as it's written,
+        # and frequent utterances reuse a cached reply
+        print("🤖 Buddy: ", end="", flush=True)
+        yield from reply_sentences(client, memory, user_input, reply_cache, stream=STREAM_REPLIES,
+                                   on_text=lambda text: print(text, end="", flush=True),
+                                   context_messages=REPLY_CONTEXT_MESSAGES, trace=tracer.current)
+        print()
+
+    async def turns():
+        # Wait for Buddy to finish speaking before asking for the next line
+        while not pipeline.stopping:
+            trace = tracer.turn("main2")
+            yield None
+            await pipeline.idle()
+            await asyncio.to_thread(player.close)
+            trace.end()
+
+    pipeline = Pipeline(
+        Stage("listen", listen, thread="daemon"),  # Ctrl+C mustn't wait for a pending input()
+        Stage("think", think),
+        Stage("synthesize", synthesize, workers=2),
+        Stage("play", play),
+    )
+    try:
+        asyncio.run(pipeline.run(turns()))
+    except KeyboardInterrupt:
+        # input() may still be waiting on its daemon thread and holding stdin,
+        # which would abort the interpreter's normal shutdown: leave right away
+        print("\n👋 Bye!", flush=True)
+        os._exit(130)
 
 if __name__ == "__main__":
     chat_loop()
\ No newline at end of file
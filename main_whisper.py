@@ -1,11 +1,27 @@
 import os
-import requests
 import json
+import asyncio
+import tempfile
+import threading
+import subprocess
 import numpy as np
-import whisper
 import sounddevice as sd
 import soundfile as sf
-from openai import OpenAI
+from http_clients import get_openai_client, get_session, prewarm, configure_pools
+from audio_utils import record_until_silence, record_utterance, get_input_device, MicStream, Endpointer, BargeInDetector
+from streaming_stt import StreamingTranscriber
+from whisper_loader import WhisperLoader
+from stt_backends import APIBackend
+from audio_format import as_mono_float32
+from reply_stream import reply_sentences
+from pipeline import Pipeline, Stage
+from conversation_memory import ConversationMemory, openai_summarizer
+from reply_cache import get_reply_cache, openai_embedder
+from tts import (open_deepgram_stream, play_stream, TurnPlayer, stream_player_command, CachedAudio,
+                 pcm_output_rate, pcm_params, player_options)
+from phrase_bank import load_phrase_bank
+from tts_cache import get_tts_cache, DEFAULT_CACHE_DIR
+from tracing import tracer_from_config
 
 # Load credentials from config.json
 def load_config():
@@ -19,52 +35,99 @@ def load_config():
 config = load_config()
 OPENAI_KEY = config["openai_api_key"]
 DEEPGRAM_KEY = config["deepgram_api_key"]
+# Speak each sentence as soon as it is generated instead of waiting for the whole reply
+STREAM_REPLIES = config.get("stream_replies", True)
+# Play speech in-process as raw PCM at the output device's rate: no player process, no MP3 decoding
+PCM_RATE = pcm_output_rate() if config.get("stream_tts", True) and config.get("pcm_playback", True) else None
+TTS_FORMAT = pcm_params(PCM_RATE) if PCM_RATE else {}
+# Start playback on the first TTS bytes (in-process, or ffplay/mpg123 reading MP3 from a pipe)
+STREAM_TTS = config.get("stream_tts", True) and (PCM_RATE is not None or stream_player_command() is not None)
+# One output stream per turn: the sentences of a reply play back to back
+player = TurnPlayer(PCM_RATE)
+# Milliseconds of speech buffered before playback starts: more rides out network jitter, less starts sooner
+TTS_JITTER_MS = config.get("tts_jitter_ms", 150)
+# Repeated phrases ("Great job!") are served from disk instead of Deepgram
+tts_cache = get_tts_cache(config.get("tts_cache_dir", DEFAULT_CACHE_DIR), config.get("tts_cache_mb", 200))
+# Fixed phrases and lesson openers, rendered once and played from a local pack
+phrases = load_phrase_bank(DEEPGRAM_KEY, config.get("lesson_openers", []), **TTS_FORMAT)
+# Transcribe while the child is talking instead of after recording
+STREAMING_STT = config.get("streaming_stt", False)
+# Keep listening while Buddy talks; the child's voice cuts the reply short (needs streaming_stt,
+# works best with headphones). barge_in_threshold fixes the RMS level that counts as speech.
+BARGE_IN = config.get("barge_in", False) and STREAMING_STT
+# Set when the child talks over Buddy: stops playback mid-sentence
+interrupted = threading.Event()
+# Per-turn stage timings: "trace_file" (JSONL) and/or "metrics_port" (Prometheus) turn it on
+tracer = tracer_from_config(config)
 
-client = OpenAI(api_key=OPENAI_KEY)
+# Shared keep-alive clients: TLS handshakes are paid once, not every turn
+configure_pools(config.get("http_pool_sizes", {}))
+client = get_openai_client(OPENAI_KEY)
 
-# Load local Whisper model (base model is ~150MB, fast and accurate)
-print("📦 Loading Whisper model (this takes ~10 seconds on first run)...")
-try:
-    whisper_model = whisper.load_model("base")
-    print("✅ Whisper model loaded!\n")
-except Exception as e:
-    print(f"❌ Error loading Whisper model: {e}")
-    print("Make sure you have ffmpeg installed: brew install ffmpeg")
-    whisper_model = None
+def whisper_loaded(loader):
+    if loader.ready:
+        print("\n✅ Whisper model loaded!")
+    else:
+        print(f"\n❌ Error loading Whisper model: {loader.error}")
+        print("Make sure you have ffmpeg installed: brew install ffmpeg")
 
-def record_audio(filename="input.wav", duration=8, rate=16000):
+# Load local Whisper model (base model is ~150MB, fast and accurate) in the background,
+# so the greeting plays right away instead of after ~10 seconds.
+# stt_engine: "whisper" (PyTorch), "faster-whisper" (int8 on CPU, much faster) or "api"
+print("📦 Loading Whisper model in the background...")
+whisper_loader = WhisperLoader(config.get("whisper_model", "base"), warmup=config.get("whisper_warmup", True),
+                               on_done=whisper_loaded, engine=config.get("stt_engine", "whisper"),
+                               client=client, **config.get("stt_options", {})).start()
+# Shared by every API transcription (fallback while the local model loads)
+api_stt = APIBackend(client)
+# Until the local model is ready, transcribe with the OpenAI API instead of waiting for it
+WHISPER_API_FALLBACK = config.get("whisper_api_fallback", True)
+# Prompt-size ceiling per turn; older turns are folded into a rolling summary
+MAX_PROMPT_TOKENS = config.get("max_prompt_tokens", 1500)
+# Replies to frequent utterances ("hello", "I don't know") are reused without calling the LLM
+REPLY_CONTEXT_MESSAGES = 2
+reply_cache = get_reply_cache(ttl=config.get("reply_cache_ttl", 6 * 3600),
+                              embed=openai_embedder(client) if config.get("reply_cache_semantic", False) else None)
+
+def record_audio(filename=None, duration=8, rate=16000, endpointing=True, hangover=0.8):
     """
-    Records audio from microphone with fixed duration.
-    Uses simpler, more reliable recording approach.
+    Records audio from microphone and returns it as a mono float32 array.
+    With endpointing on, recording stops as soon as the speaker goes quiet;
+    otherwise it records for the full fixed duration.
     
     Args:
-        filename: Output file path
-        duration: Recording duration in seconds
+        filename: Optional file path to also save the recording to
+        duration: Recording duration in seconds (maximum when endpointing)
         rate: Sample rate in Hz
+        endpointing: Stop on trailing silence instead of waiting for duration
+        hangover: Seconds of silence that end the utterance
     """
-    print(f"🎤 Recording for {duration} seconds... speak now!")
+    if endpointing:
+        print(f"🎤 Listening (up to {duration} seconds)... speak now!")
+    else:
+        print(f"🎤 Recording for {duration} seconds... speak now!")
     try:
-        # List all available input devices
-        devices = sd.query_devices()
-        print("\n📋 Available input devices:")
-        input_devices = []
-        for i, device in enumerate(devices):
-            if device['max_input_channels'] > 0:
-                print(f"   [{i}] {device['name']} (channels: {device['max_input_channels']})")
-                input_devices.append(i)
-        
-        if not input_devices:
+        # Device lookup happens once per session
+        if get_input_device() is None:
             print("❌ No input device found!")
-            return
+            print(sd.query_devices())
+            return None
         
         # Use the default input device (usually the system default)
         print(f"\n   Using default device...")
         input_device = None  # None means use system default
         
-        # Simple fixed-duration recording
         print("   Listening...")
-        audio = sd.rec(int(duration * rate), samplerate=rate, channels=1, dtype='float32', device=input_device)
-        sd.wait()
+        if endpointing:
+            # Stop as soon as the child finishes talking
+            audio = record_until_silence(rate=rate, max_duration=duration, hangover=hangover, device=input_device)
+            if audio.size == 0:
+                print("⚠️  No speech detected.")
+                audio = np.zeros(rate // 10, dtype=np.float32)
+        else:
+            # Simple fixed-duration recording
+            audio = sd.rec(int(duration * rate), samplerate=rate, channels=1, dtype='float32', device=input_device)
+            sd.wait()
         
         # Check if we got any audio
         max_amplitude = np.max(np.abs(audio))
@@ -73,24 +136,33 @@ def record_audio(filename="input.wav", duration=8, rate=16000):
         if max_amplitude < 0.001:
             print("⚠️  Very quiet audio detected. Try speaking louder or check your microphone!")
         
-        sf.write(filename, audio, rate)
-        print("✅ Recording saved!")
+        if filename:
+            sf.write(filename, audio, rate)
+        print("✅ Recording done!")
+        return as_mono_float32(audio)
         
     except Exception as e:
         print(f"❌ Recording error: {e}")
+        return None
 
-def transcribe_audio(filename="input.wav"):
-    """Converts speech to text using local Whisper (instant, no network latency)"""
+def transcribe_audio(audio, rate=16000):
+    """
+    Converts speech to text using local Whisper (instant, no network latency),
+    with the engine chosen by "stt_engine" in config.json.
+    Takes the 16 kHz mono float32 array from record_audio(), so nothing is
+    written to disk or re-decoded through ffmpeg.
+    """
+    if audio is None or len(audio) == 0:
+        return ""
     print("⏳ Transcribing...")
     try:
+        whisper_model = whisper_loader.get(timeout=0 if WHISPER_API_FALLBACK else None)
         if whisper_model is None:
-            # Fallback to OpenAI API
-            print("   Using OpenAI API (local model not available)...")
-            with open(filename, "rb") as f:
-                transcript = client.audio.transcriptions.create(model="whisper-1", file=f)
-            return transcript.text
+            # Fallback to OpenAI API (uploads an in-memory WAV)
+            print("   Using OpenAI API (local model not available yet)...")
+            whisper_model = api_stt
         
-        result = whisper_model.transcribe(filename, language="en")
+        result = whisper_model.transcribe(as_mono_float32(audio), language="en")
         text = result["text"].strip()
         if not text:
             print("⚠️  No speech detected.")
@@ -99,52 +171,202 @@ def transcribe_audio(filename="input.wav"):
         print(f"❌ Transcription error: {e}")
         return ""
 
-def get_deepgram_tts(text, filename="output.mp3"):
-    """Uses Deepgram's Aura-2 for 5x cheaper speech than OpenAI"""
-    url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
-    headers = {
-        "Authorization": f"Token {DEEPGRAM_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {"text": text}
+def get_deepgram_tts(text, filename=None):
+    """
+    Uses Deepgram's Aura-2 for 5x cheaper speech than OpenAI.
+    Returns the path of the saved MP3 (a unique temp file unless filename
+    is given, so sessions never overwrite each other), or None on failure.
+    """
+    audio = tts_cache.get(text, "aura-asteria-en")
+    if audio is None:
+        url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
+        headers = {
+            "Authorization": f"Token {DEEPGRAM_KEY}",
+            "Content-Type": "application/json"
+        }
+        payload = {"text": text}
+        
+        response = get_session().post(url, headers=headers, json=payload, timeout=30)
+        if response.status_code != 200:
+            return None
+        audio = response.content
+        tts_cache.put(text, "aura-asteria-en", audio)
     
-    response = requests.post(url, headers=headers, json=payload)
-    if response.status_code == 200:
-        with open(filename, "wb") as f:
-            f.write(response.content)
-        return True
-    return False
+    if filename is None:
+        fd, filename = tempfile.mkstemp(prefix="talkybuddy_", suffix=".mp3")
+        os.close(fd)
+    with open(filename, "wb") as f:
+        f.write(audio)
+    return filename
+
+def play_speech(speech_file, interrupt=None):
+    """Plays a synthesized reply (macOS afplay) and deletes the temp file.
+    Playback stops early once `interrupt` (a threading.Event) is set."""
+    player = subprocess.Popen(["afplay", speech_file])
+    while True:
+        try:
+            player.wait(timeout=0.05)
+            break
+        except subprocess.TimeoutExpired:
+            if interrupt is not None and interrupt.is_set():
+                player.kill()
+                player.wait()
+                break
+    os.remove(speech_file)
+
+def synthesize(text):
+    """Starts speech for a reply or sentence: a streaming response, or a saved MP3 path."""
+    trace = tracer.current
+    trace.count("tts_chars", len(text))
+    with trace.span("tts") as span:
+        if not STREAM_TTS:
+            return get_deepgram_tts(text)
+        response = open_deepgram_stream(text, DEEPGRAM_KEY, cache=tts_cache, **TTS_FORMAT)
+        span.first("tts_first_byte")
+        return response
+
+def play(speech):
+    """Plays whatever synthesize() returned (cut short if the child interrupts)."""
+    trace = tracer.current
+    if interrupted.is_set():
+        discard(speech)
+    elif STREAM_TTS:
+        player.play(speech, jitter_ms=TTS_JITTER_MS, interrupt=interrupted,
+                    on_start=lambda: trace.mark("playback_start"))
+    else:
+        trace.mark("playback_start")
+        play_speech(speech, interrupt=interrupted)
+
+def discard(speech):
+    """Releases speech that will never be played (the child interrupted)."""
+    if STREAM_TTS:
+        speech.close()
+    else:
+        os.remove(speech)
+
+def say(name):
+    """Plays a pre-rendered phrase from the phrase bank (no network round-trip)."""
+    audio = phrases.get(name)
+    if not audio:
+        return
+    if STREAM_TTS:
+        play_stream(CachedAudio(audio), **player_options(PCM_RATE))
+    else:
+        fd, speech_file = tempfile.mkstemp(prefix="talkybuddy_", suffix=".mp3")
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        play_speech(speech_file)
 
 def chat_loop():
-    messages = [{"role": "system", "content": "You are a patient, friendly English teacher for kids. Keep responses short and simple. Ask one question at a time."}]
+    memory = ConversationMemory("You are a patient, friendly English teacher for kids. Keep responses short and simple. Ask one question at a time.",
+                                max_prompt_tokens=MAX_PROMPT_TOKENS, summarize=openai_summarizer(client))
     
     print("🎨 Welcome to TalkyBuddy! (Say 'exit' or 'bye' to quit)\n")
     
-    while True:
-        record_audio()
-        user_input = transcribe_audio()
-        
+    # Open the lesson with a pre-rendered opener, if any are configured
+    opener = next((name for name in phrases.names() if name.startswith("opener_")), None)
+    if opener:
+        opener_text = phrases.index[opener]["text"]
+        print(f"🤖 Buddy: {opener_text}")
+        say(opener)
+        memory.add_assistant(opener_text)
+    
+    mic = transcriber = None
+    if STREAMING_STT:
+        # One persistent input stream for the whole session
+        mic = MicStream().start()
+        vad = Endpointer(frame_ms=mic.frame_len * 1000 / mic.rate)
+    barge_in = BargeInDetector(mic, threshold=config.get("barge_in_threshold")) if BARGE_IN and mic else None
+
+    def on_barge_in():
+        # The child started talking: stop speaking and drop the rest of the reply
+        print("\n✋ (listening)")
+        interrupted.set()
+        pipeline.interrupt()
+
+    def listen(since):
+        nonlocal transcriber
+        trace = tracer.current
+        # Open API connections while the child is talking
+        prewarm()
+        if not mic:
+            with trace.span("capture"):
+                audio = record_audio()
+            with trace.span("stt"):
+                return transcribe_audio(audio)
+
+        if transcriber is None:
+            # Streaming transcription needs the local model; until it's loaded (or with a remote
+            # engine) whole utterances are cut from the same mic stream and transcribed at the end
+            whisper_model = whisper_loader.get(timeout=0 if WHISPER_API_FALLBACK else None)
+            if whisper_model is not None and whisper_model.local:
+                transcriber = StreamingTranscriber(whisper_model, mic)
+        if since is None:
+            print("🎤 Listening... speak now!")
+        # After a barge-in, start from where the child started talking (still in the ring buffer)
+        if transcriber:
+            # The transcript is ready right after the child stops, so it all counts as capture
+            with trace.span("capture"):
+                return transcriber.transcribe_utterance(on_partial=lambda text: print(f"   ... {text}"), since=since)
+        with trace.span("capture"):
+            audio = record_utterance(mic, vad, since)
+        with trace.span("stt"):
+            return transcribe_audio(audio)
+
+    def think(user_input):
         if not user_input:
             print("❌ Couldn't understand. Try again!\n")
-            continue
-            
+            say("retry")
+            return None
+
         print(f"👦 You: {user_input}\n")
-        
+
         if user_input.lower() in ["exit", "quit", "bye"]:
             print("🤖 Goodbye! See you next time!")
-            break
-        
+            say("goodbye")
+            pipeline.stop()
+            return None
+
+        if barge_in:
+            barge_in.start(on_barge_in)
         print("⏳ Thinking...")
-        messages.append({"role": "user", "content": user_input})
-        res = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
-        ai_text = res.choices[0].message.content
-        messages.append({"role": "assistant", "content": ai_text})
-        print(f"🤖 Buddy: {ai_text}")
-        
-        print("🔊 Speaking...")
-        if get_deepgram_tts(ai_text):
-            os.system("afplay output.mp3")
+        print("🤖 Buddy: ", end="", flush=True)
+        # Sentences are spoken while the rest of the reply is generated;
+        # frequent utterances come from the reply cache without calling the LLM
+        yield from reply_sentences(client, memory, user_input, reply_cache, stream=STREAM_REPLIES,
+                                   on_text=lambda text: print(text, end="", flush=True),
+                                   context_messages=REPLY_CONTEXT_MESSAGES, trace=tracer.current)
         print()
+        print(f"   📏 Prompt: {memory.last_prompt_tokens} tokens (limit {MAX_PROMPT_TOKENS})\n")
+
+    async def turns():
+        # Listen again once Buddy has finished speaking, or right away
+        # (from the start of the child's speech) after a barge-in
+        since = None
+        while not pipeline.stopping:
+            interrupted.clear()
+            trace = tracer.turn("main_whisper")
+            yield since
+            await pipeline.idle()
+            await asyncio.to_thread(player.close, interrupted)
+            trace.end()
+            since = None
+            if barge_in:
+                barge_in.stop()
+                if barge_in.triggered:
+                    since = barge_in.position
+
+    pipeline = Pipeline(
+        Stage("listen", listen),
+        Stage("think", think),
+        Stage("synthesize", synthesize, workers=2),
+        Stage("play", play, discard=discard),
+    )
+    try:
+        asyncio.run(pipeline.run(turns()))
+    finally:
+        if mic:
+            mic.stop()
 
 if __name__ == "__main__":
     chat_loop()
@@ -0,0 +1,171 @@
+import os
+import json
+import mmap
+import struct
+import tempfile
+from tts import fetch_deepgram_tts, audio_format_key, pcm_params
+
+PACK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Fixed things Buddy says outside of LLM replies
+SYSTEM_PHRASES = {
+    "retry": "Couldn't understand. Try again!",
+    "goodbye": "Goodbye! See you next time!",
+    "cleared": "Conversation cleared!",
+}
+
+_MAGIC = b"TBPK"
+_HEADER = struct.Struct("<4sI")  # magic, index length
+
+
+class PhraseBank:
+    """
+    Pre-rendered audio for fixed phrases, stored as one indexed pack file.
+
+    Pack layout: magic, index length, JSON index, then the audio clips back
+    to back. The index maps each phrase name to its text, voice model,
+    format, and byte range. The file is memory-mapped, so looking up a
+    phrase is a slice with no network or decoding work.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self._data = b""
+        self._file = None
+        if os.path.exists(path):
+            self._open()
+
+    def _open(self):
+        self.close()
+        self._file = open(self.path, "rb")
+        data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_len = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a phrase pack: {self.path}")
+        self.index = json.loads(data[_HEADER.size:_HEADER.size + index_len])
+        self._base = _HEADER.size + index_len
+        self._data = data
+
+    def close(self):
+        if self._file is not None:
+            self._data.close()
+            self._file.close()
+            self._file = None
+            self._data = b""
+
+    def get(self, name):
+        """Returns the clip for a phrase name, or None if it isn't in the pack."""
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        start = self._base + entry["offset"]
+        return self._data[start:start + entry["length"]]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return list(self.index)
+
+    def update(self, phrases, synthesize, model="aura-asteria-en", audio_format="mp3"):
+        """
+        Makes the pack match `phrases` ({name: text}), synthesizing only the
+        phrases that are missing or whose text, voice or format changed.
+        Phrases that fail to synthesize are left out. Returns the number rendered.
+        """
+        clips = {}
+        rendered = 0
+        for name, text in phrases.items():
+            entry = self.index.get(name)
+            if entry and (entry["text"], entry["model"], entry["format"]) == (text, model, audio_format):
+                clips[name] = (entry, bytes(self.get(name)))
+                continue
+            audio = synthesize(text)
+            if not audio:
+                continue
+            clips[name] = ({"text": text, "model": model, "format": audio_format}, audio)
+            rendered += 1
+
+        if rendered or set(clips) != set(self.index):
+            self._write(clips)
+        return rendered
+
+    def _write(self, clips):
+        index = {}
+        offset = 0
+        for name, (entry, audio) in clips.items():
+            index[name] = {**entry, "offset": offset, "length": len(audio)}
+            offset += len(audio)
+        index_bytes = json.dumps(index).encode("utf-8")
+
+        # Write to a temp file and swap it in, so readers never see half a pack
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".phrases")
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(index_bytes)))
+            f.write(index_bytes)
+            for _, audio in clips.values():
+                f.write(audio)
+        self.close()
+        os.replace(tmp, self.path)
+        self._open()
+
+
+def lesson_phrases(openers=()):
+    """System phrases plus configured lesson openers (named opener_0, opener_1, ...)."""
+    phrases = dict(SYSTEM_PHRASES)
+    for i, text in enumerate(openers):
+        phrases[f"opener_{i}"] = text
+    return phrases
+
+
+def pack_path(model="aura-asteria-en", directory=PACK_DIR, **params):
+    """
+    One pack file per voice and audio format, e.g. phrases.aura-asteria-en.mp3.pack.
+    This way frontends playing different formats never re-render each other's pack.
+    """
+    return os.path.join(directory, f"phrases.{model}.{audio_format_key(params)}.pack")
+
+
+def load_phrase_bank(api_key, openers=(), path=None, model="aura-asteria-en", **params):
+    """
+    Opens the phrase pack for this voice and audio format (see pack_path()),
+    rendering any missing phrases through Deepgram first. After the first
+    run (or a build step for the same format) this makes no requests.
+    Extra keyword arguments pick the audio format (e.g. tts.pcm_params(rate)).
+    """
+    path = path or pack_path(model, **params)
+    bank = PhraseBank(path)
+    try:
+        rendered = bank.update(lesson_phrases(openers),
+                               lambda text: fetch_deepgram_tts(text, api_key, model=model, **params), model=model,
+                               audio_format=audio_format_key(params))
+        if rendered:
+            print(f"🗂️  Pre-rendered {rendered} phrase(s) into {os.path.basename(path)}")
+    except Exception as e:
+        print(f"⚠️  Phrase bank not updated: {e}")
+    return bank
+
+
+if __name__ == "__main__":
+    # Build step, once per format the frontends play:
+    #   python phrase_bank.py                # MP3 (Streamlit on Safari/iOS)
+    #   python phrase_bank.py --format opus-24  # Opus (Streamlit on other browsers)
+    #   python phrase_bank.py --pcm 48000    # raw PCM at the output device's rate (terminal frontends)
+    import argparse
+    from tts_formats import FORMATS
+    parser = argparse.ArgumentParser(description="Pre-render the fixed phrases into a pack file")
+    parser.add_argument("--format", default="mp3", choices=sorted(FORMATS), help="delivery format")
+    parser.add_argument("--pcm", type=int, metavar="RATE", help="raw 16-bit PCM at this rate instead of --format")
+    parser.add_argument("--model", default="aura-asteria-en", help="Deepgram voice")
+    parser.add_argument("--path", help="pack file (default: named after the voice and format)")
+    args = parser.parse_args()
+
+    config_path = os.path.join(PACK_DIR, "config.json")
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    params = pcm_params(args.pcm) if args.pcm else FORMATS[args.format]["params"]
+    path = args.path or pack_path(args.model, **params)
+    bank = load_phrase_bank(config["deepgram_api_key"], config.get("lesson_openers", []), path, args.model, **params)
+    print(f"✅ {len(bank.names())} phrases in {path}")
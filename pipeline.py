@@ -0,0 +1,313 @@
+import asyncio
+import inspect
+import threading
+import contextvars
+
+_END = object()
+
+
+class Turn:
+    """
+    Tracks everything produced from one source item, so callers can wait for it to finish.
+    Every stage handles the turn's items in a copy of the context the source
+    produced the item in, so context variables set by the source (e.g. the
+    trace of the turn) are seen by all its stages, on any thread.
+    """
+
+    def __init__(self, value, on_done=None):
+        self.value = value
+        self.context = contextvars.copy_context()
+        self.live = 1
+        self.cancelled = False
+        self.done = asyncio.Event()
+        self._on_done = on_done
+
+    def _add(self, n):
+        self.live += n
+        if self.live <= 0 and not self.done.is_set():
+            self.done.set()
+            if self._on_done:
+                self._on_done(self)
+
+
+def _in_daemon_thread(func, *args):
+    """
+    Runs func(*args) on a new daemon thread and returns a future for its result.
+    Unlike asyncio.to_thread(), a call still blocked when the loop shuts down
+    (e.g. on Ctrl+C) doesn't keep the process alive.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    context = contextvars.copy_context()  # as asyncio.to_thread() does
+
+    def settle(result, error):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def target():
+        try:
+            result, error = func(*args), None
+        except BaseException as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            pass  # the loop is already closed
+
+    threading.Thread(target=context.run, args=(target,), daemon=True).start()
+    return future
+
+
+class Stage:
+    """
+    One step of the pipeline (capture, STT, LLM, TTS, playback, ...).
+
+    `func` takes one item and returns the next stage's item, None to drop it,
+    or a generator (sync or async) to emit several items, e.g. one per
+    sentence of a reply. Output order follows input order even with several
+    workers.
+
+    Args:
+        name: Stage name (for errors and metrics)
+        func: Sync or async function
+        workers: How many items may be processed at the same time
+        maxsize: Capacity of the queue feeding this stage (back-pressure)
+        thread: Run sync functions in a worker thread (False runs them on the
+            event loop thread, for code that must stay on the caller's thread;
+            "daemon" on a daemon thread of their own that shutdown doesn't
+            wait for, for calls like input() that may never return)
+        discard: Optional function called with items of this stage that are
+            dropped because their turn was interrupted (e.g. to close a
+            response that will never be played)
+    """
+
+    def __init__(self, name, func, workers=1, maxsize=4, thread=True, discard=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.maxsize = maxsize
+        self.thread = thread
+        self.discard = discard
+
+    async def _call(self, func, *args):
+        if inspect.isasyncgenfunction(func):
+            return func(*args)
+        if inspect.iscoroutinefunction(func):
+            return await func(*args)
+        if self.thread == "daemon":
+            return await _in_daemon_thread(func, *args)
+        if self.thread:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _outputs(self, turn, item):
+        """Yields the values produced for one item, stopping early if its turn is interrupted."""
+        if turn.cancelled:
+            if self.discard is not None:
+                self.discard(item)
+            return
+        result = await self._call(self.func, item)
+        if result is None:
+            return
+        if inspect.isasyncgen(result):
+            async for value in result:
+                yield value
+                if turn.cancelled:
+                    await result.aclose()
+                    break
+        elif inspect.isgenerator(result):
+            while True:
+                value = await self._call(next, result, _END)
+                if value is _END:
+                    break
+                yield value
+                if turn.cancelled:
+                    result.close()  # e.g. ends a streamed LLM reply mid-way
+                    break
+        else:
+            yield result
+
+    async def run(self, inbox, outbox):
+        slots = asyncio.Semaphore(self.workers)
+        buffered = {}  # seq -> outputs waiting for earlier items to finish
+        finished = set()
+        state = {"head": 0}
+        order = asyncio.Lock()  # keeps flushed and direct outputs from interleaving
+        tasks = set()
+
+        async def emit(seq, turn, value):
+            turn._add(1)  # dropped by the next stage if the turn was interrupted
+            async with order:
+                if seq == state["head"]:
+                    await outbox.put((turn, value))
+                else:
+                    buffered.setdefault(seq, []).append((turn, value))
+
+        async def finish(seq):
+            async with order:
+                finished.add(seq)
+                while state["head"] in finished:
+                    finished.discard(state["head"])
+                    state["head"] += 1
+                    for entry in buffered.pop(state["head"], []):
+                        await outbox.put(entry)
+
+        async def process(seq, turn, item):
+            try:
+                async for value in self._outputs(turn, item):
+                    await emit(seq, turn, value)
+            finally:
+                turn._add(-1)
+                await finish(seq)
+                slots.release()
+
+        seq = 0
+        try:
+            while True:
+                entry = await inbox.get()
+                if entry is _END:
+                    break
+                turn, item = entry
+                if not turn.cancelled:
+                    await slots.acquire()
+                    if turn.cancelled:  # interrupted while waiting for a free worker
+                        slots.release()
+                if turn.cancelled:
+                    if self.discard is not None:
+                        self.discard(item)
+                    turn._add(-1)
+                    continue
+                task = turn.context.run(asyncio.create_task, process(seq, *entry))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                seq += 1
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        await outbox.put(_END)
+
+
+class Pipeline:
+    """
+    Runs items through stages connected by bounded asyncio queues.
+
+    Every stage works concurrently: while one sentence plays, the next is
+    being synthesized and the rest of the reply is still streaming in. A
+    full queue makes the stage before it wait. stop() ends the run after
+    work already in flight; interrupt() drops the turns in flight but keeps
+    the pipeline running; cancel() abandons everything immediately.
+    """
+
+    def __init__(self, *stages):
+        self.stages = stages
+        self._tasks = []
+        self._turns = set()
+        self._stopping = False
+        self._loop = None
+
+    @property
+    def stopping(self):
+        return self._stopping
+
+    def stop(self):
+        """Stops taking new items from the source once the current ones finish."""
+        self._stopping = True
+
+    def cancel(self):
+        """Cancels all in-flight work (blocking calls already running in threads finish in the background)."""
+        for task in self._tasks:
+            task.cancel()
+
+    def interrupt(self):
+        """
+        Drops every turn taken from the source so far (e.g. when the child
+        talks over Buddy). Queued items are discarded and generator stages
+        stop after their current value; calls already running finish first.
+        Safe to call from any thread.
+        """
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._interrupt()
+        else:
+            loop.call_soon_threadsafe(self._interrupt)
+
+    def _interrupt(self):
+        for turn in self._turns:
+            turn.cancelled = True
+
+    async def idle(self):
+        """Waits until every item taken from the source so far has gone all the way through."""
+        while self._turns:
+            await next(iter(self._turns)).done.wait()
+
+    async def run(self, source):
+        """
+        Feeds items from `source` (iterable or async iterable) through the
+        stages and returns the outputs of the last stage, in order.
+        """
+        queues = [asyncio.Queue(maxsize=stage.maxsize) for stage in self.stages]
+        queues.append(asyncio.Queue())
+        outputs = []
+        self._stopping = False
+        self._loop = asyncio.get_running_loop()
+
+        async def feed():
+            try:
+                if hasattr(source, "__aiter__"):
+                    async for item in source:
+                        if self._stopping:
+                            break
+                        await self._submit(queues[0], item)
+                else:
+                    for item in source:
+                        if self._stopping:
+                            break
+                        await self._submit(queues[0], item)
+            finally:
+                await queues[0].put(_END)
+
+        async def drain():
+            while True:
+                entry = await queues[-1].get()
+                if entry is _END:
+                    break
+                turn, value = entry
+                if not turn.cancelled:
+                    outputs.append(value)
+                turn._add(-1)
+
+        self._tasks = [asyncio.create_task(feed()), asyncio.create_task(drain())]
+        self._tasks += [asyncio.create_task(stage.run(queues[i], queues[i + 1]))
+                        for i, stage in enumerate(self.stages)]
+        try:
+            await asyncio.gather(*self._tasks)
+        except BaseException:
+            self.cancel()
+            raise
+        finally:
+            for turn in self._turns:
+                turn.done.set()
+            self._turns.clear()
+            self._loop = None
+        return outputs
+
+    async def _submit(self, queue, item):
+        turn = Turn(item, on_done=self._turns.discard)
+        self._turns.add(turn)
+        await queue.put((turn, item))
+
+
+def run_turns(pipeline, items):
+    """Runs a pipeline to completion from synchronous code and returns its outputs."""
+    return asyncio.run(pipeline.run(items))
@@ -0,0 +1,198 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def normalize_utterance(text):
+    """Lowercases and strips punctuation so "Hello!" and "hello" share a cache entry."""
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+# Words that flip or pin down what a child means: near-duplicates must agree on these exactly
+NEGATIONS = frozenset("no not never nothing nobody none nope nah don't doesn't didn't can't cannot won't "
+                      "isn't aren't wasn't weren't haven't hasn't hadn't shouldn't wouldn't couldn't".split())
+NUMBER_WORDS = frozenset("zero one two three four five six seven eight nine ten eleven twelve thirteen "
+                         "fourteen fifteen sixteen seventeen eighteen nineteen twenty thirty forty fifty "
+                         "sixty seventy eighty ninety hundred thousand million first second third".split())
+
+
+def protected_tokens(utterance):
+    """
+    Words of a raw utterance that embeddings can't be trusted to tell apart:
+    negations, numbers, and names (words capitalized mid-sentence, as
+    Whisper writes them). Returned lowercased.
+    """
+    tokens = set()
+    for sentence in re.split(r"[.!?]+", utterance):
+        words = re.sub(r"[^\w\s']", " ", sentence).split()
+        for i, word in enumerate(words):
+            lower = word.lower()
+            if lower in NEGATIONS or lower in NUMBER_WORDS or any(c.isdigit() for c in word):
+                tokens.add(lower)
+            elif i > 0 and word[0].isupper() and lower != "i" and not lower.startswith("i'"):
+                tokens.add(lower)
+    return frozenset(tokens)
+
+
+def context_hash(messages):
+    """Hash of the recent conversation the reply depends on (e.g. Buddy's last question)."""
+    raw = "\x00".join(f"{m['role']}:{normalize_utterance(m['content'])}" for m in messages)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def openai_embedder(client, model="text-embedding-3-small"):
+    """Returns an embed(text) function using the OpenAI embeddings API."""
+    def embed(text):
+        res = client.embeddings.create(model=model, input=text)
+        return np.asarray(res.data[0].embedding, dtype=np.float32)
+    return embed
+
+
+class ReplyCache:
+    """
+    Caches Buddy's replies to frequent child utterances.
+
+    Entries are keyed on the normalized transcript plus a hash of the recent
+    context window, so "I don't know" after different questions gets
+    different replies. With an `embed` function, a miss falls back to a
+    cosine-similarity search among entries with the same context, which
+    catches near-duplicates like "hello buddy" / "hello there buddy".
+    Embeddings alone would also match "my name is Tim" with "my name is Tom",
+    or "I like it" with "I don't like it", so only entries with the same
+    names, numbers and negations (see protected_tokens) are compared.
+    An utterance is embedded at most once per miss: put() reuses the vector
+    get() computed, and otherwise embeds on a background thread so storing
+    a reply never waits on the embeddings API.
+    Entries expire after `ttl` seconds; the least recently used are evicted
+    past `max_items`.
+
+    Args:
+        max_items: Maximum number of cached replies
+        ttl: Seconds an entry stays valid
+        embed: Optional function text -> embedding vector
+        similarity: Minimum cosine similarity for a near-duplicate hit
+    """
+
+    def __init__(self, max_items=512, ttl=6 * 3600, embed=None, similarity=0.92):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.embed = embed
+        self.similarity = similarity
+        self._entries = OrderedDict()  # key -> (reply, expires, context, embedding, protected tokens)
+        self._vectors = OrderedDict()  # normalized text -> embedding from get(), for put()
+        self._lock = threading.Lock()
+        self._embedder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reply-embed") if embed else None
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _expire(self, now):
+        for key in [k for k, entry in self._entries.items() if entry[1] <= now]:
+            del self._entries[key]
+
+    def get(self, utterance, context):
+        """Returns a cached reply for the utterance in this context, or None."""
+        text = normalize_utterance(utterance)
+        ctx = context_hash(context)
+        key = (ctx, text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            protected = protected_tokens(utterance)
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if e[2] == ctx and e[3] is not None and e[1] > now and e[4] == protected]
+
+        if self.embed is None or not candidates or not text:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        vector = self._vector(text)
+        best_key, best_score = None, self.similarity
+        for k, entry in candidates:
+            score = float(np.dot(vector, entry[3]))
+            if score >= best_score:
+                best_key, best_score = k, score
+        with self._lock:
+            entry = self._entries.get(best_key) if best_key else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            self.similar_hits += 1
+            return entry[0]
+
+    def put(self, utterance, context, reply):
+        """Stores the reply given to an utterance in this context."""
+        text = normalize_utterance(utterance)
+        if not text or not reply:
+            return
+        ctx = context_hash(context)
+        key = (ctx, text)
+        now = time.time()
+        with self._lock:
+            vector = self._vectors.get(text)
+            self._entries[key] = (reply, now + self.ttl, ctx, vector, protected_tokens(utterance))
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_items:
+                self._expire(now)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+        if self._embedder is not None and vector is None:
+            self._embedder.submit(self._embed_entry, key, reply)
+
+    def _embed_entry(self, key, reply):
+        """Fills in the embedding of a stored entry (until then it only serves exact hits)."""
+        try:
+            vector = self._vector(key[1])
+        except Exception as e:
+            print(f"⚠️ Reply cache embedding failed: {e}")
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == reply:
+                self._entries[key] = entry[:3] + (vector,) + entry[4:]
+
+    def _vector(self, text):
+        """Unit embedding of a normalized utterance, remembered for a few turns."""
+        with self._lock:
+            vector = self._vectors.get(text)
+        if vector is None:
+            vector = self._unit(self.embed(text))
+            with self._lock:
+                self._vectors[text] = vector
+                while len(self._vectors) > 64:
+                    self._vectors.popitem(last=False)
+        return vector
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "similar_hits": self.similar_hits,
+                    "misses": self.misses, "entries": len(self._entries)}
+
+
+def get_reply_cache(max_items=512, ttl=6 * 3600, embed=None, similarity=0.92):
+    """Returns the process-wide ReplyCache, created on first use (shared by all Streamlit sessions)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ReplyCache(max_items=max_items, ttl=ttl, embed=embed, similarity=similarity)
+        return _shared
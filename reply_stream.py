@@ -0,0 +1,121 @@
+import re
+from conversation_memory import count_tokens
+from tracing import NULL_TRACE
+
+# End of sentence: punctuation (plus closing quotes/brackets) followed by whitespace
+_SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+
+def stream_chat(client, messages, model="gpt-4o-mini"):
+    """Yields reply text pieces from a streamed chat completion as they arrive."""
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True)
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()  # also ends the request when the reply is abandoned (barge-in)
+
+
+def split_sentences(pieces, min_chars=12):
+    """
+    Groups streamed text pieces into sentences.
+
+    Very short sentences ("Hi!") are merged with the next one so TTS isn't
+    called for a single word. Whatever is left when the stream ends is
+    yielded as the last sentence.
+    """
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        while True:
+            cut = next((m.end() for m in _SENTENCE_END.finditer(buf) if m.start() >= min_chars), None)
+            if cut is None:
+                break
+            yield buf[:cut].strip()
+            buf = buf[cut:]
+    if buf.strip():
+        yield buf.strip()
+
+
+def reply_sentences(client, memory, user_input, reply_cache=None, stream=True, on_text=None,
+                    model="gpt-4o-mini", context_messages=2, trace=NULL_TRACE, generation=None):
+    """
+    Generates Buddy's reply to one utterance, yielding it sentence by sentence.
+
+    A cached reply (see ReplyCache) skips the LLM. Otherwise the reply is
+    streamed and split into sentences, or requested in one piece when
+    `stream` is False. The exchange is recorded in `memory` (and the reply
+    cache) once the whole reply has been produced; if the generator is
+    closed early (the child interrupted), the part generated so far is
+    recorded instead and nothing is cached. If the chat call fails before
+    the first token, the child's message is taken back out of `memory`.
+
+    Args:
+        client: OpenAI client
+        memory: ConversationMemory holding the conversation
+        user_input: What the child said
+        reply_cache: Optional ReplyCache
+        stream: Stream the reply and yield it per sentence
+        on_text: Optional callback receiving each text piece as it arrives
+        model: Chat model
+        context_messages: Recent messages the reply cache key depends on
+        trace: TurnTrace receiving the "llm" span, time to first token and token/character counts
+        generation: memory.generation when the turn started; the exchange isn't
+            recorded if the conversation was cleared since
+    """
+    context = memory.messages[-context_messages:]
+    cached = reply_cache.get(user_input, context) if reply_cache is not None else None
+    question = memory.add_user(user_input, generation)
+    trace.count("user_chars", len(user_input))
+    with trace.span("llm") as llm:
+        parts = []
+
+        def tee(pieces):
+            for piece in pieces:
+                if not parts:
+                    llm.first("llm_first_token")
+                parts.append(piece)
+                if on_text:
+                    on_text(piece)
+                yield piece
+
+        def emit(sentences):
+            # Time the consumer holds a sentence (e.g. waiting for room in the TTS queue) isn't LLM time
+            try:
+                for sentence in sentences:
+                    with llm.pause():
+                        yield sentence
+            finally:
+                sentences.close()  # ends a streamed request abandoned mid-way
+
+        try:
+            if cached is not None:
+                trace.count("reply_cache_hits", 1)
+                yield from emit(split_sentences(tee([cached])) if stream else tee([cached]))
+            elif stream:
+                yield from emit(split_sentences(tee(stream_chat(client, memory.prompt(), model))))
+            else:
+                res = client.chat.completions.create(model=model, messages=memory.prompt())
+                yield from emit(tee([res.choices[0].message.content]))
+        except GeneratorExit:
+            if parts:
+                memory.add_assistant("".join(parts), generation)
+            raise
+        except Exception:
+            # Keep what Buddy already said; otherwise the question stays unanswered, so take it back
+            if parts:
+                memory.add_assistant("".join(parts), generation)
+            elif question is not None:
+                memory.remove(question)
+            raise
+
+    ai_text = "".join(parts)
+    memory.add_assistant(ai_text, generation)
+    if cached is None and reply_cache is not None:
+        reply_cache.put(user_input, context, ai_text)
+    if trace.enabled:
+        trace.count("reply_chars", len(ai_text))
+        if cached is None:
+            trace.count("prompt_tokens", memory.last_prompt_tokens)
+            trace.count("completion_tokens", count_tokens(ai_text, model))
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import argparse
+import threading
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from audio_format import WHISPER_RATE, decode_wav, resample
+from stt_backends import PCM_TYPE
+from stt_batching import BatchingBackend
+from whisper_loader import WhisperLoader
+
+DEFAULT_PORT = 8765
+
+
+class SpeechService:
+    """
+    One shared STT model serving every connected client.
+
+    Each HTTP connection gets its own thread, but inference only runs on a
+    pool of `workers` threads, so a classroom full of requests queues up
+    instead of oversubscribing the CPU. With max_batch > 1, requests are
+    micro-batched instead (see BatchingBackend): clips arriving within
+    `max_wait` seconds of each other are decoded in one pass.
+
+    Args:
+        loader: Started WhisperLoader with the model to serve
+        workers: Transcriptions run at the same time (without batching)
+        language: Default Whisper language code
+        max_batch: Largest micro-batch (1 disables batching)
+        max_wait: Seconds a request waits for others to batch with
+    """
+
+    def __init__(self, loader, workers=2, language="en", max_batch=1, max_wait=0.02):
+        self.loader = loader
+        self.language = language
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batcher = None
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stt")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def _model(self):
+        model = self.loader.get()
+        if model is None:
+            raise RuntimeError(f"STT model failed to load: {self.loader.error}")
+        if self.max_batch <= 1:
+            return model
+        with self._lock:
+            if self.batcher is None:
+                if not hasattr(model, "transcribe_batch"):
+                    # Batching would run every clip one after another on the scheduler thread
+                    print(f"⚠️  {type(model).__name__} can't batch; using the worker pool instead")
+                    self.max_batch = 1
+                    return model
+                self.batcher = BatchingBackend(model, self.max_batch, self.max_wait)
+            return self.batcher
+
+    def _run(self, model, audio, language, prompt):
+        started = time.perf_counter()
+        return model.transcribe(audio, language=language, initial_prompt=prompt), started
+
+    def transcribe(self, audio, language=None, prompt=None):
+        """Queues one 16 kHz mono float32 clip and returns its transcript (plus queue/inference timings)."""
+        queued = time.perf_counter()
+        with self._lock:
+            self.pending += 1
+        try:
+            model = self._model()
+            if model is self.batcher:
+                # The batcher does the queueing; waiting in this connection's thread lets requests pile up
+                result, started = self._run(model, audio, language or self.language, prompt)
+            else:
+                result, started = self.pool.submit(self._run, model, audio, language or self.language, prompt).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+        finished = time.perf_counter()
+        with self._lock:
+            self.served += 1
+            self.audio_seconds += len(audio) / WHISPER_RATE
+            self.busy_seconds += finished - started
+        return dict(result, queue_seconds=started - queued, seconds=finished - started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.loader.ready,
+                "error": str(self.loader.error) if self.loader.error else None,
+                "pending": self.pending,
+                "served": self.served,
+                "audio_seconds": round(self.audio_seconds, 1),
+                "busy_seconds": round(self.busy_seconds, 1),
+                **(self.batcher.stats() if self.batcher else {}),
+            }
+
+
+class SpeechHandler(BaseHTTPRequestHandler):
+    """
+    POST /transcribe  body: WAV, or raw float32 PCM with Content-Type audio/x-float32
+                      query: rate (for raw PCM), language, prompt
+    GET  /health      readiness and load statistics
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients reuse their connection
+    service = None  # set by serve()
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._json(200, self.service.stats())
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/transcribe":
+            self._json(404, {"error": "not found"})
+            return
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            if self.headers.get("Content-Type", "").split(";")[0].strip() == PCM_TYPE:
+                audio = np.frombuffer(body, dtype="<f4")
+                rate = int(query.get("rate", WHISPER_RATE))
+                if rate <= 0:
+                    raise ValueError(f"rate must be positive, got {rate}")
+            else:
+                audio, rate = decode_wav(body)
+            audio = resample(audio, rate, WHISPER_RATE)
+        except (ValueError, struct.error) as e:
+            self._json(400, {"error": f"Audio format error: {e}"})
+            return
+
+        try:
+            result = self.service.transcribe(audio, query.get("language"), query.get("prompt"))
+        except Exception as e:
+            self._json(500, {"error": str(e)})
+            return
+        self._json(200, result)
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # one line per utterance would flood the console in a classroom
+
+
+def serve(service, host="127.0.0.1", port=DEFAULT_PORT):
+    """Serves `service` over HTTP until interrupted."""
+    handler = type("Handler", (SpeechHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"🎧 Speech server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pool.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    # python speech_server.py [--host 0.0.0.0] [--port 8765] [--workers 2]
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            config = json.load(f)
+
+    parser = argparse.ArgumentParser(description="Serve one shared Whisper model to every TalkyBuddy client")
+    parser.add_argument("--host", default="127.0.0.1", help="use 0.0.0.0 to serve the whole classroom network")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=2, help="transcriptions run at the same time")
+    parser.add_argument("--engine", default=config.get("server_stt_engine", "whisper"),
+                        help="whisper or faster-whisper")
+    parser.add_argument("--model", default=config.get("whisper_model", "base"))
+    parser.add_argument("--batch-size", type=int, default=1, help="micro-batch concurrent clips (whisper engine)")
+    parser.add_argument("--batch-wait-ms", type=float, default=20, help="how long a clip waits for others to batch with")
+    args = parser.parse_args()
+    if args.batch_size > 1 and args.engine != "whisper":
+        parser.error(f"--batch-size needs the whisper engine ({args.engine} uses --workers for concurrency)")
+
+    options = dict(config.get("server_stt_options", {}))
+    if args.engine == "faster-whisper":
+        options.setdefault("num_workers", args.workers)
+    print(f"📦 Loading {args.engine} model '{args.model}'...")
+    loader = WhisperLoader(args.model, engine=args.engine, **options).start()
+    service = SpeechService(loader, workers=args.workers, max_batch=args.batch_size,
+                            max_wait=args.batch_wait_ms / 1000)
+    serve(service, args.host, args.port)
@@ -0,0 +1,103 @@
+import numpy as np
+from audio_utils import Endpointer
+
+
+class StreamingTranscriber:
+    """
+    Transcribes speech from a MicStream while the child is still talking.
+
+    While speech is going on, the audio since the last committed point is
+    re-transcribed every `step` seconds and reported as a partial hypothesis.
+    Once that audio is longer than `window` seconds, Whisper segments that
+    end more than `overlap` seconds before the live edge are committed and
+    the window slides forward, so the final pass after end of speech only
+    has to decode the short uncommitted tail.
+
+    Args:
+        model: Local STT backend (see stt_backends)
+        mic: Started MicStream
+        language: Whisper language code
+        step: Seconds of new audio between partial decodes
+        window: Seconds of uncommitted audio before segments are committed
+        overlap: Seconds at the live edge that are never committed early
+        hangover: Seconds of trailing silence that end the utterance
+        max_duration: Hard limit on utterance length in seconds
+        start_timeout: Give up if no speech starts within this many seconds
+        pre_roll: Seconds of audio kept from before speech onset
+    """
+
+    def __init__(self, model, mic, language="en", step=1.0, window=4.0, overlap=1.0,
+                 hangover=0.6, max_duration=15, start_timeout=5, pre_roll=0.3):
+        self.model = model
+        self.mic = mic
+        self.language = language
+        self.step = int(step * mic.rate)
+        self.window = int(window * mic.rate)
+        self.overlap = overlap
+        self.max_samples = int(max_duration * mic.rate)
+        self.start_samples = int(start_timeout * mic.rate)
+        self.pre_roll = int(pre_roll * mic.rate)
+        frame_ms = mic.frame_len * 1000 / mic.rate
+        self.vad = Endpointer(frame_ms=frame_ms, hangover=hangover)
+
+    def _decode(self, audio, prompt):
+        return self.model.transcribe(audio, language=self.language, initial_prompt=prompt or None)
+
+    def transcribe_utterance(self, on_partial=None, since=None):
+        """
+        Waits for one utterance and returns its final transcript ("" if none).
+
+        on_partial, if given, is called with the running hypothesis text.
+        since, if given, is a MicStream position to start from instead of
+        now, e.g. where the child started talking over Buddy.
+        """
+        self.vad.reset()
+        listen_from = self.mic.position if since is None else since
+        start = None
+        committed = []
+        commit_pos = 0
+        last_decode = 0
+
+        for pos, frame in self.mic.frames(listen_from):
+            event = self.vad.push(frame)
+            end = pos + len(frame)
+
+            if start is None:
+                if event == "onset":
+                    start = max(listen_from, end - self.pre_roll - self.vad.onset_frames * len(frame))
+                    commit_pos = last_decode = start
+                elif end - listen_from >= self.start_samples:
+                    return ""
+                continue
+
+            if event == "end" or end - start >= self.max_samples:
+                break
+
+            if end - last_decode < self.step:
+                continue
+            last_decode = end
+
+            audio = self.mic.read(commit_pos, end)
+            result = self._decode(audio, " ".join(committed))
+            segments = result["segments"]
+            tail_text = result["text"].strip()
+
+            if len(audio) >= self.window:
+                # Commit segments that are safely behind the live edge
+                limit = len(audio) / self.mic.rate - self.overlap
+                done = [s for s in segments if s["end"] <= limit]
+                if done:
+                    committed.extend(s["text"].strip() for s in done)
+                    commit_pos += int(done[-1]["end"] * self.mic.rate)
+                    tail_text = " ".join(s["text"].strip() for s in segments[len(done):])
+
+            if on_partial:
+                on_partial(" ".join(committed + [tail_text]).strip())
+
+        if start is None:
+            return ""
+
+        tail = self.mic.read(commit_pos, self.mic.position)
+        if tail.size and np.max(np.abs(tail)) > 0:
+            committed.append(self._decode(tail, " ".join(committed))["text"].strip())
+        return " ".join(t for t in committed if t).strip()
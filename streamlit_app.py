@@ -1,19 +1,33 @@
 import streamlit as st
 import os
 import json
-import numpy as np
-import whisper
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from openai import OpenAI
-import tempfile
-from pathlib import Path
-
-# Load credentials from config.json
-def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), "config.json")
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"Config file not found: {config_path}")
-    with open(config_path, "r") as f:
+from http_clients import get_openai_client, get_session, configure_pools
+from audio_format import as_mono_float32, decode_wav, resample
+from whisper_loader import WhisperLoader
+from stt_backends import APIBackend
+from tts_cache import get_tts_cache, DEFAULT_CACHE_DIR
+from stt_cache import get_stt_cache, content_hash
+from tts import audio_format_key
+from tts_formats import FORMATS, browser_formats, negotiate, transcode_cached, join_clips
+from pipeline import Pipeline, Stage, run_turns
+from reply_stream import reply_sentences
+from phrase_bank import load_phrase_bank
+from conversation_memory import ConversationMemory, openai_summarizer
+from reply_cache import get_reply_cache, openai_embedder
+from tracing import tracer_from_config, NULL_TRACE
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
+
+# Load credentials from config.json, once per process (and again only after the file changes)
+@st.cache_resource
+def load_config(mtime=None):
+    if not os.path.exists(CONFIG_PATH):
+        raise FileNotFoundError(f"Config file not found: {CONFIG_PATH}")
+    with open(CONFIG_PATH, "r") as f:
         config = json.load(f)
     return config
 
@@ -22,94 +36,287 @@ st.set_page_config(page_title="TalkyBuddy", page_icon="🎨", layout="wide")
 st.title("🎨 TalkyBuddy - Learn English Together")
 
 # Load config and initialize clients
-config = load_config()
+config = load_config(os.path.getmtime(CONFIG_PATH) if os.path.exists(CONFIG_PATH) else None)
 OPENAI_KEY = config["openai_api_key"]
 DEEPGRAM_KEY = config["deepgram_api_key"]
-openai_client = OpenAI(api_key=OPENAI_KEY)
 
-# Load Whisper model once
+# Clients and caches are built once per process and shared by every rerun and browser session
+@st.cache_resource
+def get_clients():
+    # Keep-alive connection pools
+    configure_pools(config.get("http_pool_sizes", {}))
+    client = get_openai_client(OPENAI_KEY)
+    # Synthesized phrases and replies to frequent utterances
+    tts = get_tts_cache(config.get("tts_cache_dir", DEFAULT_CACHE_DIR), config.get("tts_cache_mb", 200))
+    replies = get_reply_cache(ttl=config.get("reply_cache_ttl", 6 * 3600),
+                              embed=openai_embedder(client) if config.get("reply_cache_semantic", False) else None)
+    # Transcripts by audio hash, so reruns and resubmitted recordings skip Whisper (in memory unless "stt_cache_dir" is set)
+    transcripts = get_stt_cache(config.get("stt_cache_dir"), config.get("stt_cache_items", 256),
+                                ttl=config.get("stt_cache_ttl", 24 * 3600))
+    return client, tts, replies, transcripts
+
+openai_client, tts_cache, reply_cache, stt_cache = get_clients()
+
+# Turns run here instead of on the script thread, so the page stays responsive while Buddy answers
+@st.cache_resource
+def get_turn_workers():
+    return ThreadPoolExecutor(max_workers=config.get("streamlit_turn_workers", 8), thread_name_prefix="turn")
+
+turn_workers = get_turn_workers()
+
+# Load Whisper model once per process, in the background so the page renders right away
 @st.cache_resource
 def load_whisper_model():
-    try:
-        model = whisper.load_model("base")
-        return model
-    except Exception as e:
-        st.error(f"Error loading Whisper model: {e}")
-        return None
+    return WhisperLoader(config.get("whisper_model", "base"), warmup=config.get("whisper_warmup", True),
+                         engine=config.get("stt_engine", "whisper"), client=openai_client,
+                         **config.get("stt_options", {})).start()
 
-whisper_model = load_whisper_model()
+whisper_loader = load_whisper_model()
+# Until the local model is ready, transcribe with the OpenAI API instead of waiting for it
+WHISPER_API_FALLBACK = config.get("whisper_api_fallback", True)
+if whisper_loader.error:
+    st.error(f"Error loading Whisper model: {whisper_loader.error}")
 
-def transcribe_audio(audio_bytes, sample_rate=16000):
-    """Transcribe audio using local Whisper"""
-    try:
-        # Save audio to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            import soundfile as sf
-            sf.write(tmp_file.name, audio_bytes, sample_rate)
-            tmp_path = tmp_file.name
-        
-        # Transcribe
-        result = whisper_model.transcribe(tmp_path, language="en")
-        text = result["text"].strip()
-        
-        # Clean up
-        os.unlink(tmp_path)
-        
-        return text
-    except Exception as e:
-        st.error(f"Transcription error: {e}")
-        return ""
+# Pre-rendered fixed phrases, loaded once per process for each format sessions negotiate
+@st.cache_resource
+def get_phrase_bank(tts_format):
+    return load_phrase_bank(DEEPGRAM_KEY, config.get("lesson_openers", []), **FORMATS[tts_format]["params"])
+
+# Per-turn stage timings for every session ("trace_file" and/or "metrics_port"), set up once per process
+@st.cache_resource
+def get_tracer():
+    return tracer_from_config(config)
+
+tracer = get_tracer()
+
+def play_phrase(name):
+    """Plays a pre-rendered phrase in the browser, in the session's negotiated format (no TTS request)"""
+    tts_format = st.session_state.tts_format
+    audio = get_phrase_bank(tts_format).get(name)
+    if audio:
+        st.audio(bytes(audio), format=FORMATS[tts_format]["mime"], autoplay=True)
 
-def get_chat_response(user_text, messages):
-    """Get response from GPT-4o-mini"""
+def transcribe_audio(audio_array, sample_rate=16000):
+    """Transcribe a 16 kHz mono float32 array using local Whisper (no temp file or ffmpeg).
+    Audio transcribed before (same samples) is answered from the transcript cache."""
+    if sample_rate != 16000:
+        raise ValueError(f"Whisper expects 16000 Hz audio, got {sample_rate} Hz")
+    
+    whisper_model = whisper_loader.get(timeout=0 if WHISPER_API_FALLBACK else None)
+    engine = f"{config.get('stt_engine', 'whisper')}-{config.get('whisper_model', 'base')}"
+    if whisper_model is None:
+        # Local model still loading (or failed): use the OpenAI API with an in-memory WAV
+        whisper_model = APIBackend(openai_client)
+        engine = f"api-{whisper_model.model}"
+    
+    # Transcribe straight from memory
+    return stt_cache.get_or_transcribe(as_mono_float32(audio_array),
+                                       lambda audio: whisper_model.transcribe(audio, language="en")["text"].strip(),
+                                       model=engine)
+
+def get_deepgram_tts(text, tts_format="mp3"):
+    """Generate speech using Deepgram in `tts_format` (see tts_formats.FORMATS).
+    Repeated phrases come from the TTS cache, transcoded if only another format is cached.
+    Raises RuntimeError with a message for the page on failure."""
+    params = FORMATS[tts_format]["params"]
+    encoding = audio_format_key(params)
+    cached = tts_cache.get(text, "aura-asteria-en", encoding) or transcode_cached(text, "aura-asteria-en",
+                                                                                  tts_format, tts_cache)
+    if cached is not None:
+        return cached
+    
+    url = "https://api.deepgram.com/v1/speak"
+    headers = {
+        "Authorization": f"Token {DEEPGRAM_KEY.strip()}",
+        "Content-Type": "application/json"
+    }
+    payload = {"text": text}
+    
     try:
-        messages.append({"role": "user", "content": user_text})
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
-        ai_text = response.choices[0].message.content
-        messages.append({"role": "assistant", "content": ai_text})
-        return ai_text, messages
+        response = get_session().post(url, params={"model": "aura-asteria-en", **params}, headers=headers,
+                                      json=payload, timeout=30)
+    except requests.exceptions.Timeout:
+        raise RuntimeError("❌ TTS timeout - Deepgram took too long to respond")
     except Exception as e:
-        st.error(f"Chat error: {e}")
-        return "", messages
+        raise RuntimeError(f"❌ TTS error: {str(e)}")
+    
+    if response.status_code == 200:
+        tts_cache.put(text, "aura-asteria-en", response.content, encoding)
+        return response.content
+    elif response.status_code == 401:
+        raise RuntimeError("❌ Deepgram API Key Error - check your config.json")
+    elif response.status_code == 429:
+        raise RuntimeError("❌ Rate limit exceeded - please wait a moment")
+    else:
+        raise RuntimeError(f"❌ Deepgram error: {response.status_code}\n{response.text}")
+
+class Turn:
+    """
+    One conversation turn, processed on a turn worker.
+    The worker only writes to this object (st.session_state and the page
+    belong to the script thread); the page polls it until `done` is set.
+    """
 
-def get_deepgram_tts(text):
-    """Generate speech using Deepgram"""
+    def __init__(self, generation, user_text=None, wav=None):
+        self.generation = generation  # the conversation it belongs to (see ConversationMemory.generation)
+        self.user_text = user_text
+        self.wav = wav
+        self.status = "⏳ Transcribing..." if wav is not None else "⏳ Thinking..."
+        self.reply = None
+        self.audio = None
+        self.errors = []
+        self.done = threading.Event()
+        self.refreshed = False
+        self.played = False
+
+def process_turn(turn, messages, memory, tts_format, trace=NULL_TRACE):
+    """Runs one turn on a turn worker, then ends its trace: transcription, then the reply
+    streamed through the conversation pipeline (think → speak), so each sentence is synthesized
+    while the rest of the reply is still being written. Frequent utterances are answered from
+    the reply cache. Appends to `messages`/`memory` (the session's own objects) and leaves the
+    results on `turn`; the sentences' audio is joined into one clip for the page."""
     try:
-        url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
-        headers = {
-            "Authorization": f"Token {DEEPGRAM_KEY.strip()}",
-            "Content-Type": "application/json"
-        }
-        payload = {"text": text}
-        
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        if turn.wav is not None:
+            # Decode the WAV payload (header skipped, PCM viewed in place); the browser did the recording
+            try:
+                with trace.span("capture"):
+                    audio_array, audio_rate = decode_wav(turn.wav)
+                    audio_array = resample(audio_array, audio_rate, 16000)
+            except ValueError as e:
+                turn.errors.append(f"Audio format error: {e}")
+                return
+            try:
+                with trace.span("stt"):
+                    turn.user_text = transcribe_audio(audio_array, sample_rate=16000) if len(audio_array) else ""
+            except Exception as e:
+                turn.errors.append(f"Transcription error: {e}")
+                return
+            if not turn.user_text:
+                return
         
-        if response.status_code == 200:
-            return response.content
-        elif response.status_code == 401:
-            st.error("❌ Deepgram API Key Error - check your config.json")
-            return None
-        elif response.status_code == 429:
-            st.error("❌ Rate limit exceeded - please wait a moment")
-            return None
-        else:
-            st.error(f"❌ Deepgram error: {response.status_code}\n{response.text}")
-            return None
-    except requests.exceptions.Timeout:
-        st.error("❌ TTS timeout - Deepgram took too long to respond")
-        return None
-    except Exception as e:
-        st.error(f"❌ TTS error: {str(e)}")
-        return None
+        turn.status = "⏳ Thinking..."
+        messages.append({"role": "user", "content": turn.user_text})
+        parts = []
+
+        def think(text):
+            yield from reply_sentences(openai_client, memory, text, reply_cache, on_text=parts.append,
+                                       trace=trace, generation=turn.generation)
+            turn.reply = "".join(parts)
+            messages.append({"role": "assistant", "content": turn.reply})
+
+        def speak(sentence):
+            turn.status = "🔊 Generating speech..."
+            trace.count("tts_chars", len(sentence))
+            try:
+                with trace.span("tts") as span:
+                    audio = get_deepgram_tts(sentence, tts_format)
+                    span.first("tts_first_byte")
+            except RuntimeError as e:
+                turn.errors.append(str(e))
+                return None
+            return audio
+
+        try:
+            clips = run_turns(Pipeline(Stage("think", think), Stage("speak", speak, workers=2)), [turn.user_text])
+        except Exception as e:
+            turn.errors.append(f"Chat error: {e}")
+            return
+        if turn.errors:
+            return
+        turn.audio = join_clips(clips, tts_format)
+        trace.mark("playback_start")  # handed to the page, which shows the player on its next poll
+    finally:
+        trace.end()
+        turn.done.set()
+
+def start_turn(**kwargs):
+    """Hands a turn to the worker pool and returns right away."""
+    turn = Turn(st.session_state.memory.generation, **kwargs)
+    st.session_state.turn = turn
+    turn_workers.submit(process_turn, turn, st.session_state.messages, st.session_state.memory,
+                        st.session_state.tts_format, tracer.turn("streamlit"))
+
+def turn_busy():
+    turn = st.session_state.get("turn")
+    return turn is not None and not turn.done.is_set()
+
+def show_turn():
+    """The turn in progress (its stage so far) or, once it's done, its results.
+    A finished turn stays on the page across reruns, but its phrases autoplay only once."""
+    turn = st.session_state.get("turn")
+    if turn is None:
+        return
+    if not turn.done.is_set():
+        if turn.user_text:
+            st.success(f"👦 You: {turn.user_text}")
+        st.info(turn.status)
+        return
+    if not turn.refreshed:
+        # Rerun the whole page once, so the history picks up the new messages
+        turn.refreshed = True
+        st.rerun()
+    first_show, turn.played = not turn.played, True
+    
+    for error in turn.errors:
+        st.error(error)
+    if turn.wav is not None and not turn.user_text:
+        st.warning("⚠️ Couldn't understand. Try again!")
+        if first_show:
+            play_phrase("retry")
+    if turn.reply:
+        st.success(f"🤖 Buddy: {turn.reply}")
+    if turn.audio:
+        st.audio(turn.audio, format=FORMATS[st.session_state.tts_format]["mime"])
+        st.success("✅ Done!")
+
+# How often the page checks on a turn in progress (seconds)
+POLL_SECONDS = 0.3
+# st.fragment reruns just the turn panel while polling (Streamlit 1.37+; older versions rerun the page)
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+# Messages shown as chat bubbles; earlier ones are collapsed into one transcript block
+RECENT_MESSAGES = 10
+
+def format_message(message):
+    return f"👦 You: {message['content']}" if message["role"] == "user" else f"🤖 Buddy: {message['content']}"
+
+def render_history(messages):
+    """Shows the conversation. Messages leaving the recent window are formatted once, appended
+    to the session's transcript, and shown as a single block, so a rerun costs about the same
+    however long the conversation gets."""
+    history = messages[1:]  # Skip system message
+    older = history[:max(0, len(history) - RECENT_MESSAGES)]
+    if st.session_state.transcript_count > len(older):  # conversation was cleared
+        st.session_state.transcript, st.session_state.transcript_count = "", 0
+    for message in older[st.session_state.transcript_count:]:
+        st.session_state.transcript += format_message(message) + "\n\n"
+    st.session_state.transcript_count = len(older)
+    
+    if older:
+        with st.expander(f"📜 Earlier messages ({len(older)})"):
+            st.markdown(st.session_state.transcript)
+    for message in history[len(older):]:
+        st.chat_message(message["role"]).write(format_message(message))
 
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = [
         {"role": "system", "content": "You are a patient, friendly English teacher for kids. Keep responses short and simple. Ask one question at a time."}
     ]
+if "tts_format" not in st.session_state:
+    # Smallest payload that sounds good and this browser plays: Opus at a low bitrate where supported.
+    # client_bandwidth_kbps (per tablet on a shared Wi-Fi) steps down to smaller formats.
+    headers = getattr(getattr(st, "context", None), "headers", None) or {}
+    st.session_state.tts_format = negotiate(config.get("tts_web_formats", ["opus-24", "mp3"]),
+                                            browser_formats(headers.get("User-Agent", "")),
+                                            config.get("client_bandwidth_kbps"))
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory(
+        st.session_state.messages[0]["content"],
+        max_prompt_tokens=config.get("max_prompt_tokens", 1500),
+        summarize=openai_summarizer(openai_client))
+if "transcript" not in st.session_state:
+    st.session_state.transcript, st.session_state.transcript_count = "", 0
 
 # Sidebar
 with st.sidebar:
@@ -119,11 +326,20 @@ with st.sidebar:
     st.write("**Recording Settings**")
     duration = st.slider("Recording duration (seconds)", 3, 15, 8)
     st.divider()
+    cache_stats = tts_cache.stats()
+    st.caption(f"🔊 TTS cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+    st.caption(f"📏 Last prompt: {st.session_state.memory.last_prompt_tokens} tokens")
+    st.caption(f"💬 Reply cache: {reply_cache.stats()['hits']} hits")
+    st.caption(f"📝 Transcript cache: {stt_cache.stats()['hits']} hits")
     if st.button("🔄 Clear Conversation"):
         st.session_state.messages = [
             {"role": "system", "content": "You are a patient, friendly English teacher for kids. Keep responses short and simple. Ask one question at a time."}
         ]
+        st.session_state.memory.clear()
+        st.session_state.transcript, st.session_state.transcript_count = "", 0
+        st.session_state.pop("turn", None)
         st.success("Conversation cleared!")
+        play_phrase("cleared")
 
 # Main chat interface
 st.write("👋 Welcome! Let's practice English together.")
@@ -131,11 +347,7 @@ st.write("👋 Welcome! Let's practice English together.")
 # Display conversation history
 chat_container = st.container()
 with chat_container:
-    for message in st.session_state.messages[1:]:  # Skip system message
-        if message["role"] == "user":
-            st.chat_message("user").write(f"👦 You: {message['content']}")
-        else:
-            st.chat_message("assistant").write(f"🤖 Buddy: {message['content']}")
+    render_history(st.session_state.messages)
 
 st.divider()
 
@@ -145,66 +357,38 @@ if input_mode == "🎤 Voice":
     st.info("📌 Click the microphone icon → Speak → Click stop button → Wait for transcription", icon="ℹ️")
     audio_data = st.audio_input("Click microphone to record", sample_rate=16000)
     
-    if audio_data and "last_audio" not in st.session_state:
-        st.session_state.last_audio = audio_data
-        st.write("🎧 Processing your audio...")
-        
-        # Convert audio data
-        audio_array = np.frombuffer(audio_data.getbuffer(), dtype=np.int16).astype(np.float32) / 32768.0
-        
-        # Transcribe
-        with st.spinner("⏳ Transcribing..."):
-            user_text = transcribe_audio(audio_array, sample_rate=16000)
-        
-        if user_text:
-            st.success(f"👦 You: {user_text}")
-            
-            # Get response
-            with st.spinner("⏳ Thinking..."):
-                ai_response, st.session_state.messages = get_chat_response(user_text, st.session_state.messages)
-            
-            if ai_response:
-                st.success(f"🤖 Buddy: {ai_response}")
-                
-                # Generate speech
-                with st.spinner("🔊 Generating speech..."):
-                    audio_bytes = get_deepgram_tts(ai_response)
-                
-                if audio_bytes:
-                    st.audio(audio_bytes, format="audio/mp3")
-                    st.success("✅ Done!")
+    # Every rerun sees the widget's current recording again: start a turn only for one not sent yet
+    audio_hash = content_hash(audio_data.getbuffer()) if audio_data else None
+    if audio_hash and audio_hash != st.session_state.get("last_audio_hash"):
+        if turn_busy():
+            # Picked up by the rerun that follows the current turn
+            st.caption("⏳ Buddy is still answering - your recording is next")
         else:
-            st.warning("⚠️ Couldn't understand. Try again!")
-    elif audio_data is None:
-        # Reset when user clears the recording
-        if "last_audio" in st.session_state:
-            del st.session_state.last_audio
+            st.session_state.last_audio_hash = audio_hash
+            start_turn(wav=audio_data.getvalue())
 
 else:  # Text input
     st.subheader("⌨️ Text Input")
     user_text = st.text_input("Type your message:")
     
     if st.button("📨 Send Message", use_container_width=True, type="primary"):
-        if user_text:
-            st.write(f"👦 You: {user_text}")
-            
-            # Get response
-            with st.spinner("⏳ Thinking..."):
-                ai_response, st.session_state.messages = get_chat_response(user_text, st.session_state.messages)
-            
-            if ai_response:
-                st.success(f"🤖 Buddy: {ai_response}")
-                
-                # Generate speech
-                with st.spinner("🔊 Generating speech..."):
-                    audio_bytes = get_deepgram_tts(ai_response)
-                
-                if audio_bytes:
-                    st.audio(audio_bytes, format="audio/mp3")
-                    st.success("✅ Done!")
-        else:
+        if not user_text:
             st.warning("Please type a message first!")
+        elif turn_busy():
+            st.warning("⏳ Buddy is still answering - send it again in a moment")
+        else:
+            start_turn(user_text=user_text)
+
+# Current turn: polled until its worker finishes
+if fragment is not None:
+    fragment(show_turn, run_every=POLL_SECONDS if turn_busy() else None)()
+else:
+    show_turn()
 
 # Footer
 st.divider()
 st.caption("🎨 TalkyBuddy - Your friendly English learning companion")
+
+if fragment is None and turn_busy():
+    time.sleep(POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1,184 @@
+import threading
+import numpy as np
+from audio_format import WHISPER_RATE, as_mono_float32, wav_file
+from http_clients import get_session
+
+ENGINES = ("whisper", "faster-whisper", "api", "server")
+# Content type for raw little-endian float32 mono PCM (what the speech server accepts besides WAV)
+PCM_TYPE = "audio/x-float32"
+DEFAULT_SERVER_URL = "http://127.0.0.1:8765"
+
+
+class WhisperBackend:
+    """
+    openai-whisper on PyTorch (the original engine).
+
+    Calls are serialized: whisper installs its decoding cache hooks on the
+    shared model, so two transcriptions can't run on it at the same time.
+
+    Args:
+        model_name: Whisper model size ("tiny", "base", ...)
+        device: Torch device, or None to let whisper choose
+    """
+
+    local = True
+
+    def __init__(self, model_name="base", device=None):
+        import whisper
+        self.model = whisper.load_model(model_name, device=device)
+        self.fp16 = self.model.device.type != "cpu"
+        self._lock = threading.Lock()
+
+    def transcribe(self, audio, language="en", initial_prompt=None):
+        with self._lock:
+            result = self.model.transcribe(as_mono_float32(audio), language=language, fp16=self.fp16,
+                                           condition_on_previous_text=False, initial_prompt=initial_prompt)
+        return {
+            "text": result["text"].strip(),
+            "segments": [{"start": s["start"], "end": s["end"], "text": s["text"]} for s in result["segments"]],
+            "language": result.get("language", language),
+        }
+
+    def transcribe_batch(self, audios, language="en", initial_prompt=None):
+        """
+        Transcribes several clips with one batched encoder/decoder pass.
+        Each clip is padded to Whisper's 30 s window; longer clips fall back
+        to transcribe(). Each result has a single segment spanning the clip.
+        """
+        import torch
+        import whisper
+        if any(len(audio) > whisper.audio.N_SAMPLES for audio in audios):
+            return [self.transcribe(audio, language, initial_prompt) for audio in audios]
+
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(np.array(as_mono_float32(audio)))),
+                                        self.model.dims.n_mels)
+            for audio in audios
+        ]).to(self.model.device)
+        options = whisper.DecodingOptions(language=language, prompt=initial_prompt, fp16=self.fp16,
+                                          without_timestamps=True)
+        with self._lock:
+            decoded = whisper.decode(self.model, mel, options)
+
+        results = []
+        for audio, r in zip(audios, decoded):
+            # Same no-speech rule as whisper.transcribe(), so silence doesn't turn into text
+            silent = r.no_speech_prob > 0.6 and r.avg_logprob < -1.0
+            text = "" if silent else r.text.strip()
+            segments = [{"start": 0.0, "end": len(audio) / WHISPER_RATE, "text": text}] if text else []
+            results.append({"text": text, "segments": segments, "language": language})
+        return results
+
+
+class FasterWhisperBackend:
+    """
+    int8-quantized Whisper on CPU via faster-whisper (CTranslate2).
+
+    Several times faster than PyTorch on CPU-only machines, with a much
+    smaller memory footprint, for the same model sizes.
+
+    Args:
+        model_name: Whisper model size ("tiny", "base", ...) or a converted model directory
+        compute_type: CTranslate2 quantization ("int8", "int8_float32", "float32", ...)
+        cpu_threads: Threads per transcription (0 lets CTranslate2 decide)
+        beam_size: 1 is greedy decoding, like openai-whisper's default
+        num_workers: Transcriptions that may run in parallel from different threads
+    """
+
+    local = True
+
+    def __init__(self, model_name="base", compute_type="int8", cpu_threads=0, beam_size=1, num_workers=1):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_name, device="cpu", compute_type=compute_type,
+                                  cpu_threads=cpu_threads, num_workers=num_workers)
+        self.beam_size = beam_size
+
+    def transcribe(self, audio, language="en", initial_prompt=None):
+        segments, info = self.model.transcribe(as_mono_float32(audio), language=language, beam_size=self.beam_size,
+                                               condition_on_previous_text=False, initial_prompt=initial_prompt)
+        segments = [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+        return {
+            "text": "".join(s["text"] for s in segments).strip(),
+            "segments": segments,
+            "language": info.language,
+        }
+
+
+class APIBackend:
+    """
+    OpenAI's hosted whisper-1 (uploads an in-memory WAV).
+
+    Args:
+        client: OpenAI client
+        model: Transcription model
+    """
+
+    local = False
+
+    def __init__(self, client, model="whisper-1"):
+        self.client = client
+        self.model = model
+
+    def transcribe(self, audio, language="en", initial_prompt=None):
+        options = {"prompt": initial_prompt} if initial_prompt else {}
+        res = self.client.audio.transcriptions.create(model=self.model, file=wav_file(audio, WHISPER_RATE),
+                                                      language=language, response_format="verbose_json",
+                                                      **options)
+        segments = [{"start": s.start, "end": s.end, "text": s.text} for s in (res.segments or [])]
+        return {"text": res.text.strip(), "segments": segments, "language": language}
+
+
+class ServerBackend:
+    """
+    Whisper hosted by speech_server.py, so a whole classroom shares one model.
+
+    Audio is posted as raw float32 PCM over a pooled keep-alive connection.
+
+    Args:
+        url: Base URL of the speech server
+        timeout: Seconds to wait for a transcript (includes queueing on the server)
+    """
+
+    local = False
+
+    def __init__(self, url=DEFAULT_SERVER_URL, timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def transcribe(self, audio, language="en", initial_prompt=None):
+        params = {"rate": WHISPER_RATE, "language": language}
+        if initial_prompt:
+            params["prompt"] = initial_prompt
+        pcm = as_mono_float32(audio).astype("<f4", copy=False)
+        res = get_session().post(f"{self.url}/transcribe", params=params, data=pcm.tobytes(),
+                                 headers={"Content-Type": PCM_TYPE}, timeout=self.timeout)
+        res.raise_for_status()
+        result = res.json()
+        return {"text": result["text"], "segments": result["segments"], "language": result["language"]}
+
+
+def load_backend(engine="whisper", model_name="base", client=None, **options):
+    """
+    Creates the STT backend selected in config ("stt_engine").
+
+    Every backend has transcribe(audio, language="en", initial_prompt=None)
+    taking a 16 kHz mono float32 array and returning
+    {"text": ..., "segments": [{"start", "end", "text"}, ...], "language": ...}.
+    """
+    if engine == "whisper":
+        return WhisperBackend(model_name, **options)
+    if engine == "faster-whisper":
+        return FasterWhisperBackend(model_name, **options)
+    if engine == "api":
+        if client is None:
+            raise ValueError("The api STT engine needs an OpenAI client")
+        return APIBackend(client, **options)
+    if engine == "server":
+        return ServerBackend(**options)
+    raise ValueError(f"Unknown STT engine {engine!r} (expected one of {', '.join(ENGINES)})")
+
+
+def warm_up(backend):
+    """Runs one dummy transcription so the first real turn doesn't pay for kernel setup."""
+    if backend.local:
+        backend.transcribe(np.zeros(WHISPER_RATE, dtype=np.float32))
@@ -0,0 +1,82 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class BatchingBackend:
+    """
+    Collects concurrent transcription requests into batches for one model.
+
+    The first request starts a batch; requests arriving within `max_wait`
+    seconds (up to `max_batch` of them) join it, and the batch runs as a
+    single backend.transcribe_batch() call, so several children finishing
+    at once share one encoder/decoder pass. Requests with a different
+    language or prompt go into separate batches. Backends without
+    transcribe_batch() are called once per request, one after another, so
+    only wrap backends that have it.
+
+    Has the same transcribe() interface as the backends it wraps.
+
+    Args:
+        backend: Loaded STT backend (see stt_backends)
+        max_batch: Largest number of clips decoded together
+        max_wait: Seconds the first request of a batch waits for company
+    """
+
+    def __init__(self, backend, max_batch=8, max_wait=0.02):
+        self.backend = backend
+        self.local = backend.local
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.clips = 0
+        threading.Thread(target=self._schedule, daemon=True).start()
+
+    def transcribe(self, audio, language="en", initial_prompt=None):
+        future = Future()
+        self._requests.put((audio, language, initial_prompt, future))
+        return future.result()
+
+    def _schedule(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for request in batch:
+                groups.setdefault((request[1], request[2]), []).append(request)
+            for (language, prompt), requests in groups.items():
+                self._run(requests, language, prompt)
+
+    def _run(self, requests, language, prompt):
+        audios = [r[0] for r in requests]
+        try:
+            if hasattr(self.backend, "transcribe_batch") and len(audios) > 1:
+                results = self.backend.transcribe_batch(audios, language=language, initial_prompt=prompt)
+            else:
+                results = [self.backend.transcribe(a, language=language, initial_prompt=prompt) for a in audios]
+        except Exception as e:
+            for r in requests:
+                r[3].set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.clips += len(requests)
+        for r, result in zip(requests, results):
+            r[3].set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {"batches": self.batches, "clips": self.clips,
+                    "mean_batch": round(self.clips / self.batches, 2) if self.batches else 0.0}
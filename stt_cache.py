@@ -0,0 +1,179 @@
+import os
+import re
+import time
+import zlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def content_hash(buffer):
+    """
+    Fast (non-cryptographic) hash of a byte buffer: length plus CRC-32 and
+    Adler-32, both computed by zlib over the buffer in place.
+    """
+    view = memoryview(buffer).cast("B")
+    return f"{len(view):x}-{zlib.crc32(view):08x}{zlib.adler32(view):08x}"
+
+
+def audio_key(audio, language="en", model=""):
+    """
+    Cache key of a recording: the engine/model that transcribes it, the
+    transcription language and a hash of its raw float32 PCM samples.
+    """
+    model = re.sub(r"[^\w.-]", "_", model)
+    return f"{model}-{language}-{content_hash(np.ascontiguousarray(audio, dtype=np.float32))}"
+
+
+class TranscriptCache:
+    """
+    Transcripts keyed by a hash of the audio and the model that transcribed
+    it, so the same recording (a Streamlit rerun, retry or resubmission)
+    never goes through Whisper twice. Empty transcripts aren't cached: a
+    clip Whisper heard nothing in is worth another try.
+
+    Recent transcripts are kept in memory (LRU by count). Only with a
+    `directory` are they also stored as small text files, so they survive
+    a restart. These are children's words: files unused for `ttl` seconds
+    are deleted, and past `max_files` the least recently used are evicted.
+    As in TTSCache, access order on disk is the file mtime and writes are
+    atomic.
+
+    Args:
+        directory: Cache directory (created if missing), or None for memory only
+        memory_items: Number of transcripts kept in memory
+        max_files: Number of transcripts kept on disk
+        ttl: Seconds a transcript file is kept after its last use
+    """
+
+    def __init__(self, directory=None, memory_items=256, max_files=5000, ttl=24 * 3600):
+        self.directory = directory
+        self.memory_items = memory_items
+        self.max_files = max_files
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._files = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.evict()  # drops files that expired while nothing was running
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _entries(self):
+        """Yields (path, mtime) for every cached transcript."""
+        for name in os.listdir(self.directory):
+            if name.startswith("."):
+                continue  # partial write of another process
+            path = os.path.join(self.directory, name)
+            try:
+                yield path, os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, audio, language="en", model=""):
+        """Returns the cached transcript of a recording, or None on a miss."""
+        key = audio_key(audio, language, model)
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return text
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                if time.time() - os.stat(path).st_mtime > self.ttl:
+                    os.remove(path)  # expired
+                else:
+                    with open(path, "r", encoding="utf-8") as f:
+                        text = f.read()
+                    os.utime(path)  # mark as recently used
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._remember(key, text)
+        return text
+
+    def put(self, audio, text, language="en", model=""):
+        """Stores a recording's transcript (empty ones are skipped)."""
+        if not text:
+            return
+        key = audio_key(audio, language, model)
+        with self._lock:
+            self._remember(key, text)
+        if not self.directory:
+            return
+
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        existed = os.path.exists(path)
+        os.replace(tmp, path)
+        with self._lock:
+            self._files += not existed
+            over = self._files > self.max_files
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Deletes expired files, then least-recently-used ones down to 90% of max_files
+        (so eviction doesn't run on every put)."""
+        cutoff = time.time() - self.ttl
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        keep = min(int(self.max_files * 0.9), sum(1 for _, mtime in entries if mtime > cutoff))
+        for path, _ in entries[:len(entries) - keep]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already evicted by another process
+        with self._lock:
+            self._files = keep
+
+    def get_or_transcribe(self, audio, transcribe, language="en", model=""):
+        """Returns the cached transcript, or calls transcribe(audio) and caches its result (errors aren't cached)."""
+        text = self.get(audio, language, model)
+        if text is None:
+            text = transcribe(audio)
+            self.put(audio, text, language, model)
+        return text
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": self._files,
+            }
+
+
+def get_stt_cache(directory=None, memory_items=256, max_files=5000, ttl=24 * 3600):
+    """Returns the process-wide TranscriptCache, created on first use (shared by all Streamlit sessions)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = TranscriptCache(directory, memory_items=memory_items, max_files=max_files, ttl=ttl)
+        return _shared
@@ -0,0 +1,58 @@
+import time
+import threading
+import contextvars
+from pipeline import Pipeline, Stage, run_turns
+
+
+def test_interrupt_discards_item_waiting_for_busy_worker():
+    played, discarded = [], []
+    started = threading.Event()
+
+    def split(_):
+        yield from (1, 2, 3, 4)
+
+    def play(n):
+        if n == 2:
+            started.set()
+            time.sleep(0.2)  # item 3 is taken from the queue and waits for this worker
+        played.append(n)
+
+    pipeline = Pipeline(Stage("split", split), Stage("play", play, discard=discarded.append))
+
+    def interrupt():
+        started.wait(5)
+        time.sleep(0.05)
+        pipeline.interrupt()
+
+    threading.Thread(target=interrupt, daemon=True).start()
+    run_turns(pipeline, [None])
+
+    assert played == [1, 2]
+    assert 3 in discarded
+
+
+def test_outputs_keep_input_order():
+    def double(n):
+        time.sleep(0.01 * (5 - n))
+        return n * 2
+
+    assert run_turns(Pipeline(Stage("double", double, workers=3)), range(5)) == [0, 2, 4, 6, 8]
+
+
+def test_stages_see_context_of_their_turn():
+    current = contextvars.ContextVar("current")
+
+    async def source():
+        for n in range(3):
+            current.set(n)  # e.g. Tracer.turn() before each turn
+            yield n
+
+    def split(n):
+        yield from (n, n)
+
+    def check(n):
+        return n, current.get()
+
+    pipeline = Pipeline(Stage("split", split), Stage("check", check, workers=2),
+                        Stage("daemon", lambda pair: pair + (current.get(),), thread="daemon"))
+    assert run_turns(pipeline, source()) == [(n, n, n) for n in range(3) for _ in range(2)]
@@ -0,0 +1,278 @@
+import json
+import time
+import threading
+import itertools
+import contextlib
+import contextvars
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Histogram buckets in seconds, from TTS first bytes up to whole turns
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    """
+    A timed stage of a turn; first(name) records how long into the stage something first happened.
+    Time spent inside `with span.pause():` (e.g. a generator waiting for the next stage to take its
+    output) isn't counted.
+    """
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.paused = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.trace.spans.append({"name": self.name, "start": round(self.start - self.trace.t0, 4),
+                                 "duration": round(end - self.start - self.paused, 4)})
+        if self.name == "capture":
+            self.trace.capture_end = end
+
+    @contextlib.contextmanager
+    def pause(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.paused += time.perf_counter() - started
+
+    def first(self, name):
+        if name not in self.trace.events:
+            self.trace.events[name] = round(time.perf_counter() - self.start - self.paused, 4)
+
+
+class TurnTrace:
+    """
+    Timings and counts for one conversation turn.
+
+    Use `with trace.span("stt"):` around stages, span.first("llm_first_token")
+    for latencies within a stage, trace.mark("playback_start") for moments
+    relative to the start of the turn and trace.count("reply_chars", n) for
+    sizes. end() writes the record and updates the metrics.
+    """
+
+    enabled = True
+
+    def __init__(self, tracer, frontend):
+        self.tracer = tracer
+        self.frontend = frontend
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.capture_end = None
+        self.spans = []
+        self.events = {}
+        self.counts = {}
+        self._ended = False
+
+    def span(self, name):
+        return Span(self, name)
+
+    def mark(self, name):
+        """Records the first time `name` happens, in seconds since the turn started."""
+        if name not in self.events:
+            now = time.perf_counter()
+            self.events[name] = round(now - self.t0, 4)
+            if name == "playback_start" and self.capture_end is not None:
+                self.events["time_to_first_audio"] = round(now - self.capture_end, 4)
+
+    def count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def end(self):
+        if self._ended:
+            return
+        self._ended = True
+        self.tracer._record(self, time.perf_counter() - self.t0)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def first(self, name):
+        pass
+
+    def pause(self):
+        return self
+
+
+class _NullTrace:
+    """What a disabled tracer hands out: every call is a no-op."""
+
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name):
+        return self._span
+
+    def mark(self, name):
+        pass
+
+    def count(self, name, n):
+        pass
+
+    def end(self):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Tracer:
+    """
+    Collects per-turn traces: one JSON line per turn in `path` (if given) and
+    Prometheus metrics (see render_metrics() and serve_metrics()).
+
+    When disabled, turn() returns NULL_TRACE, so instrumented code costs a
+    few no-op method calls per turn.
+
+    Args:
+        path: JSONL file to append turn records to, or None
+        enabled: Collect anything at all
+    """
+
+    def __init__(self, path=None, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        # Turn in progress in this context: per thread, and per pipeline turn (see pipeline.Turn)
+        self._current = contextvars.ContextVar("current_trace", default=NULL_TRACE)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._file = None
+        self.turns = {}
+        self.histograms = {}
+        self.totals = {}
+
+    @property
+    def current(self):
+        """The turn started by turn() in this thread or pipeline turn, or NULL_TRACE."""
+        return self._current.get()
+
+    def turn(self, frontend=""):
+        """Starts tracing a new turn (and makes it the current one in this context)."""
+        if not self.enabled:
+            return NULL_TRACE
+        trace = TurnTrace(self, frontend)
+        self._current.set(trace)
+        return trace
+
+    def _record(self, trace, duration):
+        record = {
+            "turn": next(self._ids),
+            "frontend": trace.frontend,
+            "time": round(trace.started, 3),
+            "duration": round(duration, 4),
+            "spans": trace.spans,
+            "events": trace.events,
+            "counts": trace.counts,
+        }
+        with self._lock:
+            self.turns[trace.frontend] = self.turns.get(trace.frontend, 0) + 1
+            self._observe(("turn_seconds", ""), duration)
+            for span in trace.spans:
+                self._observe(("stage_seconds", span["name"]), span["duration"])
+            for name, value in trace.events.items():
+                self._observe(("event_seconds", name), value)
+            for name, n in trace.counts.items():
+                self.totals[name] = self.totals.get(name, 0) + n
+            if self.path:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.flush()
+        if self._current.get() is trace:
+            self._current.set(NULL_TRACE)
+
+    def _observe(self, key, value):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def render_metrics(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = ["# TYPE talkybuddy_turns_total counter"]
+        with self._lock:
+            for frontend, n in sorted(self.turns.items()):
+                lines.append(f'talkybuddy_turns_total{{frontend="{frontend}"}} {n}')
+            for metric, label in (("turn_seconds", None), ("stage_seconds", "stage"), ("event_seconds", "event")):
+                lines.append(f"# TYPE talkybuddy_{metric} histogram")
+                for (name, value), histogram in sorted(self.histograms.items()):
+                    if name != metric:
+                        continue
+                    labels = f'{label}="{value}",' if label else ""
+                    for bound, n in zip(BUCKETS, histogram.counts):
+                        lines.append(f'talkybuddy_{metric}_bucket{{{labels}le="{bound}"}} {n}')
+                    lines.append(f'talkybuddy_{metric}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+                    suffix = f"{{{labels.rstrip(',')}}}" if label else ""
+                    lines.append(f"talkybuddy_{metric}_sum{suffix} {histogram.sum:.4f}")
+                    lines.append(f"talkybuddy_{metric}_count{suffix} {histogram.count}")
+            for name, n in sorted(self.totals.items()):
+                lines.append(f"# TYPE talkybuddy_{name}_total counter")
+                lines.append(f"talkybuddy_{name}_total {n}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics in the Prometheus text format."""
+
+    tracer = None  # set by serve_metrics()
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.tracer.render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(tracer, port=9464, host="127.0.0.1"):
+    """Serves tracer metrics at http://host:port/metrics on a background thread."""
+    handler = type("Handler", (MetricsHandler,), {"tracer": tracer})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def tracer_from_config(config):
+    """
+    Builds the tracer configured in config.json:
+    "trace_file" (JSONL path) and/or "metrics_port" turn tracing on.
+    """
+    trace_file = config.get("trace_file")
+    metrics_port = config.get("metrics_port")
+    tracer = Tracer(trace_file, enabled=bool(trace_file or metrics_port))
+    if metrics_port:
+        serve_metrics(tracer, int(metrics_port), config.get("metrics_host", "127.0.0.1"))
+    return tracer
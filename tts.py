@@ -0,0 +1,433 @@
+import time
+import queue
+import shutil
+import threading
+import subprocess
+from http_clients import get_session
+
+try:
+    import sounddevice as sd
+except (ImportError, OSError):  # no PortAudio: only the external players are available
+    sd = None
+
+DEEPGRAM_SPEAK_URL = "https://api.deepgram.com/v1/speak"
+# Sample rates Deepgram renders linear16 at
+DEEPGRAM_PCM_RATES = (8000, 16000, 24000, 32000, 48000)
+_DONE = object()
+
+
+def audio_format_key(params):
+    """Cache label for the requested audio format, e.g. "mp3" or "linear16-24000"."""
+    if not params:
+        return "mp3"
+    return "-".join(str(params[k]) for k in sorted(params))
+
+
+class CachedAudio:
+    """Serves cached audio bytes through the same iter_content() interface as a streaming response."""
+
+    def __init__(self, audio):
+        self.content = audio
+
+    def iter_content(self, chunk_size=4096):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _CachingStream:
+    """Passes a streaming response through and stores the full clip in the cache once it completes."""
+
+    def __init__(self, response, cache, text, model, audio_format):
+        self.response = response
+        self._store = (cache, text, model, audio_format)
+
+    def iter_content(self, chunk_size=4096):
+        parts = []
+        for chunk in self.response.iter_content(chunk_size=chunk_size):
+            parts.append(chunk)
+            yield chunk
+        cache, text, model, audio_format = self._store
+        cache.put(text, model, b"".join(parts), audio_format)
+
+    def close(self):
+        self.response.close()
+
+
+def open_deepgram_stream(text, api_key, model="aura-asteria-en", timeout=30, cache=None,
+                         url=DEEPGRAM_SPEAK_URL, **params):
+    """
+    Starts a Deepgram speak request and returns the response without reading
+    the body, so audio can be consumed chunk by chunk as it arrives.
+
+    Extra keyword arguments become query parameters (encoding, sample_rate, ...).
+    With a TTSCache, cached phrases are replayed without any request and new
+    ones are stored once fully streamed.
+    `url` can point at another speak endpoint (e.g. a local stand-in).
+    Returns None if Deepgram answers with an error.
+    """
+    audio_format = audio_format_key(params)
+    if cache is not None:
+        audio = cache.get(text, model, audio_format)
+        if audio is not None:
+            return CachedAudio(audio)
+
+    headers = {
+        "Authorization": f"Token {api_key.strip()}",
+        "Content-Type": "application/json"
+    }
+    response = get_session().post(url, params={"model": model, **params},
+                                  headers=headers, json={"text": text}, stream=True, timeout=timeout)
+    if response.status_code != 200:
+        print(f"❌ Deepgram Error: {response.status_code} - {response.text}")
+        response.close()
+        return None
+    if cache is not None:
+        return _CachingStream(response, cache, text, model, audio_format)
+    return response
+
+
+def fetch_deepgram_tts(text, api_key, model="aura-asteria-en", timeout=30, cache=None, **params):
+    """Returns the complete synthesized clip as bytes (None on error)."""
+    response = open_deepgram_stream(text, api_key, model=model, timeout=timeout, cache=cache, **params)
+    if response is None:
+        return None
+    try:
+        return b"".join(response.iter_content(chunk_size=16384))
+    finally:
+        response.close()
+
+
+def stream_player_command():
+    """Returns a command that plays MP3 from stdin, or None if no such player is installed."""
+    if shutil.which("ffplay"):
+        return ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-i", "-"]
+    if shutil.which("mpg123"):
+        return ["mpg123", "-q", "-"]
+    return None
+
+
+class PlayerSink:
+    """
+    Pipes encoded audio into an external player's stdin as it arrives.
+    Writes block while the pipe is full, which throttles the reader.
+    """
+
+    def __init__(self, command=None):
+        self.command = command or stream_player_command()
+        if self.command is None:
+            raise RuntimeError("No streaming audio player found (install ffmpeg or mpg123)")
+        self._proc = None
+
+    def write(self, chunk):
+        if self._proc is None:
+            self._proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._proc.stdin.write(chunk)
+
+    def close(self):
+        """Signals end of audio and waits for playback to finish."""
+        proc = self._proc
+        if proc is not None:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            proc.wait()
+            self._proc = None
+
+    def abort(self):
+        """Stops playback immediately, dropping whatever the player still has buffered."""
+        proc = self._proc
+        if proc is not None:
+            proc.kill()
+
+
+def pcm_params(rate):
+    """Deepgram query parameters for raw 16-bit mono PCM at `rate` (no container, nothing to decode)."""
+    return {"encoding": "linear16", "sample_rate": rate, "container": "none"}
+
+
+def pcm_output_rate(device=None):
+    """
+    Sample rate to request PCM speech at: the output device's own rate when
+    Deepgram can render it, else 48 kHz. None if there is no output device.
+    """
+    if sd is None:
+        return None
+    try:
+        rate = int(sd.query_devices(device, "output")["default_samplerate"])
+    except Exception:  # sd.PortAudioError or ValueError: no output device
+        return None
+    return rate if rate in DEEPGRAM_PCM_RATES else 48000
+
+
+class PCMSink:
+    """
+    Plays 16-bit mono PCM in-process through a sounddevice output stream:
+    no player process to spawn and nothing to decode.
+
+    Writes go into a bounded buffer that the audio callback drains, so a
+    full buffer throttles the network reader. close() waits until the
+    buffer has played; abort() silences the device at once.
+
+    Args:
+        rate: Sample rate of the PCM (request it from Deepgram with pcm_params())
+        device: sounddevice output device (None means system default)
+        max_buffered: Seconds of audio held before write() blocks
+    """
+
+    def __init__(self, rate, device=None, max_buffered=1.0):
+        if sd is None:
+            raise RuntimeError("sounddevice is not available for in-process playback")
+        self.rate = rate
+        self.device = device
+        self.max_bytes = int(rate * 2 * max_buffered)
+        self.frames_played = 0
+        self._buffer = bytearray()
+        self._carry = b""
+        self._cond = threading.Condition()
+        self._stream_lock = threading.Lock()
+        self._stream = None
+        self._aborted = False
+
+    @property
+    def seconds_played(self):
+        return self.frames_played / self.rate
+
+    def _callback(self, outdata, frame_count, time_info, status):
+        wanted = len(outdata)
+        with self._cond:
+            n = min(wanted, len(self._buffer))
+            outdata[:n] = self._buffer[:n]
+            del self._buffer[:n]
+            self._cond.notify_all()
+        if n < wanted:
+            outdata[n:] = b"\x00" * (wanted - n)  # underrun: silence until more arrives
+        self.frames_played += n // 2
+
+    def write(self, chunk):
+        data = self._carry + chunk
+        usable = len(data) - len(data) % 2  # a sample can be split across network chunks
+        self._carry = data[usable:]
+        with self._cond:
+            while len(self._buffer) >= self.max_bytes and not self._aborted:
+                self._cond.wait(0.1)
+            if self._aborted:
+                return
+            self._buffer += data[:usable]
+        with self._stream_lock:
+            if self._stream is None and not self._aborted:
+                # Opened on the first audio, so the device doesn't play leading silence
+                self._stream = sd.RawOutputStream(samplerate=self.rate, channels=1, dtype="int16",
+                                                  device=self.device, callback=self._callback)
+                self._stream.start()
+
+    def close(self):
+        """Waits for buffered audio to finish playing, then releases the device."""
+        with self._cond:
+            while self._buffer and not self._aborted:
+                self._cond.wait(0.1)
+        with self._stream_lock:
+            stream, self._stream = self._stream, None
+            if stream is not None:
+                if not self._aborted:
+                    time.sleep(stream.latency)  # the last block is still in the device
+                stream.stop()
+                stream.close()
+
+    def abort(self):
+        """Stops playback immediately, dropping buffered audio."""
+        with self._cond:
+            self._aborted = True
+            self._buffer.clear()
+            self._cond.notify_all()
+        with self._stream_lock:
+            stream, self._stream = self._stream, None
+            if stream is not None:
+                stream.abort()
+                stream.close()
+
+
+def player_options(pcm_rate=None):
+    """
+    play_stream() arguments for the configured playback: an in-process
+    PCMSink when `pcm_rate` is set, otherwise the external MP3 player.
+    """
+    if pcm_rate is None:
+        return {}
+    return {"sink": PCMSink(pcm_rate), "bytes_per_second": pcm_rate * 2}
+
+
+def play_stream(response, sink=None, chunk_size=4096, jitter_ms=150,
+                bytes_per_second=6000, max_buffered=32, interrupt=None, on_start=None, keep_open=False):
+    """
+    Plays a streaming TTS response, starting on the first chunks.
+
+    A reader thread pulls chunks off the network into a bounded queue, so a
+    slow sink pushes back on the download instead of buffering without
+    limit. Playback starts once `jitter_ms` of audio is buffered (or the
+    response ends), which absorbs network jitter without waiting for the
+    whole clip.
+
+    Args:
+        response: Streaming response from open_deepgram_stream()
+        sink: Object with write(chunk) and close(); defaults to a PlayerSink
+        chunk_size: Bytes per network read
+        jitter_ms: Milliseconds of audio to buffer before playback starts
+        bytes_per_second: Audio byte rate (Deepgram's default MP3 is 48 kbps)
+        max_buffered: Maximum chunks held between network and sink
+        interrupt: Optional threading.Event; once set, playback and the
+            download stop at once (barge-in) and the sink is aborted
+        on_start: Optional callback run when the first audio goes to the sink
+        keep_open: Leave the sink open (and playing) after the response, for
+            the next one to follow without a gap (see TurnPlayer)
+
+    Returns:
+        Number of audio bytes played
+    """
+    if response is None:
+        return 0
+    sink = sink or PlayerSink()
+    chunks = queue.Queue(maxsize=max_buffered)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        # Waits for room in the queue unless playback was abandoned
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read():
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if stop.is_set():
+                    break
+                if chunk:
+                    put(chunk)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            response.close()
+            put(_DONE)
+
+    def watch():
+        # Barge-in: cut the player off mid-clip instead of letting it drain
+        while not stop.is_set():
+            if interrupt.wait(0.05):
+                stop.set()
+                getattr(sink, "abort", sink.close)()
+                return
+
+    threading.Thread(target=read, daemon=True).start()
+    if interrupt is not None:
+        threading.Thread(target=watch, daemon=True).start()
+
+    prebuffer = int(bytes_per_second * jitter_ms / 1000)
+    pending = []
+    buffered = 0
+    played = 0
+    closed = False
+    try:
+        while not stop.is_set():
+            try:
+                chunk = chunks.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if chunk is _DONE:
+                break
+            if pending is not None:
+                # Jitter buffer: hold audio until enough has arrived
+                pending.append(chunk)
+                buffered += len(chunk)
+                if buffered < prebuffer:
+                    continue
+                chunk = b"".join(pending)
+                pending = None
+                if on_start:
+                    on_start()
+            sink.write(chunk)
+            played += len(chunk)
+        if pending and not stop.is_set():
+            if on_start:
+                on_start()
+            sink.write(b"".join(pending))
+            played += buffered
+        if not stop.is_set():
+            if not keep_open:
+                sink.close()  # waits for the player to drain (still interruptible)
+            closed = True
+    except (BrokenPipeError, ValueError, OSError):
+        if interrupt is None or not interrupt.is_set():
+            raise  # the sink only fails on purpose when it was aborted
+    finally:
+        interrupted = interrupt is not None and interrupt.is_set()
+        stop.set()
+        if interrupted:
+            getattr(sink, "abort", sink.close)()
+        elif not closed:
+            sink.close()
+
+    if errors and not interrupted:
+        raise errors[0]
+    return played
+
+
+class TurnPlayer:
+    """
+    Plays all the sentences of a turn through one sink: the output device
+    (or player process) is opened on the first sentence and kept until
+    close() at the end of the turn, instead of once per sentence.
+
+    Args:
+        pcm_rate: As for player_options()
+    """
+
+    def __init__(self, pcm_rate=None):
+        self.pcm_rate = pcm_rate
+        self._options = None
+        self._lock = threading.Lock()
+
+    def play(self, response, **kwargs):
+        """play_stream() into the turn's sink, which stays open afterwards."""
+        with self._lock:
+            if self._options is None:
+                self._options = player_options(self.pcm_rate)
+                if "sink" not in self._options:
+                    self._options["sink"] = PlayerSink()
+            options = self._options
+        return play_stream(response, keep_open=True, **options, **kwargs)
+
+    def close(self, interrupt=None):
+        """
+        Waits for the turn's audio to finish playing and releases the sink.
+        Once `interrupt` (a threading.Event) is set, playback stops at once.
+        """
+        with self._lock:
+            options, self._options = self._options, None
+        if options is None:
+            return
+        sink = options["sink"]
+        done = threading.Event()
+
+        def watch():
+            while not done.is_set():
+                if interrupt.wait(0.05):
+                    getattr(sink, "abort", sink.close)()
+                    return
+
+        if interrupt is not None:
+            threading.Thread(target=watch, daemon=True).start()
+        try:
+            sink.close()
+        except (BrokenPipeError, ValueError, OSError):
+            if interrupt is None or not interrupt.is_set():
+                raise
+        finally:
+            done.set()
@@ -0,0 +1,182 @@
+import os
+import hashlib
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "talkybuddy", "tts")
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """Canonical form of a phrase for cache keys (Unicode NFC, collapsed whitespace)."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text, model, encoding):
+    """Content address of a synthesized clip: hash of (normalized text, voice model, encoding)."""
+    raw = "\x00".join([normalize_text(text), model, encoding])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Two-tier cache of synthesized speech.
+
+    Recent clips are kept in memory (LRU by count); all clips are stored on
+    disk under their content hash, with least-recently-used files evicted
+    once the directory grows past `max_bytes`. Access order on disk is the
+    file mtime, which is refreshed on every hit. Files are written
+    atomically, so several processes can share one directory.
+
+    Args:
+        directory: Cache directory (created if missing)
+        max_bytes: Size limit for the disk tier
+        memory_items: Number of clips kept in the in-memory tier
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=200 * 1024 * 1024, memory_items=64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._disk_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key, encoding):
+        return os.path.join(self.directory, key[:2], f"{key}.{encoding}")
+
+    def _entries(self):
+        """Yields (path, size, mtime) for every cached file."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith("."):
+                    continue  # partial write of another process
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _remember(self, key, audio):
+        self._memory[key] = audio
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read(self, key, encoding):
+        """Returns (audio or None, whether it came from memory), without counting a lookup."""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                return audio, True
+
+        path = self._path(key, encoding)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None, False
+
+        with self._lock:
+            self._remember(key, audio)
+        return audio, False
+
+    def get(self, text, model, encoding="mp3"):
+        """Returns cached audio bytes, or None on a miss."""
+        audio, in_memory = self._read(cache_key(text, model, encoding), encoding)
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.memory_hits += in_memory
+        return audio
+
+    def find(self, text, model, encodings):
+        """
+        Returns (encoding, audio) for the first of `encodings` cached for a
+        phrase, or (None, None). Used to transcode instead of re-synthesizing;
+        not counted in the hit statistics.
+        """
+        for encoding in encodings:
+            audio, _ = self._read(cache_key(text, model, encoding), encoding)
+            if audio is not None:
+                return encoding, audio
+        return None, None
+
+    def put(self, text, model, audio, encoding="mp3"):
+        """Stores audio bytes for a phrase and evicts old clips if over the size limit."""
+        if not audio:
+            return
+        key = cache_key(text, model, encoding)
+        path = self._path(key, encoding)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        existed = os.path.exists(path)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._remember(key, audio)
+            if not existed:
+                self._disk_bytes += len(audio)
+            over = self._disk_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Deletes least-recently-used files until the disk tier fits in max_bytes."""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already evicted by another process
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def get_or_synthesize(self, text, model, synthesize, encoding="mp3"):
+        """Returns cached audio, or calls synthesize(text) and caches its result."""
+        audio = self.get(text, model, encoding)
+        if audio is None:
+            audio = synthesize(text)
+            if audio:
+                self.put(text, model, audio, encoding)
+        return audio
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_bytes": self._disk_bytes,
+                "memory_items": len(self._memory),
+            }
+
+
+def get_tts_cache(directory=DEFAULT_CACHE_DIR, max_mb=200):
+    """Returns the process-wide TTSCache, created on first use (shared by all Streamlit sessions)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = TTSCache(directory, max_bytes=int(max_mb * 1024 * 1024))
+        return _shared
@@ -0,0 +1,143 @@
+import io
+import numpy as np
+from audio_format import as_mono_float32, resample
+from tts import fetch_deepgram_tts, audio_format_key, pcm_params, DEEPGRAM_PCM_RATES
+
+# Delivery formats: Deepgram query parameters, MIME type, file extension and bitrate (kbps)
+FORMATS = {
+    "wav": {"params": {"encoding": "linear16", "sample_rate": 24000, "container": "wav"},
+            "mime": "audio/wav", "ext": "wav", "kbps": 384},
+    "mp3": {"params": {}, "mime": "audio/mpeg", "ext": "mp3", "kbps": 48},  # Deepgram's default
+    "mp3-32": {"params": {"encoding": "mp3", "bit_rate": 32000}, "mime": "audio/mpeg", "ext": "mp3", "kbps": 32},
+    "opus-24": {"params": {"encoding": "opus", "bit_rate": 24000}, "mime": "audio/ogg", "ext": "ogg", "kbps": 24},
+    "opus-12": {"params": {"encoding": "opus", "bit_rate": 12000}, "mime": "audio/ogg", "ext": "ogg", "kbps": 12},
+}
+
+# Cached encodings a clip can be transcoded from, lossless first
+_SOURCES = ([audio_format_key(pcm_params(rate)) for rate in DEEPGRAM_PCM_RATES] +
+            [audio_format_key(FORMATS[name]["params"]) for name in ("wav", "mp3", "mp3-32", "opus-24", "opus-12")])
+_RAW_RATES = {audio_format_key(pcm_params(rate)): rate for rate in DEEPGRAM_PCM_RATES}
+_OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def browser_formats(user_agent=""):
+    """
+    Formats a browser can play. Safari and every iOS browser (all WebKit)
+    can't be relied on for Ogg Opus, so they get MP3/WAV only.
+    """
+    webkit_only = "iPhone" in user_agent or "iPad" in user_agent or (
+        "Safari" in user_agent and not any(name in user_agent for name in ("Chrome", "Chromium", "Android")))
+    return [name for name, fmt in FORMATS.items() if not (webkit_only and fmt["ext"] == "ogg")]
+
+
+def negotiate(preferred, playable=None, bandwidth_kbps=None, margin=4.0):
+    """
+    Picks the delivery format for a client.
+
+    Takes the first of `preferred` the client can play whose bitrate leaves
+    the link `margin` times faster than playback (so a clip arrives well
+    before it would finish playing). Without a bandwidth estimate that's the
+    first playable preference; if none fits, the smallest playable one.
+
+    Args:
+        preferred: Format names (see FORMATS), best first
+        playable: Formats the client supports (None means all)
+        bandwidth_kbps: Estimated link bandwidth for this client
+        margin: How much faster than real time delivery should be
+    """
+    candidates = [name for name in preferred if name in FORMATS and (playable is None or name in playable)]
+    if not candidates:
+        return "mp3"
+    if bandwidth_kbps is None:
+        return candidates[0]
+    for name in candidates:
+        if FORMATS[name]["kbps"] * margin <= bandwidth_kbps:
+            return name
+    return min(candidates, key=lambda name: FORMATS[name]["kbps"])
+
+
+def _decode(audio, encoding):
+    import soundfile as sf
+    if encoding in _RAW_RATES:
+        return np.frombuffer(audio, dtype="<i2").astype(np.float32) / 32768.0, _RAW_RATES[encoding]
+    samples, rate = sf.read(io.BytesIO(audio), dtype="float32")
+    return as_mono_float32(samples), rate
+
+
+def _encode(samples, rate, name):
+    import soundfile as sf
+    fmt = FORMATS[name]
+    out = io.BytesIO()
+    if fmt["ext"] == "ogg":
+        if rate not in _OPUS_RATES:
+            samples, rate = resample(samples, rate, 24000), 24000
+        # libsndfile maps compression level 0..1 linearly onto 256..6 kbps
+        level = min(0.99, max(0.0, 1 - (fmt["params"]["bit_rate"] - 6000) / 250000))
+        sf.write(out, samples, rate, format="OGG", subtype="OPUS", compression_level=level)
+    elif fmt["ext"] == "wav":
+        target = fmt["params"]["sample_rate"]
+        sf.write(out, resample(samples, rate, target), target, format="WAV", subtype="PCM_16")
+    else:
+        raise ValueError(f"Can't encode {name} locally")
+    return out.getvalue()
+
+
+def transcode(audio, source_encoding, name):
+    """
+    Re-encodes a cached clip (any encoding in the TTS cache) into format `name`.
+    Only Opus and WAV can be produced locally; raises ValueError for other targets.
+    """
+    return _encode(*_decode(audio, source_encoding), name)
+
+
+def join_clips(clips, name):
+    """
+    Joins per-sentence clips in format `name` into one clip (None if there are none).
+    MP3 frames are simply concatenated; Opus and WAV files are decoded and
+    encoded again as one file.
+    """
+    clips = [clip for clip in clips if clip]
+    if len(clips) <= 1:
+        return clips[0] if clips else None
+    if FORMATS[name]["ext"] == "mp3":
+        return b"".join(clips)
+    encoding = audio_format_key(FORMATS[name]["params"])
+    decoded = [_decode(clip, encoding) for clip in clips]
+    rate = decoded[0][1]
+    return _encode(np.concatenate([resample(samples, r, rate) for samples, r in decoded]), rate, name)
+
+
+def transcode_cached(text, model, name, cache):
+    """
+    Produces format `name` of a phrase from another format already in the
+    cache (no Deepgram request), stores it and returns it; None if nothing
+    usable is cached.
+    """
+    if cache is None or FORMATS[name]["ext"] not in ("ogg", "wav"):
+        return None
+    target = audio_format_key(FORMATS[name]["params"])
+    source, audio = cache.find(text, model, [e for e in _SOURCES if e != target])
+    if audio is None:
+        return None
+    try:
+        converted = transcode(audio, source, name)
+    except Exception as e:  # old libsndfile without Opus/MP3, or a damaged clip
+        print(f"⚠️  Transcoding {source} → {name} failed: {e}")
+        return None
+    cache.put(text, model, converted, target)
+    return converted
+
+
+def get_speech(text, api_key, name="mp3", model="aura-asteria-en", cache=None):
+    """
+    Returns a phrase's speech in format `name`: from the cache, transcoded
+    from another cached format, or synthesized by Deepgram. None on error.
+    """
+    params = FORMATS[name]["params"]
+    if cache is None:
+        return fetch_deepgram_tts(text, api_key, model=model, **params)
+    audio = cache.get(text, model, audio_format_key(params)) or transcode_cached(text, model, name, cache)
+    if audio is None:
+        audio = fetch_deepgram_tts(text, api_key, model=model, **params)
+        cache.put(text, model, audio, audio_format_key(params))
+    return audio
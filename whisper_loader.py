@@ -0,0 +1,71 @@
+import threading
+from stt_backends import load_backend, warm_up
+
+
+class WhisperLoader:
+    """
+    Loads a Whisper STT backend (see stt_backends) on a background thread.
+
+    The engine's heavy imports (whisper pulls in torch) only happen inside
+    that thread, so startup isn't blocked and text-only paths never pay for
+    them. An optional warm-up transcription of a second of silence primes
+    the kernels, so the first real turn isn't the slow one.
+
+    Args:
+        name: Whisper model size ("tiny", "base", ...)
+        warmup: Run one dummy transcription after loading
+        on_done: Optional callback receiving the loader once loading finished or failed
+        engine: STT engine passed to load_backend() ("whisper", "faster-whisper", "api")
+        **options: Extra arguments for the backend (client, compute_type, ...)
+    """
+
+    def __init__(self, name="base", warmup=True, on_done=None, engine="whisper", **options):
+        self.name = name
+        self.warmup = warmup
+        self.on_done = on_done
+        self.engine = engine
+        self.options = options
+        self.model = None
+        self.error = None
+        self._done = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts loading (only the first call does anything)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, daemon=True)
+                self._thread.start()
+        return self
+
+    def _load(self):
+        try:
+            model = load_backend(self.engine, self.name, **self.options)
+            if self.warmup:
+                warm_up(model)
+            self.model = model
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+            if self.on_done:
+                self.on_done(self)
+
+    @property
+    def ready(self):
+        return self.model is not None
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        """
+        Returns the model, waiting up to `timeout` seconds for it (None waits
+        until loading finishes, 0 doesn't wait). Returns None if the model
+        isn't available (yet).
+        """
+        self.start()
+        self._done.wait(timeout)
+        return self.model
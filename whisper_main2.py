@@ -1,9 +1,21 @@
 import os
-import requests
 import json
-from openai import OpenAI
+import asyncio
+import tempfile
+from http_clients import get_openai_client, get_session, prewarm, configure_pools
 import sounddevice as sd
 import soundfile as sf
+import numpy as np
+from audio_utils import record_until_silence, get_input_device
+from audio_format import as_mono_float32
+from stt_backends import APIBackend, ServerBackend
+from reply_stream import reply_sentences
+from pipeline import Pipeline, Stage
+from conversation_memory import ConversationMemory, openai_summarizer
+from tts import (open_deepgram_stream, TurnPlayer, stream_player_command,
+                 pcm_output_rate, pcm_params)
+from tts_cache import get_tts_cache, DEFAULT_CACHE_DIR
+from tracing import tracer_from_config
 
 # Load credentials from config.json
 def load_config():
@@ -17,74 +29,156 @@ def load_config():
 config = load_config()
 OPENAI_KEY = config["openai_api_key"]
 DEEPGRAM_KEY = config["deepgram_api_key"]
+# Speak each sentence as soon as it is generated instead of waiting for the whole reply
+STREAM_REPLIES = config.get("stream_replies", True)
+# Prompt-size ceiling per turn; older turns are folded into a rolling summary
+MAX_PROMPT_TOKENS = config.get("max_prompt_tokens", 1500)
+# Play speech in-process as raw PCM at the output device's rate: no player process, no MP3 decoding
+PCM_RATE = pcm_output_rate() if config.get("stream_tts", True) and config.get("pcm_playback", True) else None
+TTS_FORMAT = pcm_params(PCM_RATE) if PCM_RATE else {}
+# Start playback on the first TTS bytes (in-process, or ffplay/mpg123 reading MP3 from a pipe)
+STREAM_TTS = config.get("stream_tts", True) and (PCM_RATE is not None or stream_player_command() is not None)
+# One output stream per turn: the sentences of a reply play back to back
+player = TurnPlayer(PCM_RATE)
+# Milliseconds of speech buffered before playback starts: more rides out network jitter, less starts sooner
+TTS_JITTER_MS = config.get("tts_jitter_ms", 150)
+# Repeated phrases ("Great job!") are served from disk instead of Deepgram
+tts_cache = get_tts_cache(config.get("tts_cache_dir", DEFAULT_CACHE_DIR), config.get("tts_cache_mb", 200))
+# Per-turn stage timings: "trace_file" (JSONL) and/or "metrics_port" (Prometheus) turn it on
+tracer = tracer_from_config(config)
 
-client = OpenAI(api_key=OPENAI_KEY)
+# Shared keep-alive clients: TLS handshakes are paid once, not every turn
+configure_pools(config.get("http_pool_sizes", {}))
+client = get_openai_client(OPENAI_KEY)
+# Hosted whisper-1 transcription (no local model needed), or the classroom speech server
+if config.get("stt_engine") == "server":
+    stt = ServerBackend(**config.get("stt_options", {}))
+else:
+    stt = APIBackend(client)
 
-def record_audio(filename="input.wav", duration=10, rate=16000):
-    """Records audio from microphone (cross-platform)"""
+def record_audio(filename=None, duration=10, rate=16000, endpointing=True):
+    """Records audio from microphone (cross-platform), stopping on silence when endpointing.
+    Returns a mono float32 array; also saves to filename if given."""
     print("Recording...")
     try:
-        # Find the first input device with input channels
-        devices = sd.query_devices()
-        input_device = None
-        for i, device in enumerate(devices):
-            if device['max_input_channels'] > 0:
-                input_device = i
-                print(f"Using input device: {device['name']}")
-                break
-        
-        if input_device is None:
+        # Find the first input device with input channels (cached for the session)
+        found = get_input_device()
+        if found is None:
             print("No input device found! Available devices:")
-            print(devices)
-            return
+            print(sd.query_devices())
+            return None
+        input_device, name = found
+        print(f"Using input device: {name}")
         
-        audio = sd.rec(int(duration * rate), samplerate=rate, channels=1, dtype='float32', device=input_device)
-        sd.wait()
-        sf.write(filename, audio, rate)
-        print("Recording saved!")
+        if endpointing:
+            audio = record_until_silence(rate=rate, max_duration=duration, device=input_device)
+            if audio.size == 0:
+                audio = np.zeros(rate // 10, dtype=np.float32)
+        else:
+            audio = sd.rec(int(duration * rate), samplerate=rate, channels=1, dtype='float32', device=input_device)
+            sd.wait()
+        if filename:
+            sf.write(filename, audio, rate)
+        print("Recording done!")
+        return as_mono_float32(audio)
     except Exception as e:
         print(f"Recording error: {e}")
+        return None
 
-def transcribe_audio(filename="input.wav"):
-    """Converts speech to text using Whisper"""
-    with open(filename, "rb") as f:
-        transcript = client.audio.transcriptions.create(model="whisper-1", file=f)
-    return transcript.text
+def transcribe_audio(audio, rate=16000):
+    """Converts 16 kHz speech to text using Whisper (uploads an in-memory WAV, no temp file)"""
+    if audio is None or len(audio) == 0:
+        return ""
+    return stt.transcribe(audio)["text"]
 
-def get_deepgram_tts(text, filename="output.mp3"):
-    """Uses Deepgram's Aura-2 for 5x cheaper speech than OpenAI"""
-    url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
-    headers = {
-        "Authorization": f"Token {DEEPGRAM_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {"text": text}
+def get_deepgram_tts(text, filename=None):
+    """Uses Deepgram's Aura-2 for 5x cheaper speech than OpenAI. Returns the MP3 path or None."""
+    audio = tts_cache.get(text, "aura-asteria-en")
+    if audio is None:
+        url = "https://api.deepgram.com/v1/speak?model=aura-asteria-en"
+        headers = {
+            "Authorization": f"Token {DEEPGRAM_KEY}",
+            "Content-Type": "application/json"
+        }
+        payload = {"text": text}
+        
+        response = get_session().post(url, headers=headers, json=payload, timeout=30)
+        if response.status_code != 200:
+            return None
+        audio = response.content
+        tts_cache.put(text, "aura-asteria-en", audio)
     
-    response = requests.post(url, headers=headers, json=payload)
-    if response.status_code == 200:
-        with open(filename, "wb") as f:
-            f.write(response.content)
-        return True
-    return False
+    if filename is None:
+        # Unique file per reply so concurrent sessions don't collide
+        fd, filename = tempfile.mkstemp(prefix="talkybuddy_", suffix=".mp3")
+        os.close(fd)
+    with open(filename, "wb") as f:
+        f.write(audio)
+    return filename
+
+def play_speech(speech_file):
+    """Plays a synthesized reply (macOS afplay) and deletes the temp file."""
+    os.system(f'afplay "{speech_file}"')
+    os.remove(speech_file)
+
+def synthesize(text):
+    """Starts speech for a reply or sentence: a streaming response, or a saved MP3 path."""
+    trace = tracer.current
+    trace.count("tts_chars", len(text))
+    with trace.span("tts") as span:
+        if not STREAM_TTS:
+            return get_deepgram_tts(text)
+        response = open_deepgram_stream(text, DEEPGRAM_KEY, cache=tts_cache, **TTS_FORMAT)
+        span.first("tts_first_byte")
+        return response
+
+def play(speech):
+    """Plays whatever synthesize() returned."""
+    trace = tracer.current
+    if STREAM_TTS:
+        player.play(speech, jitter_ms=TTS_JITTER_MS, on_start=lambda: trace.mark("playback_start"))
+    else:
+        trace.mark("playback_start")
+        play_speech(speech)
 
 def chat_loop():
-    messages = [{"role": "system", "content": "You are a friendly teacher. Speak simply."}]
+    memory = ConversationMemory("You are a friendly teacher. Speak simply.",
+                                max_prompt_tokens=MAX_PROMPT_TOKENS, summarize=openai_summarizer(client))
     
-    while True:
+    def listen(_):
         print("🎤 Listening...")
-        record_audio()
-        user_input = transcribe_audio()
+        prewarm()  # open API connections while the child is talking
+        trace = tracer.current
+        with trace.span("capture"):
+            audio = record_audio()
+        with trace.span("stt"):
+            return transcribe_audio(audio)
+
+    def think(user_input):
         print(f"👦 You: {user_input}")
-        
-        if user_input.lower() in ["exit", "bye"]: break
-        
-        messages.append({"role": "user", "content": user_input})
-        res = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
-        ai_text = res.choices[0].message.content
-        print(f"🤖 AI: {ai_text}")
-        
-        if get_deepgram_tts(ai_text):
-            os.system("afplay output.mp3")
+        if user_input.lower() in ["exit", "bye"]:
+            pipeline.stop()
+            return
+        print("🤖 AI: ", end="", flush=True)
+        yield from reply_sentences(client, memory, user_input, stream=STREAM_REPLIES,
+                                   on_text=lambda text: print(text, end="", flush=True), trace=tracer.current)
+        print()
+
+    async def turns():
+        while not pipeline.stopping:
+            trace = tracer.turn("whisper_main2")
+            yield None
+            await pipeline.idle()
+            await asyncio.to_thread(player.close)
+            trace.end()
+
+    pipeline = Pipeline(
+        Stage("listen", listen),
+        Stage("think", think),
+        Stage("synthesize", synthesize, workers=2),
+        Stage("play", play),
+    )
+    asyncio.run(pipeline.run(turns()))
 
 if __name__ == "__main__":
     chat_loop()